@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+"""
+Compare the fixed-slice datetime converters in ipwb.util with the
+strptime()-based converters they replace on the common path.
+
+Usage: python benchmarks/datetime_conversion.py [iterations]
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from ipwb import util  # noqa: E402
+
+CONVERSIONS = [
+    ('iso8601_to_digits14', '2018-11-26T13:42:57Z'),
+    ('digits14_to_rfc1123', '20181126134257'),
+    ('rfc1123_to_digits14', 'Mon, 26 Nov 2018 13:42:57 GMT'),
+    ('get_rfc1123_of_now', None),
+]
+
+
+def main(iterations=100000):
+    print(f'{"function":<24}{"strptime":>12}{"fast":>12}{"speedup":>10}')
+    for (name, arg) in CONVERSIONS:
+        args = () if arg is None else (arg,)
+        fast = getattr(util, name)
+        slow = getattr(util, f'strptime_{name}')
+        if arg is not None:
+            assert fast(arg) == slow(arg)
+
+        slow_time = timeit.timeit(lambda: slow(*args), number=iterations)
+        fast_time = timeit.timeit(lambda: fast(*args), number=iterations)
+
+        print(f'{name:<24}'
+              f'{slow_time / iterations * 1e6:>10.2f}us'
+              f'{fast_time / iterations * 1e6:>10.2f}us'
+              f'{slow_time / fast_time:>9.1f}x')
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
@@ -8,7 +8,10 @@ import tempfile
 from multiaddr import Multiaddr
 from multiaddr import exceptions as multiaddr_exceptions
 # ipwb modules
-from ipwb import settings, replay, indexer, util
+from ipwb import (
+    settings, replay, indexer, ingest, util, cdxj, cid_cache, compression,
+    record_filter, unixfs)
+from ipwb.content_store import content_store
 from ipwb.error_handler import exception_logger
 from ipwb.__init__ import __version__ as ipwb_version
 
@@ -18,7 +21,8 @@ def main():
     check_args(sys.argv)
 
 
-def check_args_index(args):
+def configure_content_store(args):
+    """Set up the IPFS daemon or local store content is pushed to"""
     # args.daemon_address is always set. Either default or by CLI
     try:
         # see if it parses
@@ -27,19 +31,88 @@ def check_args_index(args):
         print("Daemon address cannot be parsed")
         raise e
     settings.App.set("ipfsapi", str(daemon))
+    settings.App.set("ipfs_concurrency", args.ipfs_concurrency)
+
+    if args.store:
+        settings.App.set("store", args.store)
+        os.makedirs(args.store, exist_ok=True)
+    elif args.ipfs_concurrency:
+        content_store().check_available()
+    else:
+        util.check_daemon_is_alive()
+
+
+def check_args_index(args):
+    configure_content_store(args)
+
+    # The daemon's defaults are used unless some option of `ipfs add` is set
+    add_options = None
+    if args.cid_version is not None or args.raw_leaves or args.chunker or \
+            not args.pin or args.hash:
+        add_options = unixfs.resolve_add_options(
+            args.cid_version, args.raw_leaves, args.chunker, args.hash,
+            args.pin)
+    settings.App.set("ipfs_add_options", add_options)
+
+    cid_cache_path = args.cid_cache_path
+    if args.cid_cache and cid_cache_path is None:
+        cid_cache_path = cid_cache.default_cid_cache_path()
 
-    util.check_daemon_is_alive()
+    # Unpinned content may be garbage collected while cached as added
+    if not args.pin and cid_cache_path:
+        raise ValueError('--no-pin cannot be used with --cid-cache')
 
     enc_key = None
     compression_level = None
     if args.e:
         enc_key = ''
-    if args.c:
-        compression_level = 6  # Magic 6, TA-DA!
+
+    # Choosing a codec, level or dictionary implies compression
+    codec = args.codec or (
+        compression.ZSTD if args.dictionary else compression.ZLIB)
+    if args.c or args.codec or args.compression_level is not None or \
+            args.dictionary:
+        compression_level = compression.check_level(
+            compression.CODECS[codec], args.compression_level)
+        if args.dictionary and codec != compression.ZSTD:
+            raise ValueError('Only zstd compression uses a dictionary')
+        if codec == compression.ZSTD:
+            compression.require_zstandard()
 
     indexer.index_file_at(args.warc_path, enc_key, compression_level,
                           args.compressFirst, outfile=args.outfile,
-                          debug=args.debug)
+                          debug=args.debug, jobs=args.jobs,
+                          batch_size=args.batch_size,
+                          batch_bytes=args.batch_bytes,
+                          processes=args.processes,
+                          memory_budget=args.sort_memory * 1024 ** 2,
+                          cid_cache_path=cid_cache_path,
+                          stream_threshold=args.stream_threshold * 1024 ** 2,
+                          titles=args.titles, resume=args.resume,
+                          compression_codec=codec,
+                          compression_dictionary_path=args.dictionary,
+                          header_templates=args.header_templates,
+                          stats_json=args.stats_json, shards=args.shards,
+                          split_warcs=args.split,
+                          cdx_offsets_path=args.offsets,
+                          include=args.include, exclude=args.exclude,
+                          stream=args.stream)
+
+
+def check_args_ingest(args):
+    configure_content_store(args)
+    ingest.ingest(args.watch, args.index, processes=args.processes,
+                  poll_seconds=args.poll_seconds,
+                  settle_seconds=args.settle_seconds,
+                  batch_warcs=args.batch_warcs,
+                  batch_seconds=args.batch_seconds, once=args.once,
+                  jobs=args.jobs, cid_cache_path=args.cid_cache)
+
+
+def check_args_sort(args):
+    indexer.sort_cdxj_files(args.cdxj_paths, outfile=args.outfile,
+                            memory_budget=args.sort_memory * 1024 ** 2,
+                            shards=args.shards)
 
 
 def check_args_replay(args):
@@ -75,6 +148,8 @@ def check_args_replay(args):
         print("Daemon address cannot be parsed")
         raise e
     settings.App.set("ipfsapi", str(daemon))
+    settings.App.set("store", args.store)
+    settings.App.set("ipfs_concurrency", args.ipfs_concurrency)
 
     port = replay.IPWBREPLAY_PORT
     if hasattr(args, 'port') and args.port is not None:
@@ -93,6 +168,27 @@ def check_args_replay(args):
         sys.exit()
 
 
+def positive_int(value):
+    """Argument type for options that require a count of at least one"""
+    try:
+        count = int(value)
+    except ValueError:
+        count = 0
+
+    if count < 1:
+        raise argparse.ArgumentTypeError(
+            f'{value} is not a positive integer')
+    return count
+
+
+def record_filter_arg(value):
+    """Argument type for --include and --exclude"""
+    try:
+        return record_filter.parse_filter(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
 def check_args(args_in):
     """
     Check to ensure valid arguments were passed in and provides guidance
@@ -112,7 +208,7 @@ def check_args(args_in):
         help="Index a WARC file for replay in ipwb")
     index_parser.add_argument(
         'warc_path',
-        help="Path to a WARC[.gz] file",
+        help="Path to a WARC[.gz] file, - to read one from STDIN",
         metavar="index <warc_path>",
         nargs='+',
         default=None)
@@ -126,6 +222,26 @@ def check_args(args_in):
         help='Compress WARC content prior to adding to IPFS',
         action='store_true',
         default=False)
+    index_parser.add_argument(
+        '--codec',
+        help=('Compress WARC content with this codec (default zlib, or '
+              'zstd with --dictionary), zstd needs the zstandard package'),
+        choices=sorted(compression.CODECS),
+        default=None)
+    index_parser.add_argument(
+        '--compression-level',
+        help=('Compression level, 0-9 for zlib (default 6) and 1-22 for '
+              'zstd (default 3)'),
+        metavar='LEVEL',
+        type=int,
+        default=None)
+    index_parser.add_argument(
+        '--dictionary',
+        help=('Compress with the zstd dictionary in PATH. If there is none, '
+              'one is trained on the HTTP headers and small HTML payloads '
+              'of the WARCs and written to PATH'),
+        metavar='PATH',
+        default=None)
     index_parser.add_argument(
         '--compressFirst',
         help='Compress data before encryption, where applicable',
@@ -135,6 +251,147 @@ def check_args(args_in):
         '-o', '--outfile',
         help='Path to an output CDXJ file, defaults to STDOUT',
         default=None)
+    index_parser.add_argument(
+        '--stream',
+        help=('Write each CDXJ line as soon as its record is pushed, '
+              'unsorted, for `ipwb sort` to sort later'),
+        action='store_true')
+    index_parser.add_argument(
+        '--shards',
+        help=('Split the index into N files by SURT key, the outfile '
+              'becoming a manifest of their first keys'),
+        metavar='N',
+        type=positive_int,
+        default=None)
+    index_parser.add_argument(
+        '-j', '--jobs',
+        help='Number of records to push to IPFS concurrently (default 1)',
+        type=positive_int,
+        default=1)
+    index_parser.add_argument(
+        '--batch-size',
+        help=('Maximum number of objects to add to IPFS per request '
+              '(default 1, no batching)'),
+        type=positive_int,
+        default=1)
+    index_parser.add_argument(
+        '--batch-bytes',
+        help=('Maximum number of bytes to add to IPFS per batched request '
+              f'(default {indexer.DEFAULT_BATCH_BYTES})'),
+        type=positive_int,
+        default=indexer.DEFAULT_BATCH_BYTES)
+    index_parser.add_argument(
+        '--processes',
+        help='Number of WARC files to index in parallel (default 1)',
+        type=positive_int,
+        default=1)
+    index_parser.add_argument(
+        '--split',
+        help=('Also split .warc.gz files gzipped a record per member into '
+              'byte ranges indexed in parallel by the --processes'),
+        action='store_true')
+    index_parser.add_argument(
+        '--offsets',
+        help=('CDX or CDXJ index of the WARCs to take the record offsets '
+              'for --split from, instead of scanning for gzip members'),
+        metavar='CDX',
+        default=None)
+    index_parser.add_argument(
+        '--sort-memory',
+        help=('Megabytes of CDXJ lines to sort in memory before spilling '
+              'sorted runs to temporary files (default '
+              f'{cdxj.DEFAULT_SORT_MEMORY // 1024 ** 2})'),
+        metavar='MB',
+        type=positive_int,
+        default=cdxj.DEFAULT_SORT_MEMORY // 1024 ** 2)
+    index_parser.add_argument(
+        '--cid-cache',
+        help=('Skip adding content that was added to IPFS before, as '
+              'recorded in a cache file'),
+        action='store_true')
+    index_parser.add_argument(
+        '--cid-cache-path',
+        help=('Cache file of --cid-cache, which it implies (default '
+              f'{os.path.join("$IPFS_PATH", cid_cache.CID_CACHE_FILENAME)})'),
+        metavar='PATH',
+        default=None)
+    index_parser.add_argument(
+        '--stream-threshold',
+        help=('Stream payloads of records larger than this many megabytes '
+              'to IPFS in chunks rather than reading them into memory '
+              f'(default {indexer.DEFAULT_STREAM_THRESHOLD // 1024 ** 2})'),
+        metavar='MB',
+        type=positive_int,
+        default=indexer.DEFAULT_STREAM_THRESHOLD // 1024 ** 2)
+    index_parser.add_argument(
+        '--cid-version',
+        help=('Version of the CIDs of added content (default 0, or 1 '
+              'with a --hash other than sha2-256)'),
+        type=int,
+        choices=[0, 1],
+        default=None)
+    index_parser.add_argument(
+        '--raw-leaves',
+        help=('Add chunks of content as raw blocks rather than UnixFS '
+              'nodes (default with --cid-version 1)'),
+        action='store_true',
+        default=None)
+    index_parser.add_argument(
+        '--chunker',
+        help=('How IPFS splits content into chunks, e.g. size-1048576 '
+              f'(default {unixfs.DEFAULT_CHUNKER})'),
+        default=None)
+    index_parser.add_argument(
+        '--no-pin',
+        help=('Do not pin added content, to pin it later in bulk (not '
+              'with --cid-cache)'),
+        action='store_false',
+        dest='pin',
+        default=True)
+    index_parser.add_argument(
+        '--hash',
+        help=f'Hash function of CIDs (default {unixfs.DEFAULT_HASH})',
+        choices=list(unixfs.HASH_FUNCTIONS),
+        default=None)
+    index_parser.add_argument(
+        '--include',
+        help=('Only index records matching a filter, one of uri:REGEX, '
+              'surt:PREFIX, mime:TYPE, status:CODE (e.g. 2xx) or size:BYTES '
+              '(payloads of at most BYTES). Can be given more than once.'),
+        metavar='FILTER',
+        action='append',
+        type=record_filter_arg)
+    index_parser.add_argument(
+        '--exclude',
+        help=('Do not index records matching a filter, as for --include. '
+              'Filters are matched before payloads are read.'),
+        metavar='FILTER',
+        action='append',
+        type=record_filter_arg)
+    index_parser.add_argument(
+        '--no-titles',
+        help='Do not extract the titles of HTML pages into the index',
+        action='store_false',
+        dest='titles',
+        default=True)
+    index_parser.add_argument(
+        '--header-templates',
+        help=('Store HTTP headers as templates shared between records, '
+              'keeping the values that differ in the index'),
+        action='store_true',
+        default=False)
+    index_parser.add_argument(
+        '--resume',
+        help=('Carry on from where an interrupted run with the same '
+              'outfile stopped, rather than starting over'),
+        action='store_true',
+        default=False)
+    index_parser.add_argument(
+        '--stats-json',
+        help=('Write throughput statistics and the time spent in each '
+              'stage of indexing to PATH as JSON'),
+        metavar='PATH',
+        default=None)
     index_parser.add_argument(
         '--debug',
         help='Convenience flag to help with testing and debugging',
@@ -165,12 +422,123 @@ def check_args(args_in):
     replay_parser.set_defaults(func=check_args_replay,
                                onError=replay_parser.print_help)
 
+    sort_parser = subparsers.add_parser(
+        'sort',
+        prog="ipwb sort",
+        description="Sort and merge CDXJ files, e.g. written with --stream",
+        help="Sort and merge CDXJ files")
+    sort_parser.add_argument(
+        'cdxj_paths',
+        help='Paths of CDXJ files, - to read one from STDIN',
+        metavar='cdxj_path',
+        nargs='+')
+    sort_parser.add_argument(
+        '-o', '--outfile',
+        help=('Path of a CDXJ file to merge the sorted lines into, defaults '
+              'to STDOUT'),
+        default=None)
+    sort_parser.add_argument(
+        '--shards',
+        help='Split the outfile into N files by SURT key, as for index',
+        metavar='N',
+        type=positive_int,
+        default=None)
+    sort_parser.add_argument(
+        '--sort-memory',
+        help=('Megabytes of CDXJ lines to sort in memory before spilling '
+              'sorted runs to temporary files (default '
+              f'{cdxj.DEFAULT_SORT_MEMORY // 1024 ** 2})'),
+        metavar='MB',
+        type=positive_int,
+        default=cdxj.DEFAULT_SORT_MEMORY // 1024 ** 2)
+    sort_parser.set_defaults(func=check_args_sort)
+
+    ingest_parser = subparsers.add_parser(
+        'ingest',
+        prog="ipwb ingest",
+        description=("Index the WARCs put in a directory into an index as "
+                     "they are closed"),
+        help="Continuously index the WARCs put in a directory")
+    ingest_parser.add_argument(
+        '--watch',
+        help='Directory WARCs are put in',
+        metavar='DIR',
+        required=True)
+    ingest_parser.add_argument(
+        '--index',
+        help='CDXJ index to merge the WARCs into',
+        metavar='OUT.cdxj',
+        required=True)
+    ingest_parser.add_argument(
+        '--processes',
+        help=('Number of WARC files of a batch to index in parallel '
+              '(default 1)'),
+        type=positive_int,
+        default=1)
+    ingest_parser.add_argument(
+        '-j', '--jobs',
+        help='Number of records to push to IPFS concurrently (default 1)',
+        type=positive_int,
+        default=1)
+    ingest_parser.add_argument(
+        '--batch-warcs',
+        help=('Merge a batch once it has N WARCs (default '
+              f'{ingest.DEFAULT_BATCH_WARCS})'),
+        metavar='N',
+        type=positive_int,
+        default=ingest.DEFAULT_BATCH_WARCS)
+    ingest_parser.add_argument(
+        '--batch-seconds',
+        help=('Merge a batch once its first WARC waited this long (default '
+              f'{ingest.DEFAULT_BATCH_SECONDS})'),
+        metavar='SECONDS',
+        type=float,
+        default=ingest.DEFAULT_BATCH_SECONDS)
+    ingest_parser.add_argument(
+        '--poll-seconds',
+        help=('Seconds between looks for new WARCs (default '
+              f'{ingest.DEFAULT_POLL_SECONDS})'),
+        metavar='SECONDS',
+        type=float,
+        default=ingest.DEFAULT_POLL_SECONDS)
+    ingest_parser.add_argument(
+        '--settle-seconds',
+        help=('Seconds a WARC must go unmodified to be taken as closed '
+              f'(default {ingest.DEFAULT_SETTLE_SECONDS})'),
+        metavar='SECONDS',
+        type=float,
+        default=ingest.DEFAULT_SETTLE_SECONDS)
+    ingest_parser.add_argument(
+        '--cid-cache',
+        help=('Skip adding content that was added to IPFS before, as '
+              'recorded in a cache file'),
+        metavar='PATH',
+        default=None)
+    ingest_parser.add_argument(
+        '--once',
+        help='Index the WARCs closed by now and exit, e.g. from cron',
+        action='store_true')
+    ingest_parser.set_defaults(func=check_args_ingest)
+
     parser.add_argument(
         '-d', '--daemon',
         help=("Multi-address of IPFS daemon "
               "(default /dns/localhost/tcp/5001/http)"),
         default=settings.App.config("ipfsapi"),
         dest='daemon_address')
+    parser.add_argument(
+        '--store',
+        help=('Keep content in a local content-addressed directory rather '
+              'than in IPFS, no daemon needed'),
+        metavar='DIR',
+        default=None)
+    parser.add_argument(
+        '--ipfs-concurrency',
+        help=('Talk to the IPFS daemon with the asyncio client, with up to N '
+              'requests in flight (needs aiohttp)'),
+        metavar='N',
+        type=positive_int,
+        default=None)
     parser.add_argument(
         '-v', '--version', help='Report the version of ipwb', action='version',
         version=f'InterPlanetary Wayback {ipwb_version}')
@@ -182,8 +550,9 @@ def check_args(args_in):
     parser.set_defaults(func=util.check_for_update)
 
     arg_count = len(args_in)
-    cmd_list = ['index', 'replay']
-    base_parser_flag_list = ['-d', '--daemon', '-v', '--version',
+    cmd_list = ['index', 'replay', 'sort', 'ingest']
+    base_parser_flag_list = ['-d', '--daemon', '--store',
+                             '--ipfs-concurrency', '-v', '--version',
                              '-u', '--update-check']
 
     # Various invocation error, used to show appropriate help
@@ -0,0 +1,174 @@
+"""
+asyncio client of the IPFS HTTP API
+
+ipfshttpclient makes one request at a time per thread, so the number of
+requests in flight is bounded by the number of threads. AsyncIPFSClient
+sends requests over a shared pool of connections, with up to `concurrency`
+of them in flight at once. The client runs on an event loop in a thread of
+its own, which the indexer and replay submit coroutines to, so that they
+need not become async themselves. It needs the optional aiohttp package.
+"""
+
+import asyncio
+import atexit
+import json
+import os
+import threading
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from . import settings
+from .exceptions import IPFSAPIError
+
+# Requests in flight at once unless configured otherwise
+DEFAULT_CONCURRENCY = 64
+
+# Seconds without a response before a request fails
+REQUEST_TIMEOUT = 300
+
+
+def require_aiohttp():
+    if aiohttp is None:
+        raise ImportError(
+            'The asyncio IPFS client needs the aiohttp package, install it '
+            'with pip install ipwb[async]')
+
+
+def api_base_url(daemon_address):
+    """Return the base URL of the API at a multiaddress like the settings'"""
+    parts = daemon_address.strip('/').split('/')
+    (host, port) = (parts[1], parts[3])
+    scheme = parts[4] if len(parts) > 4 else 'http'
+    if parts[0] == 'ip6':
+        host = f'[{host}]'
+
+    return f'{scheme}://{host}:{port}/api/v0'
+
+
+class EventLoopThread:
+    """An event loop running in a daemon thread"""
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(
+            target=self.loop.run_forever, name='ipwb-ipfs', daemon=True)
+        self.thread.start()
+
+    def submit(self, coroutine):
+        """Schedule a coroutine, return a concurrent.futures.Future of it"""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def run(self, coroutine):
+        """Run a coroutine and wait for its result"""
+        return self.submit(coroutine).result()
+
+
+class AsyncIPFSClient:
+    """Client of the add, cat, pin and id endpoints of the IPFS HTTP API"""
+
+    def __init__(self, daemon_address=None, concurrency=DEFAULT_CONCURRENCY):
+        require_aiohttp()
+        self.base_url = api_base_url(
+            daemon_address or settings.App.config('ipfsapi'))
+        self.concurrency = concurrency
+        self.session = None
+
+    def get_session(self):
+        # Created lazily, sessions belong to the loop they are created in
+        if self.session is None:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.concurrency),
+                timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT))
+
+        return self.session
+
+    async def request(self, endpoint, params=None, data=None):
+        """POST to an endpoint, return the body of a successful response"""
+        url = f'{self.base_url}/{endpoint}'
+        async with self.get_session().post(
+                url, params=params, data=data) as response:
+            body = await response.read()
+            if response.status >= 400:
+                try:
+                    message = json.loads(body)['Message']
+                except (ValueError, KeyError, TypeError):
+                    message = body.decode(errors='replace')
+                raise IPFSAPIError(f'{endpoint} failed: {message}')
+
+            return body
+
+    async def add(self, *byte_strings, **params):
+        """Add byte strings in one request, return their hashes in order"""
+        form = aiohttp.FormData()
+        for (idx, bytes_in) in enumerate(byte_strings):
+            # Named by position to map the returned hashes to the inputs
+            form.add_field('file', bytes_in, filename=str(idx),
+                           content_type='application/octet-stream')
+
+        body = await self.request('add', params=params, data=form)
+        hashes = {}
+        for line in body.splitlines():
+            if line.strip():
+                entry = json.loads(line)
+                hashes[entry['Name']] = entry['Hash']
+
+        if len(hashes) != len(byte_strings):
+            raise IPFSAPIError(
+                f'IPFS returned {len(hashes)} hashes for '
+                f'{len(byte_strings)} objects')
+
+        return [hashes[str(idx)] for idx in range(len(byte_strings))]
+
+    async def cat(self, cid, offset=None, length=None):
+        params = {'arg': cid}
+        if offset:
+            params['offset'] = offset
+        if length is not None:
+            params['length'] = length
+
+        return await self.request('cat', params=params)
+
+    async def pin_add(self, cid):
+        body = await self.request('pin/add', params={'arg': cid})
+        return json.loads(body)['Pins']
+
+    async def id(self):
+        return json.loads(await self.request('id'))
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+
+# (process ID, daemon address, concurrency) -> (EventLoopThread, client)
+clients = {}
+clients_lock = threading.Lock()
+
+
+def async_ipfs_client(concurrency=DEFAULT_CONCURRENCY):
+    """
+    Return the shared client of the daemon in the settings and the thread of
+    its event loop. Forked processes get their own, threads do not survive
+    a fork.
+    """
+    key = (os.getpid(), settings.App.config('ipfsapi'), concurrency)
+    with clients_lock:
+        if key not in clients:
+            client = AsyncIPFSClient(concurrency=concurrency)
+            clients[key] = (EventLoopThread(), client)
+
+        return clients[key]
+
+
+@atexit.register
+def close_clients():
+    """Close the sessions of this process' clients"""
+    with clients_lock:
+        for (key, (loop_thread, client)) in list(clients.items()):
+            if key[0] == os.getpid():
+                loop_thread.run(client.close())
+                del clients[key]
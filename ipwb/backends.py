@@ -6,6 +6,7 @@ import ipfshttpclient
 import requests
 
 from ipwb import util, settings
+from ipwb.cdxj import cdxj_shard_paths, read_cdxj_manifest
 
 
 @dataclasses.dataclass(frozen=True)
@@ -61,6 +62,11 @@ def fetch_web_index(path: str) -> Optional[str]:
 
 def fetch_local_index(path: str) -> str:
     """Fetch CDXJ index contents from a file on local disk."""
+    manifest = read_cdxj_manifest(path)
+    if manifest is not None:  # A sharded index, read as one
+        return ''.join(fetch_local_index(shard_path)
+                       for shard_path in cdxj_shard_paths(path, manifest))
+
     with open(path, 'r') as f:
         return f.read()
 
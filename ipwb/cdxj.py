@@ -0,0 +1,287 @@
+"""
+Sorting and merging of CDXJ lines
+
+Replay binary searches CDXJ indexes, so their lines must be sorted. Indexes
+can be far larger than memory, so lines are sorted in runs of bounded size
+that are spilled to temporary files and k-way merged when read back.
+
+Large indexes can be split into shards, CDXJ files of consecutive ranges of
+SURT keys, listed with their first keys in a JSON manifest. A lookup only
+needs to read the one shard that can have the key.
+"""
+
+import bisect
+import heapq
+import itertools
+import json
+import math
+import os
+import sys
+import tempfile
+
+from .exceptions import UnsortedCDXJ
+
+# Bytes of CDXJ lines held in memory before a sorted run is spilled to disk
+DEFAULT_SORT_MEMORY = 256 * 1024 * 1024
+
+
+def merge_cdxj_lines(*cdxj_runs):
+    """Merge sorted runs of CDXJ lines into one sorted, de-duped iterator"""
+    previous_line = None
+    for cdxj_line in heapq.merge(*cdxj_runs):
+        if cdxj_line != previous_line:
+            yield cdxj_line
+        previous_line = cdxj_line
+
+
+def read_cdxj_run(run_path):
+    """Iterate the lines of a CDXJ file without loading it into memory"""
+    with open(run_path, 'r') as run:
+        for cdxj_line in run:
+            yield cdxj_line.rstrip('\n')
+
+
+def write_cdxj_run(cdxj_lines, directory=None):
+    """Write CDXJ lines to a new temporary file and return its path"""
+    (fd, run_path) = tempfile.mkstemp(suffix='.cdxj', dir=directory)
+    with os.fdopen(fd, 'w') as run:
+        for cdxj_line in cdxj_lines:
+            run.write(cdxj_line + '\n')
+
+    return run_path
+
+
+def read_sorted_cdxj_file(cdxj_path):
+    """
+    Iterate the non-metadata lines of a sorted CDXJ file, raising
+    UnsortedCDXJ on reaching a line that is out of order
+    """
+    previous_line = ''
+    for cdxj_line in read_cdxj_run(cdxj_path):
+        cdxj_line = cdxj_line.strip()
+        if cdxj_line[:1] == '!' or not cdxj_line:
+            continue
+
+        if cdxj_line < previous_line:
+            raise UnsortedCDXJ(f'{cdxj_path} is not sorted')
+
+        yield cdxj_line
+        previous_line = cdxj_line
+
+
+def read_cdxj_meta(cdxj_lines):
+    """
+    Return the fields of the `!meta` lines at the start of CDXJ lines,
+    combined into one dict
+    """
+    meta = {}
+    for cdxj_line in cdxj_lines:
+        if cdxj_line[:1] != '!':
+            break
+
+        if cdxj_line.startswith('!meta '):
+            try:
+                meta.update(json.loads(cdxj_line[len('!meta '):]))
+            except (TypeError, ValueError):
+                continue
+
+    return meta
+
+
+def write_cdxj_file(cdxj_path, cdxj_lines):
+    """
+    Write CDXJ lines to a temporary file next to `cdxj_path` then atomically
+    move it into place, so readers see either the old or the new file
+    """
+    tmp_path = write_cdxj_tmp_file(cdxj_path, cdxj_lines)
+    try:
+        os.replace(tmp_path, cdxj_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def write_cdxj_tmp_file(cdxj_path, cdxj_lines):
+    """
+    Write CDXJ lines to a temporary file next to `cdxj_path`, with the mode
+    `cdxj_path` has or would be created with, and return its path
+    """
+    cdxj_dir = os.path.dirname(os.path.abspath(cdxj_path))
+    (fd, tmp_path) = tempfile.mkstemp(
+        prefix=f'.{os.path.basename(cdxj_path)}.', suffix='.tmp',
+        dir=cdxj_dir)
+
+    try:
+        with os.fdopen(fd, 'w') as tmp_file:
+            for cdxj_line in cdxj_lines:
+                tmp_file.write(cdxj_line + '\n')
+
+        # mkstemp() creates files only readable by the owner
+        try:
+            mode = os.stat(cdxj_path).st_mode
+        except FileNotFoundError:
+            umask = os.umask(0)
+            os.umask(umask)
+            mode = 0o666 & ~umask
+        os.chmod(tmp_path, mode)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+    return tmp_path
+
+
+def cdxj_key(cdxj_line):
+    """Return the SURT key of a CDXJ line"""
+    return cdxj_line.split(' ', 1)[0]
+
+
+def shard_path(manifest_path, shard_number):
+    (stem, _) = os.path.splitext(manifest_path)
+    return f'{stem}-{shard_number:05d}.cdxj'
+
+
+def read_cdxj_manifest(path):
+    """Return the manifest of a sharded index, None if `path` is not one"""
+    try:
+        with open(path, 'r') as f:
+            # CDXJ lines start with a SURT key or !, never with {
+            if f.read(1) != '{':
+                return None
+            f.seek(0)
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def cdxj_shard_paths(manifest_path, manifest):
+    """Return the paths of the shards of a manifest, in key order"""
+    manifest_dir = os.path.dirname(os.path.abspath(manifest_path))
+
+    return [os.path.join(manifest_dir, shard['path'])
+            for shard in manifest['shards']]
+
+
+def find_cdxj_shard(manifest_path, manifest, key):
+    """Return the path of the shard that has the lines of a SURT key, if any"""
+    first_keys = [shard['first_key'] for shard in manifest['shards']]
+    shard_number = max(bisect.bisect_right(first_keys, key) - 1, 0)
+
+    return cdxj_shard_paths(manifest_path, manifest)[shard_number]
+
+
+def write_cdxj_shards(manifest_path, cdxj_metadata_lines, cdxj_lines,
+                      line_count, shard_count):
+    """
+    Split sorted CDXJ lines into `shard_count` files of about as many lines
+    each, then write a manifest of them at `manifest_path`. Shards are only
+    split between SURT keys, so all captures of a URI are in one shard, and
+    each starts with the metadata lines.
+    """
+    lines_per_shard = max(math.ceil(line_count / shard_count), 1)
+    groups = itertools.groupby(cdxj_lines, key=cdxj_key)
+    group = next(groups, None)
+    shards = []
+
+    def shard_lines(shard):
+        nonlocal group
+        yield from cdxj_metadata_lines
+        while group is not None and shard['line_count'] < lines_per_shard:
+            for cdxj_line in group[1]:
+                shard['line_count'] += 1
+                yield cdxj_line
+            group = next(groups, None)
+
+    # Shards are moved into place once all are written, then the manifest
+    tmp_paths = []
+    try:
+        while group is not None or not shards:
+            path = shard_path(manifest_path, len(shards))
+            shard = {'path': os.path.basename(path),
+                     'first_key': group[0] if group else '',
+                     'line_count': 0}
+            tmp_paths.append(write_cdxj_tmp_file(path, shard_lines(shard)))
+            shards.append(shard)
+
+        for (tmp_path, path) in zip(tmp_paths, cdxj_shard_paths(
+                manifest_path, {'shards': shards})):
+            os.replace(tmp_path, path)
+    except BaseException:
+        for tmp_path in tmp_paths:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        raise
+
+    previous_manifest = read_cdxj_manifest(manifest_path)
+    write_cdxj_file(manifest_path, [json.dumps({
+        'shard_count': shard_count, 'line_count': line_count,
+        'shards': shards})])
+
+    # Shards of a previous manifest that were not overwritten
+    if previous_manifest is not None:
+        for path in cdxj_shard_paths(manifest_path, previous_manifest)[
+                len(shards):]:
+            if os.path.exists(path):
+                os.remove(path)
+
+    return shards
+
+
+class CDXJSorter:
+    """
+    Sort and de-dupe CDXJ lines in about `memory_budget` bytes of memory.
+
+    Lines are buffered until the budget is reached, at which point they are
+    sorted and spilled to a temporary file. `sorted_lines()` merges the
+    spilled runs with what is left in the buffer. The temporary files are
+    removed on `close()`.
+    """
+
+    def __init__(self, memory_budget=DEFAULT_SORT_MEMORY):
+        self.memory_budget = memory_budget
+        self.buffer = []
+        self.buffer_size = 0
+        self.run_paths = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def add(self, cdxj_line):
+        self.buffer.append(cdxj_line)
+        self.buffer_size += sys.getsizeof(cdxj_line)
+
+        if self.buffer_size >= self.memory_budget:
+            self.spill()
+
+    def add_run(self, run_path):
+        """Take ownership of a temporary file of already-sorted lines"""
+        self.run_paths.append(run_path)
+
+    def spill(self):
+        if not self.buffer:
+            return
+
+        self.buffer.sort()
+        self.run_paths.append(write_cdxj_run(merge_cdxj_lines(self.buffer)))
+        self.buffer = []
+        self.buffer_size = 0
+
+    def sorted_lines(self):
+        self.buffer.sort()
+        runs = [read_cdxj_run(run_path) for run_path in self.run_paths]
+
+        return merge_cdxj_lines(self.buffer, *runs)
+
+    def close(self):
+        for run_path in self.run_paths:
+            try:
+                os.remove(run_path)
+            except OSError:
+                pass
+
+        self.buffer = []
+        self.buffer_size = 0
+        self.run_paths = []
@@ -0,0 +1,99 @@
+"""
+Persistent cache of the IPFS hashes of content already added by the indexer
+
+Re-indexing the same or overlapping WARCs produces many byte-identical
+headers and payloads. The cache maps the SHA-256 digest of the exact bytes
+pushed to IPFS to the hash IPFS returned, so those bytes are not sent to the
+daemon again. The cache lives in the IPFS repo directory by default, as its
+entries are only valid for the daemon that stores the content. A cache
+shared by several daemons or local stores keeps their entries apart, so a
+hit never names content missing from the store indexed into. The same
+bytes get other CIDs when added with other options, so entries are also
+kept apart by the options they were added with.
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+
+from . import settings, util
+
+CID_CACHE_FILENAME = 'ipwb_cid_cache.sqlite'
+
+# Cache entries written between commits. Entries lost in a crash only cost
+# a redundant push the next time around.
+COMMIT_INTERVAL = 1000
+
+
+def default_cid_cache_path():
+    return os.path.join(util.get_ipfs_repo_path(), CID_CACHE_FILENAME)
+
+
+def store_identity():
+    """What tells the store in the settings apart from other stores"""
+    store_path = settings.App.config('store')
+    if store_path:
+        return f'store={os.path.abspath(store_path)}'
+
+    return f'ipfsapi={settings.App.config("ipfsapi")}'
+
+
+def digest(bytes_in):
+    return f'sha256:{hashlib.sha256(bytes_in).hexdigest()}'
+
+
+class CIDCache:
+    """SQLite-backed map of content digests to IPFS hashes"""
+
+    def __init__(self, path=None, add_options=None, store=None):
+        self.path = path or default_cid_cache_path()
+        # Appended to digests, empty for the daemon's defaults and no
+        # store identity
+        self.key_suffix = ''.join(
+            f';{name}={value}'
+            for (name, value) in sorted((add_options or {}).items()))
+        if store:
+            self.key_suffix += f';{store}'
+        self.lock = threading.Lock()
+        self.uncommitted_count = 0
+
+        # Shared by the push worker threads, access is serialized by the lock
+        self.connection = sqlite3.connect(
+            self.path, timeout=60, check_same_thread=False)
+        with self.lock:
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS cids '
+                '(digest TEXT PRIMARY KEY, cid TEXT NOT NULL)')
+            self.connection.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def get(self, content_digest):
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT cid FROM cids WHERE digest = ?',
+                (content_digest + self.key_suffix,)).fetchone()
+
+        return row[0] if row else None
+
+    def put(self, content_digest, cid):
+        with self.lock:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO cids (digest, cid) VALUES (?, ?)',
+                (content_digest + self.key_suffix, cid))
+
+            self.uncommitted_count += 1
+            if self.uncommitted_count >= COMMIT_INTERVAL:
+                self.connection.commit()
+                self.uncommitted_count = 0
+
+    def close(self):
+        with self.lock:
+            self.connection.commit()
+            self.connection.close()
@@ -0,0 +1,167 @@
+"""
+Codecs that compress the headers and payloads of records stored by ipwb
+
+The indexer compresses with a codec from CODECS and marks each compressed
+record's CDXJ line with the codec's name, which replay uses to look up the
+same codec to decompress it. zstd can use a trained dictionary, which lets
+HTTP headers and small HTML payloads share the redundancy between records
+that per-object compression cannot see. Dictionaries are stored like any
+other content and referenced by their zstd dictionary ID from the CDXJ
+`!meta` line. zstd needs the optional zstandard package.
+"""
+
+import functools
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+ZLIB = 'zlib'
+ZSTD = 'zstd'
+
+# Size of trained dictionaries, the default of the zstd command line tool
+DEFAULT_DICTIONARY_SIZE = 110 * 1024
+
+
+class ZlibCodec:
+    name = ZLIB
+    default_level = 6  # Magic 6, TA-DA!
+    levels = range(0, 10)
+
+    def __init__(self, level=None, dictionary=None):
+        self.level = check_level(self, level)
+        if dictionary is not None:
+            raise ValueError('zlib compression does not use dictionaries')
+
+    def compress(self, bytes_in):
+        return zlib.compress(bytes_in, self.level)
+
+    def compress_chunks(self, chunks):
+        compressor = zlib.compressobj(self.level)
+        for chunk in chunks:
+            compressed = compressor.compress(chunk)
+            if compressed:
+                yield compressed
+
+        yield compressor.flush()
+
+    def decompress(self, bytes_in, dictionary=None):
+        try:
+            return zlib.decompress(bytes_in)
+        except zlib.error as e:
+            raise ValueError(f'Could not decompress zlib data: {e}') from e
+
+
+class ZstdCodec:
+    name = ZSTD
+    default_level = 3
+    levels = range(1, 23)
+
+    def __init__(self, level=None, dictionary=None):
+        require_zstandard()
+        self.level = check_level(self, level)
+        self.dictionary = None
+        if dictionary is not None:
+            self.dictionary = zstd_dictionary(dictionary)
+            # Prepare the dictionary once rather than for every record
+            self.dictionary.precompute_compress(level=self.level)
+
+    def compressor(self):
+        return zstandard.ZstdCompressor(
+            level=self.level, dict_data=self.dictionary)
+
+    def compress(self, bytes_in):
+        return self.compressor().compress(bytes_in)
+
+    def compress_chunks(self, chunks):
+        compressor = self.compressor().compressobj()
+        for chunk in chunks:
+            compressed = compressor.compress(chunk)
+            if compressed:
+                yield compressed
+
+        yield compressor.flush()
+
+    def decompress(self, bytes_in, dictionary=None):
+        """
+        Decompress a frame, with the dictionary its frame header names if
+        any. Streamed frames do not record their size, so the frame is
+        decompressed as a stream.
+        """
+        if dictionary is not None:
+            dictionary = zstd_dictionary(dictionary)
+
+        decompressor = zstandard.ZstdDecompressor(dict_data=dictionary)
+        try:
+            return decompressor.decompressobj().decompress(bytes_in)
+        except zstandard.ZstdError as e:
+            raise ValueError(f'Could not decompress zstd data: {e}') from e
+
+
+CODECS = {codec.name: codec for codec in (ZlibCodec, ZstdCodec)}
+
+
+def require_zstandard():
+    if zstandard is None:
+        raise ImportError(
+            'zstd compression needs the zstandard package, install it '
+            'with pip install ipwb[zstd]')
+
+
+def check_level(codec, level):
+    if level is None:
+        return codec.default_level
+
+    if level not in codec.levels:
+        raise ValueError(
+            f'{codec.name} compression levels are {codec.levels.start} to '
+            f'{codec.levels.stop - 1}, not {level}')
+
+    return level
+
+
+@functools.lru_cache(maxsize=8)
+def get_codec(name, level=None, dictionary=None):
+    """Return the codec `name`, at `level` and with `dictionary` if given"""
+    try:
+        codec = CODECS[name]
+    except KeyError:
+        raise ValueError(f'Unknown compression codec {name}') from None
+
+    return codec(level, dictionary)
+
+
+def zstd_dictionary(dictionary):
+    """Wrap the bytes of a trained zstd dictionary for zstandard to use"""
+    require_zstandard()
+    dictionary = zstandard.ZstdCompressionDict(
+        dictionary, dict_type=zstandard.DICT_TYPE_FULLDICT)
+    if dictionary.dict_id() == 0:
+        raise ValueError('Not a trained zstd dictionary')
+
+    return dictionary
+
+
+def dictionary_id(dictionary):
+    """The ID zstd frames compressed with `dictionary` refer to it by"""
+    return zstd_dictionary(dictionary).dict_id()
+
+
+def frame_dictionary_id(bytes_in):
+    """The ID of the dictionary a zstd frame needs, 0 if none"""
+    require_zstandard()
+
+    return zstandard.get_frame_parameters(bytes_in).dict_id
+
+
+def train_dictionary(samples, size=DEFAULT_DICTIONARY_SIZE):
+    """Train a zstd dictionary of up to `size` bytes on byte strings"""
+    require_zstandard()
+    try:
+        return zstandard.train_dictionary(size, samples).as_bytes()
+    except zstandard.ZstdError as e:
+        raise ValueError(
+            f'Could not train a compression dictionary on {len(samples)} '
+            f'samples: {e}') from e
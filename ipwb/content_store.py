@@ -0,0 +1,302 @@
+"""
+Stores of the web archive content that ipwb indexes and replays
+
+Content is addressed by the CID IPFS gives it. IPFSStore keeps content in an
+IPFS daemon. LocalStore keeps it in a directory, under the CID `ipfs add`
+would give it, so CDXJ indexes of either store refer to content the same
+way. LocalStore needs no daemon, which suits single node deployments and
+measuring ipwb's own throughput.
+"""
+
+import asyncio
+import io
+import os
+import tempfile
+from io import BytesIO
+
+from ipfshttpclient.exceptions import ErrorResponse
+
+from . import settings
+from .aioipfs import DEFAULT_CONCURRENCY, async_ipfs_client
+from .exceptions import ContentNotFound, IPFSDaemonNotAvailable
+from .unixfs import CIDOptions, UnixFSFile, resolve_add_options, unixfs_cid
+from .util import check_daemon_is_alive, ipfs_client
+
+
+def content_store():
+    """Return the store configured in the settings"""
+    store_path = settings.App.config('store')
+    add_options = settings.App.config('ipfs_add_options')
+    if store_path:
+        return LocalStore(store_path, add_options)
+
+    ipfs_concurrency = settings.App.config('ipfs_concurrency')
+    if ipfs_concurrency:
+        return AsyncIPFSStore(ipfs_concurrency, add_options)
+
+    return IPFSStore(add_options)
+
+
+def ipfs_add_params(add_options):
+    """Return the parameters of the IPFS API's add for `ipfs add` options"""
+    params = {}
+    for (name, value) in (add_options or {}).items():
+        if isinstance(value, bool):
+            value = str(value).lower()
+        params[name.replace('_', '-')] = str(value)
+
+    return params
+
+
+class ContentStore:
+    """Interface of content stores, with defaults built on the basics"""
+
+    def check_available(self):
+        """Raise an exception if the store cannot be used"""
+
+    def put(self, bytes_in):
+        """Add bytes to the store and return their CID"""
+        raise NotImplementedError
+
+    def put_many(self, objects):
+        """Add several byte strings, return their CIDs in the same order"""
+        return [self.put(bytes_in) for bytes_in in objects]
+
+    def put_stream(self, chunks):
+        """Add the concatenation of an iterator of byte strings"""
+        return self.put(b''.join(chunks))
+
+    def get(self, cid):
+        """Return the content of a CID"""
+        raise NotImplementedError
+
+    def get_range(self, cid, offset, length=None):
+        """Return `length` bytes, or all, of a CID's content from `offset`"""
+        content = self.get(cid)[offset:]
+        return content if length is None else content[:length]
+
+    def get_many(self, cids):
+        """Return the content of several CIDs in the same order"""
+        return [self.get(cid) for cid in cids]
+
+    def has(self, cid):
+        """Whether the content of a CID is in the store"""
+        raise NotImplementedError
+
+
+class IPFSStore(ContentStore):
+    """Content added to the IPFS daemon in the settings"""
+
+    def __init__(self, add_options=None):
+        # Options like those of `ipfs add`, the daemon's defaults if None
+        self.add_options = add_options
+        self.add_params = ipfs_add_params(add_options)
+
+    def add_kwargs(self):
+        """Arguments of the client's add(), which sends pin and raw-leaves"""
+        if not self.add_options:
+            return {}
+
+        opts = dict(self.add_params)
+        for name in ('pin', 'raw-leaves'):
+            opts.pop(name, None)
+
+        return {'pin': self.add_options.get('pin', True),
+                'raw_leaves': self.add_options.get('raw_leaves'),
+                'opts': opts}
+
+    def check_available(self):
+        check_daemon_is_alive()
+
+    def put(self, bytes_in):
+        return ipfs_client().add_bytes(bytes_in, opts=self.add_params)
+
+    def put_many(self, objects):
+        """Add the byte strings in one multipart request"""
+        if not objects:
+            return []
+
+        files = []
+        for idx, bytes_in in enumerate(objects):
+            file = BytesIO(bytes_in)
+            file.name = str(idx)  # Used to map the returned hashes to objects
+            files.append(file)
+
+        res = ipfs_client().add(*files, **self.add_kwargs())
+        if not isinstance(res, list):
+            res = [res]
+
+        hashes = {entry['Name']: entry['Hash'] for entry in res}
+        if len(hashes) != len(objects):
+            raise Exception(
+                f'IPFS returned {len(hashes)} hashes for {len(objects)} '
+                'objects')
+
+        return [hashes[file.name] for file in files]
+
+    def put_stream(self, chunks):
+        """Add the byte strings as they are read, without joining them"""
+        return ipfs_client().add(
+            ChunkReader(chunks), **self.add_kwargs())['Hash']
+
+    def get(self, cid):
+        return ipfs_client().cat(cid)
+
+    def get_range(self, cid, offset, length=None):
+        return ipfs_client().cat(cid, offset=offset, length=length)
+
+    def has(self, cid):
+        """Whether the daemon has the root block of a CID without fetching"""
+        try:
+            ipfs_client().block.stat(cid, offline=True)
+        except ErrorResponse:
+            return False
+
+        return True
+
+
+class AsyncIPFSStore(IPFSStore):
+    """
+    Content added to the IPFS daemon with the asyncio client, which has up
+    to `concurrency` requests in flight. Streams are still added with the
+    synchronous client, they are read from iterators that may block.
+    """
+
+    def __init__(self, concurrency=DEFAULT_CONCURRENCY, add_options=None):
+        super().__init__(add_options)
+        (self.loop_thread, self.client) = async_ipfs_client(concurrency)
+        self.concurrency = concurrency
+
+    def check_available(self):
+        try:
+            self.loop_thread.run(self.client.id())
+        except Exception as err:
+            raise IPFSDaemonNotAvailable(
+                f'Daemon is not running at: {self.client.base_url}') from err
+
+    def submit(self, coroutine):
+        """Run a coroutine on the client's loop, return a Future of it"""
+        return self.loop_thread.submit(coroutine)
+
+    async def put_async(self, bytes_in):
+        return (await self.client.add(bytes_in, **self.add_params))[0]
+
+    async def get_async(self, cid, offset=None, length=None):
+        return await self.client.cat(cid, offset, length)
+
+    def put(self, bytes_in):
+        return self.loop_thread.run(self.put_async(bytes_in))
+
+    def put_many(self, objects):
+        if not objects:
+            return []
+
+        return self.loop_thread.run(
+            self.client.add(*objects, **self.add_params))
+
+    def get(self, cid):
+        return self.loop_thread.run(self.get_async(cid))
+
+    def get_range(self, cid, offset, length=None):
+        return self.loop_thread.run(self.get_async(cid, offset, length))
+
+    def get_many(self, cids):
+        """Fetch the CIDs concurrently"""
+        async def get_all():
+            return await asyncio.gather(*map(self.get_async, cids))
+
+        return self.loop_thread.run(get_all())
+
+
+class LocalStore(ContentStore):
+    """Content kept in files named by their CIDs under a directory"""
+
+    def __init__(self, path, add_options=None):
+        self.path = path
+        # CIDs are computed as `ipfs add` would with the options. Raises
+        # ValueError for chunkers only the daemon supports.
+        self.cid_options = CIDOptions(
+            **resolve_add_options(**(add_options or {})))
+
+    def check_available(self):
+        if not os.path.isdir(self.path):
+            raise ContentNotFound(f'No content store at {self.path}')
+
+    def object_path(self, cid):
+        # The trailing characters vary most, the leading ones not at all
+        return os.path.join(self.path, cid[-2:], cid)
+
+    def put(self, bytes_in):
+        cid = unixfs_cid(bytes_in, self.cid_options)
+        if not self.has(cid):
+            self.write_object([bytes_in], cid)
+
+        return cid
+
+    def put_stream(self, chunks):
+        return self.write_object(chunks)
+
+    def write_object(self, chunks, cid=None):
+        """
+        Write chunks to a temporary file, hashing them unless their CID is
+        given, then move it into place under the CID. Return the CID.
+        """
+        unixfs_file = UnixFSFile(self.cid_options)
+        os.makedirs(self.path, exist_ok=True)
+        (fd, tmp_path) = tempfile.mkstemp(suffix='.tmp', dir=self.path)
+        try:
+            with os.fdopen(fd, 'wb') as tmp_file:
+                for chunk in chunks:
+                    if cid is None:
+                        unixfs_file.update(chunk)
+                    tmp_file.write(chunk)
+
+            if cid is None:
+                cid = unixfs_file.cid()
+
+            object_path = self.object_path(cid)
+            os.makedirs(os.path.dirname(object_path), exist_ok=True)
+            os.replace(tmp_path, object_path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+        return cid
+
+    def get(self, cid):
+        return self.get_range(cid, 0)
+
+    def get_range(self, cid, offset, length=None):
+        try:
+            with open(self.object_path(cid), 'rb') as f:
+                f.seek(offset)
+                return f.read() if length is None else f.read(length)
+        except FileNotFoundError as err:
+            raise ContentNotFound(f'{cid} is not in {self.path}') from err
+
+    def has(self, cid):
+        return os.path.exists(self.object_path(cid))
+
+
+class ChunkReader(io.RawIOBase):
+    """Read-only file object over an iterator of byte strings"""
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.buffer = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self.buffer:
+            try:
+                self.buffer = next(self.chunks)
+            except StopIteration:
+                return 0
+
+        size = min(len(b), len(self.buffer))
+        b[:size] = self.buffer[:size]
+        self.buffer = self.buffer[size:]
+
+        return size
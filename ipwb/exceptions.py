@@ -1,2 +1,14 @@
 class IPFSDaemonNotAvailable(Exception):
     """IPFS Daemon is for some reason not available."""
+
+
+class UnsortedCDXJ(Exception):
+    """Lines of a CDXJ file are not in sorted order."""
+
+
+class ContentNotFound(Exception):
+    """Content is not in the content store."""
+
+
+class IPFSAPIError(Exception):
+    """The IPFS HTTP API responded with an error."""
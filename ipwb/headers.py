@@ -0,0 +1,46 @@
+"""
+HTTP headers split into a template shared between records and a delta
+
+Responses from one site tend to have the same header block but for the
+values of a few fields, like Date and Content-Length. Cutting those values
+out leaves a template that many records share, so it is stored once. The
+values are kept in each record's CDXJ line as its delta, from which replay
+reassembles the header.
+"""
+
+HEADER_LINE_SEPARATOR = '\r\n'
+
+# Fields whose values differ from response to response of a site
+VARYING_HEADERS = frozenset([
+    'age', 'cf-ray', 'content-length', 'content-location', 'content-md5',
+    'date', 'etag', 'expires', 'last-modified', 'location', 'set-cookie',
+    'x-amz-cf-id', 'x-amz-id-2', 'x-amz-request-id', 'x-request-id',
+    'x-runtime', 'x-served-by', 'x-timer', 'x-varnish',
+])
+
+
+def split_header(hstr):
+    """
+    Return the template of a header block and its delta, a list of
+    [line number, value] pairs of the values cut from the template
+    """
+    lines = hstr.split(HEADER_LINE_SEPARATOR)
+    delta = []
+    # The status line is part of the template
+    for (idx, line) in enumerate(lines[1:], 1):
+        (name, separator, value) = line.partition(':')
+        if separator and name.strip().lower() in VARYING_HEADERS:
+            # The name and colon are kept, the value is cut verbatim
+            lines[idx] = name + separator
+            delta.append([idx, value])
+
+    return (HEADER_LINE_SEPARATOR.join(lines), delta)
+
+
+def join_header(template, delta):
+    """Reassemble the header block split into a template and delta"""
+    lines = template.split(HEADER_LINE_SEPARATOR)
+    for (idx, value) in delta:
+        lines[idx] += value
+
+    return HEADER_LINE_SEPARATOR.join(lines)
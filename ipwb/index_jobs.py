@@ -0,0 +1,141 @@
+"""
+Background indexing of WARCs uploaded to replay
+
+Uploads are queued as jobs on a bounded queue. A single thread takes the
+jobs in turn and merges each WARC into the index, so an upload does not
+hold up the request that made it and uploads never write the index at the
+same time. The status of a job can be looked up by its ID while it is
+queued or indexed, with the bytes and records indexed so far, and for a
+while after it finished.
+"""
+
+import collections
+import os
+import queue
+import threading
+import time
+import uuid
+
+from . import indexer
+from .stats import IndexStats
+
+QUEUED = 'queued'
+INDEXING = 'indexing'
+DONE = 'done'
+FAILED = 'failed'
+
+DEFAULT_MAX_QUEUED = 16
+
+# Finished jobs kept for their status to be looked up
+MAX_FINISHED_JOBS = 256
+
+
+class IndexJob:
+    def __init__(self, warc_path, outfile):
+        self.id = uuid.uuid4().hex
+        self.warc_path = warc_path
+        self.warc_size = os.path.getsize(warc_path)
+        self.outfile = outfile
+        self.status = QUEUED
+        self.error = None
+        # Counted by the indexer as it goes, reported once it is done
+        self.index_stats = IndexStats()
+        self.stats = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    def finished(self):
+        return self.status in (DONE, FAILED)
+
+
+class IndexJobQueue:
+    """Jobs indexing WARCs one at a time on a thread of their own"""
+
+    def __init__(self, max_queued=DEFAULT_MAX_QUEUED):
+        self.queue = queue.Queue(max_queued)
+        self.jobs = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.worker = None
+
+    def submit(self, warc_path, outfile):
+        """Queue a job indexing a WARC into `outfile`, raise queue.Full"""
+        job = IndexJob(warc_path, outfile)
+        with self.lock:
+            self.queue.put_nowait(job)
+            self.jobs[job.id] = job
+
+            if self.worker is None:
+                self.worker = threading.Thread(
+                    target=self.run, name='ipwb-index-jobs', daemon=True)
+                self.worker.start()
+
+        return job
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def status(self, job):
+        """What there is to know of a job, to be sent as JSON"""
+        with self.lock:
+            status = {
+                'job': job.id,
+                'status': job.status,
+                'filename': os.path.basename(job.warc_path),
+                'submitted_at': job.submitted_at,
+                'started_at': job.started_at,
+                'finished_at': job.finished_at
+            }
+            if job.status == QUEUED:
+                # Jobs are taken in the order they were submitted
+                status['queue_position'] = sum(
+                    1 for other in self.jobs.values()
+                    if other.status == QUEUED and
+                    other.submitted_at < job.submitted_at)
+            if job.status == INDEXING:
+                counts = job.index_stats.counts
+                status['progress'] = {
+                    'warc_bytes': counts['warc_bytes'],
+                    'warc_size': job.warc_size,
+                    'records': counts['records'],
+                    'skipped_records': counts['skipped_records']
+                }
+            if job.stats is not None:
+                status['stats'] = job.stats
+            if job.error is not None:
+                status['error'] = job.error
+
+        return status
+
+    def run(self):
+        while True:
+            job = self.queue.get()
+            with self.lock:
+                job.status = INDEXING
+                job.started_at = time.time()
+
+            (status, stats, error) = self.index(job)
+
+            with self.lock:
+                (job.status, job.stats, job.error) = (status, stats, error)
+                job.finished_at = time.time()
+                self.forget_finished_jobs()
+            self.queue.task_done()
+
+    def index(self, job):
+        """Index the WARC of a job, return its status, stats and error"""
+        try:
+            indexer.index_file_at(
+                job.warc_path, outfile=job.outfile, stats=job.index_stats)
+            return (DONE, job.index_stats.as_dict(), None)
+        # The indexer exits on some errors, e.g. a missing WARC
+        except (Exception, SystemExit) as e:
+            indexer.log_error(f'Indexing {job.warc_path} failed: {e!r}')
+            return (FAILED, None, str(e) or type(e).__name__)
+
+    def forget_finished_jobs(self):
+        finished = [job_id for (job_id, job) in self.jobs.items()
+                    if job.finished()]
+        for job_id in finished[:-MAX_FINISHED_JOBS]:
+            del self.jobs[job_id]
@@ -7,19 +7,30 @@ This script reads a WARC file and returns a CDXJ representative of its
  contents. In doing so, it extracts all archived HTTP responses from
  warc-response records, separates the HTTP header from the body, pushes each
  into IPFS, and retains the hashes. These hashes are then used to populate the
- JSON block corresponding to the archived URI.
+ JSON block corresponding to the archived URI. Warc-revisit records, and
+ responses whose payload was already pushed in the same run, only push their
+ HTTP header and reuse the hash of the payload pushed before.
 """
 
 import sys
 import os
+import codecs
+import contextlib
+import functools
+import html
+import itertools
 import json
 import ipfshttpclient as ipfsapi
-import zlib
 import surt
 import ntpath
+import re
+import shutil
 import traceback
 import tempfile
+import time
 
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
 from io import BytesIO
 from warcio.archiveiterator import ArchiveIterator
 from warcio.recordloader import ArchiveLoadFailed
@@ -28,7 +39,7 @@ from requests.packages.urllib3.exceptions import NewConnectionError
 from ipfshttpclient.exceptions import ConnectionError
 # from requests.exceptions import ConnectionError
 
-from ipwb.util import iso8601_to_digits14, ipfs_client
+from ipwb.util import iso8601_to_digits14
 
 import requests
 import datetime
@@ -39,37 +50,229 @@ from Crypto.Cipher import AES
 from Crypto.Util.Padding import pad
 import base64
 
+from . import compression, settings
+from .content_store import AsyncIPFSStore, content_store
+from .unixfs import cid_add_options
+from .cid_cache import CIDCache, digest as cid_cache_digest, store_identity
+from .cdxj import (
+    CDXJSorter, DEFAULT_SORT_MEMORY, cdxj_shard_paths, merge_cdxj_lines,
+    read_cdxj_manifest, read_cdxj_meta, read_cdxj_run, read_sorted_cdxj_file,
+    write_cdxj_file, write_cdxj_run, write_cdxj_shards,
+)
+from .exceptions import UnsortedCDXJ
+from .headers import split_header
+from .journal import IndexJournal, default_journal_dir, journal_path
+from .record_filter import RecordFilter
+from .stats import IndexStats, ProgressReporter
+from .warc_ranges import read_cdx_offsets, warc_byte_ranges
 from .__init__ import __version__ as ipwb_version
 
 DEBUG = False
 
+# Path of a WARC read from STDIN
+STDIN_PATH = '-'
+
+# Records parsed ahead of the IPFS push workers, per worker
+PENDING_PUSHES_PER_JOB = 2
+
+# Upper bound on the bytes sent to IPFS in a single batched add request
+DEFAULT_BATCH_BYTES = 4 * 1024 * 1024
+
+# Bytes at the start of HTML payloads scanned for a <title> before falling
+# back to parsing the whole document
+TITLE_SCAN_BYTES = 32 * 1024
+TITLE_PATTERN = re.compile(
+    rb'<title\b[^>]*>(.*?)</title\s*>', re.IGNORECASE | re.DOTALL)
+TITLE_START_PATTERN = re.compile(rb'<title\b', re.IGNORECASE)
+BODY_START_PATTERN = re.compile(rb'<body\b', re.IGNORECASE)
+CHARSET_PATTERN = re.compile(
+    rb'''charset\s*=\s*["']?([\w.:-]+)''', re.IGNORECASE)
+
+# Layouts of encrypted content, recorded as the encryption_format of CDXJ
+# lines. Lines without one are in ENCRYPTION_FORMAT_BASE64. Either way, the
+# payload continues the AES-CTR keystream of the header.
+ENCRYPTION_FORMAT_BASE64 = 1  # Base64 encoded ciphertext
+ENCRYPTION_FORMAT_RAW = 2  # Ciphertext as is, a third smaller
+ENCRYPTION_FORMATS = (ENCRYPTION_FORMAT_BASE64, ENCRYPTION_FORMAT_RAW)
+
+# Compression dictionaries are trained on up to this many bytes of headers
+# and HTML payloads, taking payloads of up to DICTIONARY_SAMPLE_PAYLOAD_BYTES
+DICTIONARY_SAMPLES_BYTES = 16 * 1024 * 1024
+DICTIONARY_SAMPLE_PAYLOAD_BYTES = 64 * 1024
+
+# Attempts to add content to IPFS before giving up on it
+IPFS_RETRY_COUNT = 5
+
+# Settings passed on to the processes indexing WARCs in parallel
+WORKER_SETTINGS = ('ipfsapi', 'store', 'ipfs_concurrency', 'ipfs_add_options')
+
+# Records larger than this have their payload streamed to IPFS in chunks
+DEFAULT_STREAM_THRESHOLD = 16 * 1024 * 1024
+STREAM_CHUNK_SIZE = 1024 * 1024
+
 
 def s2b(s):  # Convert str to bytes, cross-py
     return bytes(s, 'utf-8')
 
 
 # TODO: put this method definition below index_file_at()
-def push_to_ipfs(hstr, payload):
-    ipfs_retry_count = 5  # WARC->IPFS attempts before giving up
+def push_to_ipfs(hstr, payload, cid_cache=None, stats=None):
+    # Py 2/3 str/unicode/byte resolution
+    if isinstance(hstr, str):
+        hstr = s2b(hstr)
+    if isinstance(payload, str):
+        payload = s2b(payload)
+
+    if payload is not None and len(payload) == 0:  # py-ipfs-api issue #137
+        return
+
+    stats = stats or IndexStats()
+
+    return retry_ipfs_push(
+        lambda: push_record_objects(hstr, payload, cid_cache, stats), stats)
+
+
+def push_record_objects(hstr, payload, cid_cache, stats):
+    """Push a header and payload, either reused from another if None"""
+    http_header_ipfs_hash = payload_ipfs_hash = None
+    with stats.timer('push'):
+        if hstr is not None:
+            http_header_ipfs_hash = push_bytes_to_ipfs_cached(hstr, cid_cache)
+        if payload is not None:
+            payload_ipfs_hash = push_bytes_to_ipfs_cached(payload, cid_cache)
+
+    for obj in (hstr, payload):
+        if obj is not None:
+            stats.count('pushed_objects')
+            stats.count('pushed_bytes', len(obj))
+
+    return [http_header_ipfs_hash, payload_ipfs_hash]
+
+
+def push_streamed_to_ipfs(hstr, payload_chunks, cid_cache=None,
+                          stats=None):
+    """
+    Push a header and a payload given as an iterator of byte strings to
+    IPFS, streaming the payload to the daemon as it is read. The payload can
+    only be read once, so unlike push_to_ipfs() it is not retried.
+    """
+    stats = stats or IndexStats()
+
+    http_header_ipfs_hash = None
+    if hstr is not None:
+        http_header_ipfs_hash = retry_ipfs_push(lambda: push_record_objects(
+            to_bytes(hstr), None, cid_cache, stats)[0], stats)
+        if http_header_ipfs_hash is None:
+            return None
+
+    try:
+        with stats.timer('push'):
+            payload_ipfs_hash = content_store().put_stream(
+                stats.counted('pushed_bytes', payload_chunks))
+        stats.count('pushed_objects')
+    except Exception as _:
+        stats.count('failed_pushes')
+        log_error('IPFS failed to add streamed payload')
+        log_error(sys.exc_info())
+        traceback.print_tb(sys.exc_info()[-1])
+        return None
+
+    return [http_header_ipfs_hash, payload_ipfs_hash]
+
+
+def push_batch_to_ipfs(records, cid_cache=None, stats=None):
+    """
+    Push the HTTP headers and payloads of several records to IPFS in a single
+    request. Return a [header hash, payload hash] pair for each record, or
+    None for records that could not be added. A header or payload of None
+    is not pushed, its hash is None.
+    """
+    records = [(s2b(hstr) if isinstance(hstr, str) else hstr,
+                s2b(payload) if isinstance(payload, str) else payload)
+               for (hstr, payload) in records]
+
+    objects = []
+    for (hstr, payload) in records:
+        if payload is None or len(payload) > 0:  # py-ipfs-api issue #137
+            objects += [obj for obj in (hstr, payload) if obj is not None]
+
+    stats = stats or IndexStats()
+
+    def push():
+        with stats.timer('push'):
+            ipfs_hashes = push_objects_to_ipfs_cached(objects, cid_cache)
+        stats.count('pushed_objects', len(objects))
+        stats.count('pushed_bytes', sum(len(obj) for obj in objects))
+        return ipfs_hashes
+
+    ipfs_hashes = retry_ipfs_push(push, stats)
+    if ipfs_hashes is None:
+        return [None] * len(records)
+
+    ipfs_hashes = iter(ipfs_hashes)
+    record_hashes = []
+    for record in records:
+        if record[1] is None or len(record[1]) > 0:
+            record_hashes.append([None if obj is None else next(ipfs_hashes)
+                                  for obj in record])
+        else:
+            record_hashes.append(None)
+
+    return record_hashes
+
+
+async def push_to_ipfs_async(store, hstr, payload, cid_cache=None,
+                             stats=None):
+    """
+    Like push_to_ipfs(), on the event loop of an AsyncIPFSStore, so many
+    records can be pushed at once without a thread each
+    """
+    objects = [to_bytes(hstr), to_bytes(payload)]
+    if objects[1] is not None and len(objects[1]) == 0:  # As push_to_ipfs()
+        return None
+
+    stats = stats or IndexStats()
+    for retry_count in range(IPFS_RETRY_COUNT):
+        start = time.perf_counter()
+        try:
+            ipfs_hashes = [None if obj is None else
+                           await push_bytes_to_ipfs_cached_async(
+                               store, obj, cid_cache)
+                           for obj in objects]
+        except Exception as _:
+            attempt_count = f'{retry_count + 1}/{IPFS_RETRY_COUNT}'
+            log_error(f'IPFS failed to add, retrying attempt {attempt_count}')
+            log_error(sys.exc_info())
+            if retry_count + 1 < IPFS_RETRY_COUNT:
+                stats.count('retries')
+            continue
+        finally:
+            # Pushes interleave on the loop, each is timed on its own
+            stats.add_seconds('push', time.perf_counter() - start)
+
+        for obj in objects:
+            if obj is not None:
+                stats.count('pushed_objects')
+                stats.count('pushed_bytes', len(obj))
+        return ipfs_hashes
+
+    stats.count('failed_pushes')
+    return None
+
+
+def retry_ipfs_push(push, stats=None):
+    """Call `push` until it succeeds, returning None if it never does"""
+    stats = stats or IndexStats()
+    ipfs_retry_count = IPFS_RETRY_COUNT
     retry_count = 0
     while retry_count < ipfs_retry_count:
         try:
-            # Py 2/3 str/unicode/byte resolution
-            if isinstance(hstr, str):
-                hstr = s2b(hstr)
-            if isinstance(payload, str):
-                payload = s2b(payload)
-
-            if len(payload) == 0:  # py-ipfs-api issue #137
-                return
-
-            http_header_ipfs_hash = push_bytes_to_ipfs(hstr)
-            payload_ipfs_hash = push_bytes_to_ipfs(payload)
+            ipfs_hashes = push()
 
             if retry_count > 0:
                 m = f'Retrying succeeded after {retry_count} attempts'
                 print(m)
-            return [http_header_ipfs_hash, payload_ipfs_hash]
+            return ipfs_hashes
         except NewConnectionError as _:
             print('IPFS daemon is likely not running.')
             print('Run "ipfs daemon" in another terminal session.')
@@ -82,21 +285,41 @@ def push_to_ipfs(hstr, payload):
             traceback.print_tb(sys.exc_info()[-1])
 
             retry_count += 1
+            if retry_count < ipfs_retry_count:
+                stats.count('retries')
 
+    stats.count('failed_pushes')
     return None  # Process of adding to IPFS failed
 
 
-def encrypt(hstr, payload, encryption_key):
-    padded_encryption_key = pad(encryption_key, AES.block_size)
-    key = base64.b64encode(padded_encryption_key)
-    cipher = AES.new(key, AES.MODE_CTR)
+def decrypt(hstr, payload, encryption_key, nonce,
+            encryption_format=ENCRYPTION_FORMAT_BASE64):
+    """
+    Decrypt the header and payload of a record encrypted with a key and a
+    base64 nonce, as stored in the `encryption_format` of the record
+    """
+    if encryption_format not in ENCRYPTION_FORMATS:
+        raise ValueError(f'Unknown encryption format {encryption_format}')
 
-    hstr_bytes = base64.b64encode(cipher.encrypt(hstr)).decode('utf-8')
+    cipher = aes_cipher(encryption_key, nonce=base64.b64decode(nonce))
+    if encryption_format == ENCRYPTION_FORMAT_BASE64:
+        hstr = base64.b64decode(hstr)
+        payload = base64.b64decode(payload)
 
-    payload_bytes = base64.b64encode(cipher.encrypt(payload)).decode('utf-8')
-    nonce = base64.b64encode(cipher.nonce).decode('utf-8')
+    return (cipher.decrypt(hstr), cipher.decrypt(payload))
 
-    return [hstr_bytes, payload_bytes, nonce]
+
+def aes_cipher(encryption_key, nonce=None):
+    """Create the AES-CTR cipher used to encrypt records with a key"""
+    padded_encryption_key = pad(to_bytes(encryption_key), AES.block_size)
+    key = base64.b64encode(padded_encryption_key)
+    if nonce is None:
+        return AES.new(key, AES.MODE_CTR)
+    return AES.new(key, AES.MODE_CTR, nonce=nonce)
+
+
+def to_bytes(s):
+    return s2b(s) if isinstance(s, str) else s
 
 
 def create_ipfs_temp_path():
@@ -109,7 +332,17 @@ def create_ipfs_temp_path():
 
 def index_file_at(warc_paths, encryption_key=None,
                   compression_level=None, encrypt_then_compress=True,
-                  quiet=False, outfile=None, debug=False):
+                  quiet=False, outfile=None, debug=False, jobs=1,
+                  batch_size=1, batch_bytes=DEFAULT_BATCH_BYTES,
+                  processes=1, memory_budget=DEFAULT_SORT_MEMORY,
+                  cid_cache_path=None,
+                  stream_threshold=DEFAULT_STREAM_THRESHOLD, titles=True,
+                  resume=False, encryption_format=ENCRYPTION_FORMAT_RAW,
+                  compression_codec=compression.ZLIB,
+                  compression_dictionary_path=None, header_templates=False,
+                  stats_json=None, shards=None, split_warcs=False,
+                  cdx_offsets_path=None, include=None, exclude=None,
+                  stream=False, stats=None):
     global DEBUG
     DEBUG = debug
 
@@ -119,7 +352,7 @@ def index_file_at(warc_paths, encryption_key=None,
     for warc_path in warc_paths:
         verify_file_exists(warc_path)
 
-    cdxj_lines = []
+    sorter = CDXJSorter(memory_budget)
 
     if outfile:
         outdir = os.path.dirname(os.path.abspath(outfile))
@@ -130,142 +363,691 @@ def index_file_at(warc_paths, encryption_key=None,
                 log_error(e)
                 log_error('CDXJ output directory was not created')
         try:
-            output_file = open(outfile, 'a+')
-            # Read existing non-meta lines (if any) to allow automatic merge
-            cdxj_lines = [ln.strip() for ln in output_file if ln[:1] != '!']
+            # Existing lines (if any) are merged in once indexing is done
+            open(outfile, 'a').close()
         except IOError as e:
             log_error(e)
             log_error('Writing generated CDXJ to STDOUT instead')
             outfile = None
 
+    # An outfile that is the manifest of a sharded index stays sharded
+    if shards is None:
+        manifest = read_cdxj_manifest(outfile) if outfile else None
+        shards = manifest['shard_count'] if manifest else 1
+    if shards > 1 and (quiet or not outfile):
+        log_error('Only indexes written to an outfile are sharded')
+
+    # Streamed lines are written as they are indexed, unsorted
+    stream = stream and not quiet
+    if stream and shards > 1:
+        log_error('Streamed indexes are sharded by `ipwb sort`')
+    if stream and processes > 1:
+        log_error('Streamed WARCs are indexed one at a time')
+        processes = 1
+    # Worker processes read /dev/null rather than STDIN
+    if STDIN_PATH in warc_paths and processes > 1:
+        log_error('WARCs are indexed one at a time with one from STDIN')
+        processes = 1
+
+    # The meta of an index has the add options of all of its lines
+    if outfile and not quiet and not stream:
+        check_add_options_match(
+            outfile, settings.App.config('ipfs_add_options'))
+
+    # Finished CDXJ lines are journaled so an interrupted run can be resumed
+    journal_dir = None
+    if outfile and not quiet and not stream:
+        journal_dir = default_journal_dir(outfile)
+        if os.path.exists(journal_dir) and not resume:
+            log_error(f'Discarding the journal of an interrupted run in '
+                      f'{journal_dir}, use --resume to continue that run')
+            shutil.rmtree(journal_dir)
+        os.makedirs(journal_dir, exist_ok=True)
+    elif resume:
+        log_error('Only runs writing to an outfile can be resumed')
+
     if encryption_key is not None and len(encryption_key) == 0:
+        if STDIN_PATH in warc_paths:
+            log_error('An encryption key cannot be entered while the WARC '
+                      'is read from STDIN')
+            sys.exit()
         encryption_key = ask_user_for_encryption_key()
         if encryption_key == '':
             encryption_key = None
             log_error('Blank key entered, encryption disabled')
 
+    if header_templates and encryption_key is not None:
+        log_error('Header templates are not used with encryption, the '
+                  'values cut from headers would be readable in the index')
+        header_templates = False
+
+    # Counted as the WARCs are read, for callers to follow the progress
+    if stats is None:
+        stats = IndexStats()
+    start_time = time.perf_counter()
+
+    # A zstd dictionary is stored like records are, for replay to fetch
+    compression_dictionary = None
+    compression_dictionaries = {}
+    if compression_level is not None and compression_dictionary_path:
+        # A WARC from STDIN can only be read once, it is not trained on
+        compression_dictionary = load_compression_dictionary(
+            compression_dictionary_path,
+            [path for path in warc_paths if path != STDIN_PATH])
+    if compression_dictionary is not None:
+        dictionary_hash = retry_ipfs_push(
+            lambda: push_bytes_to_ipfs(compression_dictionary))
+        if dictionary_hash is None:
+            raise Exception('Failed to add the compression dictionary')
+        dictionary_id = compression.dictionary_id(compression_dictionary)
+        compression_dictionaries[str(dictionary_id)] = dictionary_hash
+
     encryption_and_compression_setting = {
         'encrypt_THEN_compress': encrypt_then_compress,
         'encryption_key': encryption_key,
-        'compression_level': compression_level
+        'encryption_format': encryption_format,
+        'compression_level': compression_level,
+        'compression_codec': compression_codec,
+        'compression_dictionary': compression_dictionary
     }
 
-    for warc_path in warc_paths:
-        warc_file_full_path = warc_path
-
-        try:
-            cdxj_lines += cdx_cdxj_lines_from_file(
-                warc_file_full_path, **encryption_and_compression_setting)
-        except ArchiveLoadFailed:
-            log_error(warc_path + ' is not a valid WARC file.')
+    index_opts = {
+        'jobs': jobs,
+        'batch_size': batch_size,
+        'batch_bytes': batch_bytes,
+        'cid_cache_path': cid_cache_path,
+        'stream_threshold': stream_threshold,
+        'titles': titles,
+        'header_templates': header_templates,
+        'journal_dir': journal_dir,
+        'record_filter': RecordFilter(include or (), exclude or ()),
+        **encryption_and_compression_setting
+    }
 
-    # De-dupe and sort, needed for CDXJ adherence
-    cdxj_lines = list(set(cdxj_lines))
-    cdxj_lines.sort()
+    index_warc = functools.partial(
+        sorted_cdxj_run_from_file, memory_budget=memory_budget, **index_opts)
+
+    if stream:
+        cdxj_metadata_lines = generate_cdxj_metadata(
+            compression_dictionaries=compression_dictionaries,
+            ipfs_add_options=settings.App.config('ipfs_add_options'))
+        stream_cdxj_lines(
+            warc_paths, outfile, cdxj_metadata_lines, stats, index_opts)
+    elif processes > 1 and (len(warc_paths) > 1 or split_warcs):
+        # Each worker indexes whole WARCs, or byte ranges of them with
+        # `split_warcs`, the sorted runs are merged below
+        work_units = warc_work_units(
+            warc_paths, processes, split_warcs, cdx_offsets_path)
+        payload_cids = {}
+        deferred_revisits = []
+        with ProcessPoolExecutor(
+                max_workers=processes, initializer=init_index_worker,
+                initargs=({name: settings.App.config(name)
+                           for name in WORKER_SETTINGS},)) as pool:
+            for (run_path, run_stats, payload_hashes, deferred) in \
+                    pool.map(index_warc, work_units):
+                sorter.add_run(run_path)
+                stats.merge(run_stats)
+                for (payload_digest, (payload_hash, title)) in \
+                        payload_hashes.items():
+                    payload_cids.setdefault(
+                        payload_digest, (payload_hash, title))
+                deferred_revisits.extend(deferred)
+
+        # Revisits of payloads pushed by another worker are indexed now
+        # that all of them are done
+        for cdxj_line in iter_deferred_revisit_lines(
+                deferred_revisits, payload_cids, stats, index_opts):
+            sorter.add(cdxj_line)
+    else:
+        for cdxj_line in iter_cdxj_lines_from_files(
+                warc_paths, stats, index_opts):
+            sorter.add(cdxj_line)
+
+    # Streamed lines were written as they were indexed
+    if not stream:
+        with sorter:
+            # De-dupe and sort, needed for CDXJ adherence
+            cdxj_lines = sorter.sorted_lines()
+
+            # Lines already in the outfile may use other dictionaries
+            if outfile and not quiet:
+                compression_dictionaries = {
+                    **read_cdxj_meta(read_cdxj_run(
+                        existing_cdxj_paths(outfile)[0])).get(
+                        'compression_dictionaries', {}),
+                    **compression_dictionaries}
+
+            # Prepend metadata
+            cdxj_metadata_lines = generate_cdxj_metadata(
+                compression_dictionaries=compression_dictionaries,
+                ipfs_add_options=settings.App.config('ipfs_add_options'))
+
+            if quiet:
+                cdxj_lines = cdxj_metadata_lines + list(cdxj_lines)
+            elif outfile:
+                merge_into_cdxj_file(
+                    outfile, cdxj_metadata_lines, sorter, shards)
+                shutil.rmtree(journal_dir)
+            else:
+                for line in cdxj_metadata_lines:
+                    print(line)
+                for line in cdxj_lines:
+                    print(line)
 
-    # Prepend metadata
-    cdxj_metadata_lines = generate_cdxj_metadata(cdxj_lines)
-    cdxj_lines = cdxj_metadata_lines + cdxj_lines
+    stats.elapsed_seconds = time.perf_counter() - start_time
+    if not quiet:
+        log_error(stats.report())
+    if stats_json:
+        stats.write_json(stats_json)
 
     if quiet:
         return cdxj_lines
 
+
+def stream_cdxj_lines(warc_paths, outfile, cdxj_metadata_lines, stats,
+                      index_opts):
+    """
+    Write the CDXJ lines of WARCs to `outfile`, or STDOUT, as soon as their
+    records are pushed. The lines are not sorted, `ipwb sort` sorts them.
+    """
     if outfile:
-        # Truncate existing CDXJ file contents (if any) before writing to it
-        output_file.seek(0)
-        output_file.truncate()
-        for line in cdxj_lines:
-            output_file.write(line + "\n")
-        output_file.close()
+        out = open(outfile, 'a')
+        # Metadata is only written at the start of the file
+        if out.tell() > 0:
+            cdxj_metadata_lines = []
     else:
-        print('\n'.join(cdxj_lines))
+        out = contextlib.nullcontext(sys.stdout)
+
+    with out as f:
+        for line in cdxj_metadata_lines:
+            print(line, file=f, flush=True)
+
+        for cdxj_line in iter_cdxj_lines_from_files(
+                warc_paths, stats, index_opts):
+            print(cdxj_line, file=f, flush=True)
+
+
+def iter_cdxj_lines_from_files(warc_paths, stats, index_opts):
+    """Iterate the CDXJ lines of WARCs indexed one after the other"""
+    # Shared so records can reuse payloads pushed for an earlier WARC
+    payload_cids = {}
+    deferred_revisits = []
+    for warc_path in warc_paths:
+        try:
+            yield from iter_cdxj_lines_from_file(
+                warc_path, payload_cids=payload_cids, stats=stats,
+                deferred_revisits=deferred_revisits, **index_opts)
+        except ArchiveLoadFailed:
+            log_error(warc_path + ' is not a valid WARC file.')
+
+    # Revisits of payloads first pushed for a later WARC, as they would be
+    # if the WARCs were indexed by a process pool
+    yield from iter_deferred_revisit_lines(
+        deferred_revisits, payload_cids, stats, index_opts)
+
+
+def iter_deferred_revisit_lines(deferred_revisits, payload_cids, stats,
+                                index_opts):
+    """
+    Iterate the CDXJ lines of the (WARC path, offset) revisits whose
+    payloads were not pushed yet when they were read. They are not
+    journaled, a resumed run indexes them again.
+    """
+    # A resumed run may defer a revisit its journal has already
+    for (warc_path, record_offset) in dict.fromkeys(deferred_revisits):
+        yield from iter_cdxj_lines_from_file(
+            warc_path, payload_cids=payload_cids, stats=stats,
+            byte_range=(record_offset, record_offset + 1),
+            **{**index_opts, 'journal_dir': None})
+
+
+def sort_cdxj_files(cdxj_paths, outfile=None,
+                    memory_budget=DEFAULT_SORT_MEMORY, shards=None):
+    """
+    Sort and de-dupe the lines of CDXJ files, e.g. of streamed indexes, into
+    `outfile`, merging them with the lines already in it, or to STDOUT.
+    """
+    meta = {}
+    # Add options of the inputs with lines, the same for all of them
+    add_options = []
+    with CDXJSorter(memory_budget) as sorter:
+        for cdxj_path in cdxj_paths:
+            if cdxj_path == STDIN_PATH:
+                cdxj_lines = (line.rstrip('\n') for line in sys.stdin)
+            else:
+                cdxj_lines = read_cdxj_run(cdxj_path)
+
+            input_meta = {}
+            has_lines = False
+            for cdxj_line in cdxj_lines:
+                if cdxj_line.startswith('!meta '):
+                    input_meta.update(read_cdxj_meta([cdxj_line]))
+                elif cdxj_line[:1] != '!' and cdxj_line.strip():
+                    sorter.add(cdxj_line)
+                    has_lines = True
+
+            meta.update(input_meta)
+            if has_lines:
+                add_options.append(input_meta.get('ipfs_add_options'))
+                if cid_add_options(add_options[-1]) != \
+                        cid_add_options(add_options[0]):
+                    log_error(f'{cdxj_path} indexes content added to IPFS '
+                              f'with other options than {cdxj_paths[0]}')
+                    sys.exit()
+        if add_options:
+            meta['ipfs_add_options'] = add_options[0]
+
+        # Dictionaries of all inputs are needed to replay their lines
+        cdxj_metadata_lines = generate_cdxj_metadata(
+            compression_dictionaries=meta.get('compression_dictionaries'),
+            ipfs_add_options=meta.get('ipfs_add_options'))
+
+        if outfile:
+            if shards is None:
+                manifest = read_cdxj_manifest(outfile)
+                shards = manifest['shard_count'] if manifest else 1
+            open(outfile, 'a').close()
+            check_add_options_match(outfile, meta.get('ipfs_add_options'))
+            merge_into_cdxj_file(
+                outfile, cdxj_metadata_lines, sorter, shards)
+        else:
+            for line in itertools.chain(
+                    cdxj_metadata_lines, sorter.sorted_lines()):
+                print(line)
+
+
+def warc_work_units(warc_paths, processes, split_warcs=False,
+                    cdx_offsets_path=None):
+    """
+    Return the (WARC path, byte range) pairs indexed by worker processes.
+    The range is None for WARCs indexed whole.
+    """
+    if not split_warcs:
+        return [(warc_path, None) for warc_path in warc_paths]
+
+    cdx_offsets = read_cdx_offsets(cdx_offsets_path) \
+        if cdx_offsets_path else {}
+    work_units = []
+    for warc_path in warc_paths:
+        byte_ranges = warc_byte_ranges(
+            warc_path, processes,
+            cdx_offsets.get(os.path.basename(warc_path)))
+        work_units.extend(
+            (warc_path, byte_range) for byte_range in byte_ranges)
+
+    return work_units
+
+
+def existing_cdxj_paths(outfile):
+    """Return the CDXJ files of an index, its shards if it is sharded"""
+    manifest = read_cdxj_manifest(outfile)
+    if manifest is None:
+        return [outfile]
+
+    return cdxj_shard_paths(outfile, manifest)
+
+
+def read_add_options(cdxj_lines):
+    """
+    Return the `ipfs add` options in the meta of CDXJ lines and whether
+    there are lines of records
+    """
+    meta_lines = []
+    for cdxj_line in cdxj_lines:
+        if cdxj_line[:1] == '!':
+            meta_lines.append(cdxj_line)
+        elif cdxj_line.strip():
+            return (read_cdxj_meta(meta_lines).get('ipfs_add_options'), True)
+
+    return (read_cdxj_meta(meta_lines).get('ipfs_add_options'), False)
+
+
+def check_add_options_match(outfile, add_options):
+    """
+    Exit unless the lines already in `outfile` were added to IPFS with
+    options giving the same CIDs as `add_options`, as its meta only has the
+    options of one run
+    """
+    for cdxj_path in existing_cdxj_paths(outfile):
+        (existing_add_options, has_lines) = read_add_options(
+            read_cdxj_run(cdxj_path))
+        if has_lines and cid_add_options(existing_add_options) != \
+                cid_add_options(add_options):
+            log_error(f'{outfile} indexes content added to IPFS with other '
+                      f'options ({existing_add_options}), index into '
+                      f'another file')
+            sys.exit()
+
+
+def merge_into_cdxj_file(outfile, cdxj_metadata_lines, sorter, shards=1):
+    """
+    Merge the sorted lines of `sorter` with those already in `outfile`,
+    streaming both into a new file that then replaces `outfile`. With more
+    than one shard, they are written to shards and `outfile` is a manifest.
+    """
+    manifest = read_cdxj_manifest(outfile)
+    existing_paths = existing_cdxj_paths(outfile)
+
+    def sorted_lines():
+        existing_lines = itertools.chain.from_iterable(
+            read_sorted_cdxj_file(path) for path in existing_paths)
+        return merge_cdxj_lines(existing_lines, sorter.sorted_lines())
+
+    def write():
+        if shards > 1:
+            # Counted first to split the lines evenly
+            line_count = sum(1 for _ in sorted_lines())
+            write_cdxj_shards(outfile, cdxj_metadata_lines, sorted_lines(),
+                              line_count, shards)
+        else:
+            write_cdxj_file(outfile, itertools.chain(
+                cdxj_metadata_lines, sorted_lines()))
+
+    try:
+        write()
+    except UnsortedCDXJ:
+        log_error(f'{outfile} is not sorted, sorting it with the new lines')
+        for path in existing_paths:
+            for cdxj_line in read_cdxj_run(path):
+                if cdxj_line[:1] != '!' and cdxj_line.strip():
+                    sorter.add(cdxj_line.strip())
+
+        existing_paths = []
+        write()
+
+    # A sharded index written back as a single file
+    if manifest is not None and shards <= 1:
+        for path in cdxj_shard_paths(outfile, manifest):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def load_compression_dictionary(dictionary_path, warc_paths):
+    """
+    Read the zstd dictionary at `dictionary_path`. If there is none, train
+    one on the WARCs and write it there so later runs can use it too.
+    """
+    if os.path.exists(dictionary_path):
+        with open(dictionary_path, 'rb') as f:
+            return f.read()
+
+    samples = list(iter_compression_dictionary_samples(warc_paths))
+    try:
+        compression_dictionary = compression.train_dictionary(samples)
+    except ValueError as e:
+        log_error(f'{e}, compressing without a dictionary')
+        return None
+
+    with open(dictionary_path, 'wb') as f:
+        f.write(compression_dictionary)
+
+    return compression_dictionary
+
+
+def iter_compression_dictionary_samples(
+        warc_paths, max_bytes=DICTIONARY_SAMPLES_BYTES):
+    """
+    Iterate the HTTP headers and small HTML payloads of the response records
+    of WARCs, up to about `max_bytes` of them, to train a dictionary on
+    """
+    sampled_bytes = 0
+    for warc_path in warc_paths:
+        try:
+            with open(warc_path, 'rb') as fh:
+                for record in ArchiveIterator(fh):
+                    if record.rec_type != 'response' or \
+                            record.http_headers is None:
+                        continue
+
+                    samples = [to_bytes(record.http_headers.to_str().strip())]
+                    ctype = record.http_headers.get_header('content-type')
+                    if ctype and ctype.lower().startswith('text/html') and \
+                            (record.length or 0) <= \
+                            DICTIONARY_SAMPLE_PAYLOAD_BYTES:
+                        samples.append(record.content_stream().read())
+
+                    for sample in samples:
+                        if sample:
+                            yield sample
+                            sampled_bytes += len(sample)
+                    if sampled_bytes >= max_bytes:
+                        return
+        except ArchiveLoadFailed:
+            continue  # Reported when the WARC is indexed
+
+
+def init_index_worker(config):
+    """Configure a worker process like the process that started it"""
+    for (name, value) in config.items():
+        settings.App.set(name, value)
+
+
+def sorted_cdxj_run_from_file(work_unit, memory_budget=DEFAULT_SORT_MEMORY,
+                              **kwargs):
+    """
+    Index a WARC, or a byte range of it, and write its CDXJ lines, sorted,
+    to a temporary file. `work_unit` is the WARC's path and the range, or
+    None for the whole WARC. Return the path of the file, the IndexStats of
+    indexing, the hashes of the payloads pushed by their WARC-Payload-Digest
+    and the revisits whose payloads were not pushed in the range.
+    """
+    (warc_path, byte_range) = work_unit
+    stats = IndexStats()
+    payload_cids = {}
+    deferred_revisits = []
+    with CDXJSorter(memory_budget) as sorter:
+        try:
+            for cdxj_line in iter_cdxj_lines_from_file(
+                    warc_path, stats=stats, payload_cids=payload_cids,
+                    byte_range=byte_range,
+                    deferred_revisits=deferred_revisits, **kwargs):
+                sorter.add(cdxj_line)
+        except ArchiveLoadFailed:
+            log_error(warc_path + ' is not a valid WARC file.')
+
+        # Payloads of records still pending when indexing failed are left
+        payload_hashes = {
+            payload_digest: payload_source
+            for (payload_digest, payload_source) in payload_cids.items()
+            if isinstance(payload_source, tuple)}
+
+        return (write_cdxj_run(sorter.sorted_lines()), stats,
+                payload_hashes, deferred_revisits)
 
 
 def sanitize_cdxj_line(cdxj_line):
     return cdxj_line
 
 
-def cdx_cdxj_lines_from_file(warc_path, **enc_comp_opts):
+def cdx_cdxj_lines_from_file(warc_path, **kwargs):
+    return list(iter_cdxj_lines_from_file(warc_path, **kwargs))
+
+
+def iter_cdxj_lines_from_file(warc_path, jobs=1, batch_size=1,
+                              batch_bytes=DEFAULT_BATCH_BYTES,
+                              cid_cache_path=None, payload_cids=None,
+                              stream_threshold=DEFAULT_STREAM_THRESHOLD,
+                              titles=True, header_templates=False,
+                              journal_dir=None, stats=None, byte_range=None,
+                              deferred_revisits=None, record_filter=None,
+                              **enc_comp_opts):
+    if stats is None:
+        stats = IndexStats()
+
+    # Only the records starting in [start, end) are indexed with a range.
+    # The end of a WARC read from STDIN is not known until it is reached.
+    from_stdin = warc_path == STDIN_PATH
+    if from_stdin:
+        (range_start, range_end) = (0, None)
+    else:
+        (range_start, range_end) = byte_range or \
+            (0, os.path.getsize(warc_path))
+
+    # Progress is reported by bytes consumed rather than by record count so
+    # the WARC only needs to be read (and decompressed) once
+    progress = ProgressReporter(
+        'Processing WARC records in ' +
+        ('STDIN' if from_stdin else ntpath.basename(warc_path)),
+        None if from_stdin else range_end - range_start)
     record_count = 0
-    with open(warc_path, 'rb') as fhForCounting:
-        record_count = 0
-        try:
-            for _ in ArchiveIterator(fhForCounting):
-                record_count += 1
 
-        except ArchiveLoadFailed:
-            print('Encountered a bad WARC record.', file=sys.stderr)
+    # Records are parsed here while up to `jobs` of them are pushed to IPFS
+    # concurrently. CDXJ lines are assembled in the order records were read.
+    pending_pushes = deque()
+
+    # The asyncio client pushes records on its event loop instead, with as
+    # many in flight as its concurrency
+    store = content_store()
+    push_async = isinstance(store, AsyncIPFSStore) and batch_size <= 1
+    pushes_in_flight = store.concurrency if push_async else jobs
+
+    # With a `batch_size` above one, the header and payload objects of
+    # several records are added to IPFS in one request
+    batch = []
+    batch_object_count = batch_byte_count = 0
+
+    # WARC-Payload-Digest of payloads pushed in this run -> PendingRecord
+    # while the push is pending, (payload IPFS hash, title) once it is done
+    if payload_cids is None:
+        payload_cids = {}
+
+    # Digest of a stored header template -> PendingRecord first pushing it
+    header_template_cids = {}
+
+    # A journal left by an interrupted run has the lines of the records
+    # before its offset, indexing carries on from there
+    journal = None
+    if journal_dir and not from_stdin:
+        journal = IndexJournal(
+            journal_path(journal_dir, warc_path, range_start))
+        yield from journal.cdxj_lines()
+        for (payload_digest, (payload_hash, title)) in \
+                journal.payloads.items():
+            payload_cids.setdefault(payload_digest, (payload_hash, title))
+        if deferred_revisits is not None:
+            deferred_revisits.extend(
+                (warc_path, offset) for offset in journal.deferred_offsets)
+
+    codec = get_codec(enc_comp_opts)
+
+    cid_cache = None
+    if cid_cache_path:
+        cid_cache = CIDCache(
+            cid_cache_path, settings.App.config('ipfs_add_options'),
+            store_identity())
+    with (contextlib.nullcontext(sys.stdin.buffer) if from_stdin else
+          open(warc_path, 'rb')) as fh, \
+            ThreadPoolExecutor(max_workers=jobs) as executor, \
+            cid_cache or contextlib.nullcontext(), \
+            journal or contextlib.nullcontext():
+        if not from_stdin:
+            fh.seek(max(journal.offset, range_start) if journal else
+                    range_start)
+        start_offset = range_start if from_stdin else fh.tell()
+        counted_offset = start_offset
 
-    with open(warc_path, 'rb') as fh:
-        cdxj_lines = []
-        records_processed = 0
         # Throws pywb.warc.recordloader.ArchiveLoadFailed if not a warc
-        for record in ArchiveIterator(fh):
-            msg = f'Processing WARC records in {ntpath.basename(warc_path)}'
-            show_progress(msg, records_processed, record_count)
+        records = ArchiveIterator(fh)
+        for record in stats.timed('parse', records):
+            record_offset = records.offset
+            if range_end is not None and record_offset >= range_end:
+                break
+            progress.update(record_offset - range_start, record_count)
+            stats.count('warc_bytes', record_offset - counted_offset)
+            counted_offset = record_offset
 
-            records_processed += 1
             # Only consider WARC resps records from reqs for web resources
             ''' TODO: Change conditional to return on non-HTTP responses
                       to reduce branch depth'''
-            if record.rec_type != 'response' or \
+            if record.rec_type not in ('response', 'revisit') or \
                record.rec_headers.get_header('Content-Type') in \
                     ('text/dns', 'text/whois'):
                 continue
 
+            # Filtered out on its headers, before its payload is read
+            if record_filter and not record_filter.matches(record):
+                stats.count('filtered_records')
+                continue
+
+            # Payloads seen before in this run are not pushed again, the
+            # record reuses the payload hash of the record first seen with it.
+            # Encrypted payloads cannot be shared, each has its own nonce.
+            payload_digest = \
+                record.rec_headers.get_header('WARC-Payload-Digest')
+            payload_source = None
+            if payload_digest and \
+                    enc_comp_opts.get('encryption_key') is None:
+                payload_source = payload_cids.get(payload_digest)
+                if isinstance(payload_source, tuple):
+                    payload_source = journaled_payload_source(
+                        *payload_source)
+
+            # The record a revisit refers to may be in another range or a
+            # later WARC, the revisit is then indexed once all of them are
+            if record.rec_type == 'revisit' and payload_source is None and \
+                    record.http_headers is not None and \
+                    deferred_revisits is not None and not from_stdin:
+                deferred_revisits.append((warc_path, record_offset))
+                if journal:
+                    journal.add_deferred(record_offset)
+                continue
+
+            if record.rec_type == 'revisit' and (
+                    payload_source is None or record.http_headers is None):
+                log_error('Skipping revisit of ' +
+                          record.rec_headers.get_header('WARC-Target-URI') +
+                          ', its payload is not in this index')
+                stats.count('skipped_records')
+                continue
+
+            record_count += 1
+
             hstr = record.http_headers.to_str().strip()
+            header_delta = None
+            if header_templates:
+                (hstr, header_delta) = split_header(hstr)
 
             try:
                 status_code = record.http_headers.statusline.split()[0]
             except Exception as _:  # TODO: Do not use bare except
                 break
 
-            payload = record.content_stream().read()
-
-            title = None
-            try:
-                ctype = record.http_headers.get_header('content-type')
-                if ctype and ctype.lower().startswith('text/html'):
-                    title = BeautifulSoup(payload, 'html.parser').title
-                    if title is not None:
-                        title = ' '.join(title.text.split()) or None
-            except Exception as e:
-                print('Failed to extract title', file=sys.stderr)
-                print(e, file=sys.stderr)
-
-            http_header_ipfs_hash = ''
-            payload_ipfs_hash = ''
-            retry_count = 0
-            nonce = ''
-
-            if enc_comp_opts.get('encrypt_THEN_compress'):
-                if enc_comp_opts.get('encryption_key') is not None:
-                    key = enc_comp_opts.get('encryption_key')
-                    (hstr, payload, nonce) = encrypt(hstr, payload, key)
-                if enc_comp_opts.get('compression_level') is not None:
-                    compression_level = enc_comp_opts.get('compression_level')
-                    hstr = zlib.compress(hstr, compression_level)
-                    payload = zlib.compress(payload, compression_level)
+            # Large payloads are streamed to IPFS a chunk at a time rather
+            # than being read into memory whole
+            stream_payload = False
+            if payload_source is None:
+                with stats.timer('parse'):
+                    payload_stream = record.content_stream()
+                    if (record.length or 0) > stream_threshold:
+                        payload = payload_stream.read(STREAM_CHUNK_SIZE)
+                        stream_payload = len(payload) == STREAM_CHUNK_SIZE
+                    else:
+                        payload = payload_stream.read()
+                title = None
+                if titles:
+                    with stats.timer('titles'):
+                        title = extract_title(record, payload)
             else:
-                if enc_comp_opts.get('compression_level') is not None:
-                    compression_level = enc_comp_opts.get('compression_level')
-                    hstr = zlib.compress(hstr, compression_level)
-                    payload = zlib.compress(payload, compression_level)
-                if enc_comp_opts.get('encryption_key') is not None:
-                    encryption_key = enc_comp_opts.get('encryption_key')
-                    (hstr, payload, nonce) = \
-                        encrypt(hstr, payload, encryption_key)
-
-            # print(f'Adding {entry.get("url")} to IPFS')
-            ipfs_hashes = push_to_ipfs(hstr, payload)
-
-            if ipfs_hashes is None:
-                log_error('Skipping ' +
-                          record.rec_headers.get_header('WARC-Target-URI'))
-
-                continue
+                payload = None
+                title = payload_source.obj.get('title')
+
+            if stream_payload:
+                payload_chunks = itertools.chain([payload], stats.timed(
+                    'parse', iter(
+                        lambda: payload_stream.read(STREAM_CHUNK_SIZE), b'')))
+                (hstr, payload_chunks, nonce) = encrypt_and_compress_stream(
+                    hstr, payload_chunks, stats, **enc_comp_opts)
+            else:
+                (hstr, payload, nonce) = encrypt_and_compress(
+                    hstr, payload, stats, **enc_comp_opts)
 
-            (http_header_ipfs_hash, payload_ipfs_hash) = ipfs_hashes
+            # Templates shared with an earlier record are not pushed again
+            header_source = None
+            if header_templates:
+                header_template_digest = cid_cache_digest(hstr)
+                header_source = header_template_cids.get(
+                    header_template_digest)
 
             original_uri = record.rec_headers.get_header('WARC-Target-URI')
             original_uri_surted = \
@@ -275,8 +1057,6 @@ def cdx_cdxj_lines_from_file(warc_path, **enc_comp_opts):
                 record.rec_headers.get_header('WARC-Date'))
             mime = record.http_headers.get_header('content-type')
             obj = {
-                'locator':
-                    f'urn:ipfs/{http_header_ipfs_hash}/{payload_ipfs_hash}',
                 'status_code': status_code,
                 'mime_type': mime or '',
                 'original_uri': original_uri
@@ -285,22 +1065,384 @@ def cdx_cdxj_lines_from_file(warc_path, **enc_comp_opts):
                 obj['encryption_key'] = enc_comp_opts.get('encryption_key')
                 obj['encryption_method'] = 'aes'
                 obj['encryption_nonce'] = nonce
+                obj['encryption_format'] = enc_comp_opts.get(
+                    'encryption_format', ENCRYPTION_FORMAT_RAW)
+            if codec is not None:
+                obj['compression_method'] = codec.name
+                if enc_comp_opts.get('encryption_key') is not None and \
+                        not enc_comp_opts.get('encrypt_THEN_compress'):
+                    obj['compressed_before_encryption'] = True
+            if header_delta:
+                obj['header_delta'] = header_delta
             if title is not None:
                 obj['title'] = title
 
-            obj_jSON = json.dumps(obj)
+            pending_record = PendingRecord(
+                f'{original_uri_surted} {timestamp}', obj, payload_source,
+                header_source)
+            # Records with empty payloads are not pushed (py-ipfs-api issue
+            # #137), their templates would have no hash to share
+            if header_templates and header_source is None and \
+                    (payload is None or len(payload) > 0):
+                header_template_cids[header_template_digest] = pending_record
+            if header_source is not None:
+                hstr = None
+            if payload_digest and payload_source is None and \
+                    enc_comp_opts.get('encryption_key') is None:
+                payload_cids[payload_digest] = pending_record
+                pending_record.payload_digest = payload_digest
 
-            cdxj_line = f'{original_uri_surted} {timestamp} {obj_jSON}'
-            cdxj_lines.append(cdxj_line)  # + '\n'
-        return cdxj_lines
+            # print(f'Adding {entry.get("url")} to IPFS')
+            if stream_payload:
+                # Keep CDXJ lines in record order
+                if batch:
+                    submit_batch(executor, batch, pending_pushes, cid_cache,
+                                 stats)
+                    batch = []
+                    batch_object_count = batch_byte_count = 0
+
+                # The payload must be read before moving to the next record
+                pending_record.push_future = Future()
+                pending_record.push_future.set_result(push_streamed_to_ipfs(
+                    hstr, payload_chunks, cid_cache, stats))
+                pending_pushes.append(pending_record)
+            elif push_async:
+                pending_record.push_future = store.submit(push_to_ipfs_async(
+                    store, hstr, payload, cid_cache, stats))
+                pending_pushes.append(pending_record)
+            elif batch_size <= 1:
+                pending_record.push_future = executor.submit(
+                    push_to_ipfs, hstr, payload, cid_cache, stats)
+                pending_pushes.append(pending_record)
+            else:
+                batch.append((hstr, payload, pending_record))
+                for obj in (hstr, payload):
+                    if obj is not None:
+                        batch_object_count += 1
+                        batch_byte_count += len(obj)
+
+                if batch_object_count >= batch_size or \
+                        batch_byte_count >= batch_bytes:
+                    submit_batch(executor, batch, pending_pushes, cid_cache,
+                                 stats)
+                    batch = []
+                    batch_object_count = batch_byte_count = 0
+
+            # Indexing resumes after this record once its line is journaled
+            with stats.timer('parse'):
+                records.read_to_end()
+            pending_record.resume_offset = records.offset
+
+            # Bound the number of records held in memory awaiting a push
+            while len(pending_pushes) > pushes_in_flight * \
+                    PENDING_PUSHES_PER_JOB * max(batch_size // 2, 1):
+                cdxj_line = finish_pending_record(
+                    pending_pushes.popleft(), journal, stats, payload_cids)
+                if cdxj_line is not None:
+                    yield cdxj_line
+
+        if batch:
+            submit_batch(executor, batch, pending_pushes, cid_cache, stats)
+
+        while pending_pushes:
+            cdxj_line = finish_pending_record(
+                pending_pushes.popleft(), journal, stats, payload_cids)
+            if cdxj_line is not None:
+                yield cdxj_line
+
+        if range_end is None:
+            range_end = records.offset
+        if journal:
+            journal.checkpoint(range_end)
+
+    if range_start == 0:
+        stats.count('warcs')
+    stats.count('warc_bytes', range_end - counted_offset)
+    progress.update(range_end - range_start, record_count, force=True)
+    progress.finish()
+
+
+def extract_title(record, payload):
+    """Return the title of an HTML payload, if any"""
+    title = None
+    try:
+        ctype = record.http_headers.get_header('content-type')
+        if ctype and ctype.lower().startswith('text/html'):
+            (found, title) = scan_for_title(payload, ctype)
+            if not found:  # Fall back to parsing the whole document
+                title = BeautifulSoup(payload, 'html.parser').title
+                if title is not None:
+                    title = ' '.join(title.text.split()) or None
+    except Exception as e:
+        print('Failed to extract title', file=sys.stderr)
+        print(e, file=sys.stderr)
+
+    return title
+
+
+def scan_for_title(payload, content_type=''):
+    """
+    Look for the <title> of an HTML payload in its first TITLE_SCAN_BYTES.
+    Return (True, title) if the scan settles what the title is, title being
+    None if there is none, or (False, None) if the document must be parsed.
+    """
+    prefix = payload[:TITLE_SCAN_BYTES]
+    match = TITLE_PATTERN.search(prefix)
+
+    if match is None:
+        # No title if the whole payload was scanned or the <body> started
+        # before any <title>, otherwise the <head> may extend past the prefix
+        settled = len(payload) <= TITLE_SCAN_BYTES or (
+            BODY_START_PATTERN.search(prefix) is not None and
+            TITLE_START_PATTERN.search(prefix) is None)
+        return (settled, None)
+
+    charset = 'utf-8'
+    charset_match = CHARSET_PATTERN.search(to_bytes(content_type)) or \
+        CHARSET_PATTERN.search(prefix[:match.start()])
+    if charset_match:
+        try:
+            charset = codecs.lookup(charset_match.group(1).decode()).name
+        except LookupError:
+            pass
+
+    title = html.unescape(match.group(1).decode(charset, errors='replace'))
+
+    return (True, ' '.join(title.split()) or None)
 
 
-def generate_cdxj_metadata(cdxj_lines=None):
+def encrypt_and_compress(hstr, payload, stats=None, **enc_comp_opts):
+    """
+    Encrypt and/or compress the header and payload of a record in the order
+    set in `enc_comp_opts`. A payload of None is left as is.
+    """
+    payload_chunks = None if payload is None else [payload]
+    (hstr, payload_chunks, nonce) = encrypt_and_compress_stream(
+        hstr, payload_chunks, stats, **enc_comp_opts)
+
+    if payload_chunks is not None:
+        payload = b''.join(payload_chunks)
+
+    return (hstr, payload, nonce)
+
+
+def encrypt_and_compress_stream(hstr, payload_chunks, stats=None,
+                                **enc_comp_opts):
+    """
+    Like encrypt_and_compress(), but for a payload given as an iterable of
+    byte strings. The transformed payload is returned as an iterator that
+    encrypts and compresses one chunk at a time as it is consumed.
+    """
+    hstr = to_bytes(hstr)
+    encryption_key = enc_comp_opts.get('encryption_key')
+    encryption_format = enc_comp_opts.get(
+        'encryption_format', ENCRYPTION_FORMAT_RAW)
+    codec = get_codec(enc_comp_opts)
+    stats = stats or IndexStats()
+
+    cipher = None
+    nonce = ''
+    if encryption_key is not None:
+        with stats.timer('encryption'):
+            cipher = aes_cipher(encryption_key)
+        nonce = base64.b64encode(cipher.nonce).decode('utf-8')
+
+    # Payload chunks are transformed as they are consumed, which is timed
+    def compress():
+        nonlocal hstr, payload_chunks
+        if codec is not None:
+            with stats.timer('compression'):
+                hstr = codec.compress(hstr)
+            if payload_chunks is not None:
+                payload_chunks = stats.timed(
+                    'compression', codec.compress_chunks(payload_chunks))
+
+    def encrypt_with_key():
+        nonlocal hstr, payload_chunks
+        # The header is encrypted first, the payload continues its keystream
+        if cipher is not None:
+            with stats.timer('encryption'):
+                hstr = cipher.encrypt(hstr)
+                if encryption_format == ENCRYPTION_FORMAT_BASE64:
+                    hstr = base64.b64encode(hstr)
+            if payload_chunks is not None:
+                payload_chunks = stats.timed('encryption', encrypt_chunks(
+                    payload_chunks, cipher, encryption_format))
+
+    if enc_comp_opts.get('encrypt_THEN_compress'):
+        encrypt_with_key()
+        compress()
+    else:
+        compress()
+        encrypt_with_key()
+
+    if payload_chunks is not None:
+        payload_chunks = iter(payload_chunks)
+
+    return (hstr, payload_chunks, nonce)
+
+
+def get_codec(enc_comp_opts):
+    """The compression codec set in `enc_comp_opts`, None if there is none"""
+    compression_level = enc_comp_opts.get('compression_level')
+    if compression_level is None:
+        return None
+
+    return compression.get_codec(
+        enc_comp_opts.get('compression_codec', compression.ZLIB),
+        compression_level, enc_comp_opts.get('compression_dictionary'))
+
+
+def encrypt_chunks(chunks, cipher,
+                   encryption_format=ENCRYPTION_FORMAT_BASE64):
+    """
+    Encrypt chunks, base64 encoding the ciphertext if that is the
+    `encryption_format`, as payloads were before raw ciphertext
+    """
+    if encryption_format == ENCRYPTION_FORMAT_RAW:
+        for chunk in chunks:
+            yield cipher.encrypt(to_bytes(chunk))
+        return
+
+    remainder = b''
+    for chunk in chunks:
+        ciphertext = remainder + cipher.encrypt(to_bytes(chunk))
+        # Base64 encode whole 3 byte groups so chunks concatenate cleanly
+        cut = len(ciphertext) - len(ciphertext) % 3
+        remainder = ciphertext[cut:]
+        if cut:
+            yield base64.b64encode(ciphertext[:cut])
+
+    yield base64.b64encode(remainder)
+
+
+class PendingRecord:
+    """A record whose CDXJ line awaits its header and payload IPFS hashes"""
+
+    def __init__(self, cdxj_key, obj, payload_source=None,
+                 header_source=None):
+        self.cdxj_key = cdxj_key
+        self.obj = obj
+        # Record whose payload hash is reused, if the payload was not pushed
+        self.payload_source = payload_source
+        # Record whose header template hash is reused, likewise
+        self.header_source = header_source
+        self.push_future = None
+        self.batch_index = None
+        # WARC-Payload-Digest of the payload, if other records may reuse it
+        self.payload_digest = None
+        # WARC offset to resume indexing from once this record is done
+        self.resume_offset = None
+
+    def ipfs_hashes(self):
+        """Wait for the push of the record, return its IPFS hashes or None"""
+        ipfs_hashes = self.push_future.result()
+        if self.batch_index is not None:
+            ipfs_hashes = ipfs_hashes[self.batch_index]
+
+        return ipfs_hashes
+
+
+def journaled_payload_source(payload_hash, title=None):
+    """Stand in for the record a payload was pushed for earlier"""
+    payload_source = PendingRecord(None, {} if title is None else {
+        'title': title})
+    payload_source.push_future = Future()
+    payload_source.push_future.set_result([None, payload_hash])
+
+    return payload_source
+
+
+def submit_batch(executor, batch, pending_pushes, cid_cache=None,
+                 stats=None):
+    """Push a batch of records to IPFS in one request on the `executor`"""
+    push_future = executor.submit(
+        push_batch_to_ipfs,
+        [(hstr, payload) for (hstr, payload, _) in batch], cid_cache, stats)
+
+    for idx, (_, _, pending_record) in enumerate(batch):
+        pending_record.push_future = push_future
+        pending_record.batch_index = idx
+        pending_pushes.append(pending_record)
+
+
+def assemble_cdxj_line(pending_record):
+    """
+    Wait for the IPFS push of a record to finish and return its CDXJ line,
+    or None if the record could not be added to IPFS
+    """
+    ipfs_hashes = pending_record.ipfs_hashes()
+
+    sources = (pending_record.header_source, pending_record.payload_source)
+    for (idx, source) in enumerate(sources):
+        if ipfs_hashes is not None and source is not None:
+            source_ipfs_hashes = source.ipfs_hashes()
+            if source_ipfs_hashes is None:
+                ipfs_hashes = None
+            else:
+                ipfs_hashes = list(ipfs_hashes)
+                ipfs_hashes[idx] = source_ipfs_hashes[idx]
+
+    if ipfs_hashes is None:
+        log_error('Skipping ' + pending_record.obj['original_uri'])
+        return None
+
+    (http_header_ipfs_hash, payload_ipfs_hash) = ipfs_hashes
+    obj = {
+        'locator': f'urn:ipfs/{http_header_ipfs_hash}/{payload_ipfs_hash}',
+        **pending_record.obj
+    }
+    obj_jSON = json.dumps(obj)
+
+    return f'{pending_record.cdxj_key} {obj_jSON}'
+
+
+def finish_pending_record(pending_record, journal=None, stats=None,
+                          payload_cids=None):
+    """
+    Assemble the CDXJ line of a record and journal it, if journaling. The
+    record is replaced in `payload_cids` by its payload hash and title, so
+    only records awaiting a push are kept in memory.
+    """
+    cdxj_line = assemble_cdxj_line(pending_record)
+    if stats is not None:
+        stats.count('skipped_records' if cdxj_line is None else 'records')
+
+    payload_digest = pending_record.payload_digest
+    if payload_cids is not None and payload_digest and \
+            payload_cids.get(payload_digest) is pending_record:
+        ipfs_hashes = pending_record.ipfs_hashes()
+        if ipfs_hashes is None:
+            # Pushed by the next record with the payload instead
+            del payload_cids[payload_digest]
+        else:
+            payload_cids[payload_digest] = (
+                ipfs_hashes[1], pending_record.obj.get('title'))
+
+    if journal is not None:
+        payload = None
+        if cdxj_line is not None and pending_record.payload_digest:
+            payload = (pending_record.payload_digest,
+                       pending_record.ipfs_hashes()[1],
+                       pending_record.obj.get('title'))
+        journal.add(cdxj_line, pending_record.resume_offset, payload)
+
+    return cdxj_line
+
+
+def generate_cdxj_metadata(cdxj_lines=None, compression_dictionaries=None,
+                           ipfs_add_options=None):
     metadata = ['!context ["https://tools.ietf.org/html/rfc7089"]']
     meta_vals = {
         'generator': f'InterPlanetary Wayback {ipwb_version}',
         'created_at': datetime.datetime.now().isoformat()
     }
+    if compression_dictionaries:
+        # zstd dictionary ID -> IPFS hash of the dictionary
+        meta_vals['compression_dictionaries'] = compression_dictionaries
+    if ipfs_add_options:
+        # How records were added to IPFS, e.g. their CID version
+        meta_vals['ipfs_add_options'] = ipfs_add_options
     meta_vals = f'!meta {json.dumps(meta_vals)}'
     metadata.append(meta_vals)
 
@@ -332,29 +1474,18 @@ def verify_daemon_is_alive(host_and_port):
 
 
 def verify_file_exists(warc_path):
-    if os.path.isfile(warc_path):
+    if warc_path == STDIN_PATH or os.path.isfile(warc_path):
         return
     log_error(f'File at {warc_path} does not exist!')
     sys.exit()
 
 
-def show_progress(msg, i, n):
-    line = f'{msg}: {i}/{n}'
-    print(line, file=sys.stderr, end='\r')
-    # Clear status line, show complete msg
-    if i == n - 1:
-        final_msg = f'{msg} complete'
-        space_delta = len(final_msg) - len(msg)
-        spaces = '' * space_delta if space_delta > 0 else ''
-        print(final_msg + spaces, file=sys.stderr, end='\r\n')
-
-
 def log_error(err_in, end='\n'):
     print(err_in, file=sys.stderr, end=end)
 
 
 def pull_from_ipfs(hash_in):
-    return ipfs_client().cat(hash_in)
+    return content_store().get(hash_in)
 
 
 def push_bytes_to_ipfs(bytes_in):
@@ -364,7 +1495,7 @@ def push_bytes_to_ipfs(bytes_in):
     """
     # Returns unicode in py2.7, str in py3.7
     try:
-        res = ipfs_client().add_bytes(bytes_in)  # bytes)
+        res = content_store().put(bytes_in)
     except TypeError as _:
         print('fail')
         log_error('IPFS_API had an issue pushing the item to IPFS')
@@ -388,6 +1519,62 @@ def push_bytes_to_ipfs(bytes_in):
     return res[0]['Hash']
 
 
+def push_objects_to_ipfs(objects):
+    """
+    Add several byte strings to the content store, in one request if it is
+    IPFS, and return their hashes in the order the byte strings were supplied
+    """
+    return content_store().put_many(objects)
+
+
+def push_bytes_to_ipfs_cached(bytes_in, cid_cache=None):
+    """Push bytes to IPFS unless `cid_cache` has their hash already"""
+    if cid_cache is None:
+        return push_bytes_to_ipfs(bytes_in)
+
+    content_digest = cid_cache_digest(bytes_in)
+    ipfs_hash = cid_cache.get(content_digest)
+    if ipfs_hash is None:
+        ipfs_hash = push_bytes_to_ipfs(bytes_in)
+        if ipfs_hash is not None:
+            cid_cache.put(content_digest, ipfs_hash)
+
+    return ipfs_hash
+
+
+async def push_bytes_to_ipfs_cached_async(store, bytes_in, cid_cache=None):
+    """Like push_bytes_to_ipfs_cached(), with an AsyncIPFSStore"""
+    content_digest = None
+    if cid_cache is not None:
+        content_digest = cid_cache_digest(bytes_in)
+        ipfs_hash = cid_cache.get(content_digest)
+        if ipfs_hash is not None:
+            return ipfs_hash
+
+    ipfs_hash = await store.put_async(bytes_in)
+    if cid_cache is not None:
+        cid_cache.put(content_digest, ipfs_hash)
+
+    return ipfs_hash
+
+
+def push_objects_to_ipfs_cached(objects, cid_cache=None):
+    """Push those of `objects` whose hashes `cid_cache` lacks to IPFS"""
+    if cid_cache is None:
+        return push_objects_to_ipfs(objects)
+
+    content_digests = [cid_cache_digest(bytes_in) for bytes_in in objects]
+    ipfs_hashes = [cid_cache.get(d) for d in content_digests]
+
+    uncached = [idx for idx, h in enumerate(ipfs_hashes) if h is None]
+    pushed_hashes = push_objects_to_ipfs([objects[idx] for idx in uncached])
+    for idx, ipfs_hash in zip(uncached, pushed_hashes):
+        ipfs_hashes[idx] = ipfs_hash
+        cid_cache.put(content_digests[idx], ipfs_hash)
+
+    return ipfs_hashes
+
+
 def write_file(filename, content):
     with open(filename, 'w') as tmp_file:
         tmp_file.write(content)
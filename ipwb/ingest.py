@@ -0,0 +1,160 @@
+"""
+Continuous ingest of the WARCs dropped into a spool directory
+
+The directory is polled for WARCs that are closed, i.e. not modified for a
+while and not named like files still being written (.open, .tmp or hidden
+files). They are indexed in batches with indexer.index_file_at(), whose
+worker processes index the WARCs of a batch in parallel and whose merge
+atomically replaces the index, so replay sees either the index before or
+after a batch. The WARCs of each merged batch are recorded next to the
+index so they are not indexed again. A batch interrupted before it is
+merged is resumed from its journals on the next run. A batch that fails
+is logged and merged again without the WARCs that went away meanwhile.
+"""
+
+import json
+import os
+import time
+
+from ipwb import indexer
+
+WARC_SUFFIXES = ('.warc', '.warc.gz')
+
+DEFAULT_POLL_SECONDS = 5
+# WARCs are taken as closed once unmodified for this long
+DEFAULT_SETTLE_SECONDS = 30
+# A batch is merged once it has this many WARCs or is this old
+DEFAULT_BATCH_WARCS = 16
+DEFAULT_BATCH_SECONDS = 60
+
+
+def ingested_path(index_path):
+    """Path of the record of the WARCs merged into an index"""
+    return f'{index_path}.ingested'
+
+
+def warc_signature(warc_path):
+    """What tells a WARC from another later put at the same path"""
+    stat = os.stat(warc_path)
+    return (os.path.abspath(warc_path), stat.st_size, stat.st_mtime_ns)
+
+
+def read_ingested(index_path):
+    """Return the signatures of the WARCs merged into an index"""
+    ingested = set()
+    try:
+        with open(ingested_path(index_path)) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                    ingested.add(
+                        (entry['path'], entry['size'], entry['mtime_ns']))
+                except (KeyError, ValueError):
+                    continue  # Cut short by a crash
+    except FileNotFoundError:
+        pass
+
+    return ingested
+
+
+def record_ingested(index_path, signatures):
+    with open(ingested_path(index_path), 'a') as f:
+        for (path, size, mtime_ns) in signatures:
+            f.write(json.dumps(
+                {'path': path, 'size': size, 'mtime_ns': mtime_ns}) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def closed_warcs(watch_dir, settle_seconds=DEFAULT_SETTLE_SECONDS):
+    """Return the paths of the closed WARCs in a directory, oldest first"""
+    now = time.time()
+    warcs = []
+    for entry in os.scandir(watch_dir):
+        if entry.name.startswith('.') or \
+                not entry.name.endswith(WARC_SUFFIXES) or \
+                not entry.is_file():
+            continue
+
+        try:
+            mtime = entry.stat().st_mtime
+        except FileNotFoundError:
+            continue  # Moved away since it was listed
+        if now - mtime >= settle_seconds:
+            warcs.append((mtime, entry.path))
+
+    return [warc_path for (_, warc_path) in sorted(warcs)]
+
+
+def unchanged_warcs(batch):
+    """The WARCs of a batch still as they were when batched"""
+    unchanged = {}
+    for (signature, warc_path) in batch.items():
+        try:
+            if warc_signature(warc_path) == signature:
+                unchanged[signature] = warc_path
+        except FileNotFoundError:
+            pass
+
+    return unchanged
+
+
+def ingest(watch_dir, index_path, processes=1,
+           poll_seconds=DEFAULT_POLL_SECONDS,
+           settle_seconds=DEFAULT_SETTLE_SECONDS,
+           batch_warcs=DEFAULT_BATCH_WARCS,
+           batch_seconds=DEFAULT_BATCH_SECONDS, once=False, **index_opts):
+    """
+    Index the WARCs put in `watch_dir` into `index_path` as they are closed.
+    With `once`, index the WARCs closed by now and return.
+    """
+    ingested = read_ingested(index_path)
+    batch = {}  # Signature -> path
+    batch_started = None
+
+    while True:
+        for warc_path in closed_warcs(watch_dir, settle_seconds):
+            try:
+                signature = warc_signature(warc_path)
+            except FileNotFoundError:
+                continue
+            if signature in ingested or signature in batch:
+                continue
+
+            if not batch:
+                batch_started = time.monotonic()
+            batch[signature] = warc_path
+            if len(batch) >= batch_warcs:
+                break
+
+        if batch and (once or len(batch) >= batch_warcs or
+                      time.monotonic() - batch_started >= batch_seconds):
+            indexer.log_error(f'Merging {len(batch)} WARC(s) into '
+                              f'{index_path}')
+            try:
+                indexer.index_file_at(
+                    list(batch.values()), outfile=index_path,
+                    processes=processes, resume=True, **index_opts)
+            # The indexer exits on some errors, e.g. a WARC moved away
+            except (Exception, SystemExit) as e:
+                indexer.log_error(f'Merging into {index_path} failed: {e!r}')
+                # WARCs gone or changed since are dropped, the others are
+                # merged again
+                unchanged = unchanged_warcs(batch)
+                if len(unchanged) < len(batch):
+                    batch = unchanged
+                    continue
+                if once:
+                    return
+                time.sleep(poll_seconds)
+                continue
+
+            record_ingested(index_path, batch)
+            ingested.update(batch)
+            batch = {}
+            continue  # More WARCs may be waiting already
+
+        if once:
+            return
+
+        time.sleep(poll_seconds)
@@ -0,0 +1,161 @@
+"""
+Checkpoint journals that let an interrupted indexing run be resumed
+
+CDXJ lines are only written to the outfile once every WARC is indexed. So
+that a crash does not lose hours of work, each WARC has a journal where its
+finished CDXJ lines are appended, followed every so often by a checkpoint
+holding the byte offset in the WARC from which indexing can carry on. The
+journal also remembers the payloads pushed so far, for later revisit
+records to refer to, and the offsets of the revisits that are indexed once
+all WARCs are because their payloads were not pushed yet. Those revisits
+are not journaled themselves, a resumed run indexes them again. Anything
+written after the last checkpoint is discarded when the journal is opened
+again.
+"""
+
+import hashlib
+import json
+import os
+import time
+
+# Journal lines that are not CDXJ lines start with this
+JOURNAL_ENTRY_PREFIX = '@'
+
+# Finished CDXJ lines are made durable at least this often
+CHECKPOINT_SECONDS = 10
+CHECKPOINT_INTERVAL = 1000
+
+
+def default_journal_dir(outfile):
+    return f'{outfile}.journal'
+
+
+def journal_path(journal_dir, warc_path, range_start=0):
+    """
+    Path of the journal of a WARC, unique to the WARC's location and the
+    start of the byte range of it indexed
+    """
+    warc_path = os.path.abspath(warc_path)
+    path_digest = hashlib.sha256(warc_path.encode()).hexdigest()[:16]
+    name = f'{os.path.basename(warc_path)}.{path_digest}'
+    if range_start:
+        name += f'.{range_start}'
+
+    return os.path.join(journal_dir, f'{name}.journal')
+
+
+class IndexJournal:
+    """Append-only log of the CDXJ lines indexed from a WARC"""
+
+    def __init__(self, path):
+        self.path = path
+        # Offset in the WARC up to which records are indexed
+        self.offset = 0
+        # WARC-Payload-Digest -> (payload IPFS hash, title)
+        self.payloads = {}
+        # Offsets of revisits indexed once all WARCs are
+        self.deferred_offsets = []
+        self.buffer = []
+        self.last_checkpoint = time.monotonic()
+
+        committed_size = self.load() if os.path.exists(path) else 0
+        self.checkpointed_offset = self.offset
+        self.file = open(path, 'a+')
+        self.file.truncate(committed_size)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def entries(self):
+        """Iterate the (kind, value) entries of the journal with their end"""
+        with open(self.path, 'rb') as journal:
+            position = 0
+            for line in journal:
+                position += len(line)
+                if not line.endswith(b'\n'):
+                    return  # Cut short by a crash
+
+                line = line.decode().rstrip('\n')
+                if line.startswith(JOURNAL_ENTRY_PREFIX):
+                    (kind, value) = line[1:].split(' ', 1)
+                    yield (kind, json.loads(value), position)
+                else:
+                    yield ('cdxj', line, position)
+
+    def load(self):
+        """Read the state at the last checkpoint, return where it ends"""
+        committed_size = 0
+        payloads = {}
+        deferred_offsets = []
+        for (kind, value, position) in self.entries():
+            if kind == 'payload':
+                payloads[value['digest']] = (value['hash'], value['title'])
+            elif kind == 'deferred':
+                deferred_offsets.append(value['offset'])
+            elif kind == 'checkpoint':
+                self.offset = value['offset']
+                self.payloads.update(payloads)
+                self.deferred_offsets += deferred_offsets
+                payloads = {}
+                deferred_offsets = []
+                committed_size = position
+
+        return committed_size
+
+    def cdxj_lines(self):
+        """Iterate the CDXJ lines up to the last checkpoint"""
+        cdxj_lines = []
+        for (kind, value, _) in self.entries():
+            if kind == 'cdxj':
+                cdxj_lines.append(value)
+            elif kind == 'checkpoint':
+                yield from cdxj_lines
+                cdxj_lines = []
+
+    def add(self, cdxj_line, offset, payload=None):
+        """
+        Journal the CDXJ line of a record, if any, and the WARC offset from
+        which indexing would resume once it is done. `payload` is the
+        (WARC-Payload-Digest, IPFS hash, title) of a payload pushed for it.
+        """
+        if cdxj_line is not None:
+            self.buffer.append(cdxj_line)
+        if payload is not None:
+            (payload_digest, payload_hash, title) = payload
+            entry = {'digest': payload_digest, 'hash': payload_hash,
+                     'title': title}
+            self.buffer.append(f'{JOURNAL_ENTRY_PREFIX}payload '
+                               f'{json.dumps(entry)}')
+        if offset is not None:
+            self.offset = offset
+
+        if len(self.buffer) >= CHECKPOINT_INTERVAL or \
+                time.monotonic() - self.last_checkpoint >= CHECKPOINT_SECONDS:
+            self.checkpoint()
+
+    def add_deferred(self, offset):
+        """Journal the offset of a revisit indexed once all WARCs are"""
+        entry = json.dumps({'offset': offset})
+        self.buffer.append(f'{JOURNAL_ENTRY_PREFIX}deferred {entry}')
+
+    def checkpoint(self, offset=None):
+        if offset is not None:
+            self.offset = offset
+
+        checkpoint = json.dumps({'offset': self.offset})
+        self.buffer.append(f'{JOURNAL_ENTRY_PREFIX}checkpoint {checkpoint}')
+        self.file.write(''.join(f'{line}\n' for line in self.buffer))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+        self.buffer = []
+        self.checkpointed_offset = self.offset
+        self.last_checkpoint = time.monotonic()
+
+    def close(self):
+        if self.buffer or self.offset != self.checkpointed_offset:
+            self.checkpoint()
+        self.file.close()
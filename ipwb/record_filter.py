@@ -0,0 +1,108 @@
+"""
+Filters deciding which WARC records are indexed
+
+Filters are given as FIELD:VALUE and are matched against the WARC and HTTP
+headers of a record, so records filtered out are never read, decompressed
+or pushed to IPFS. The fields are:
+
+    uri:REGEX       the WARC-Target-URI matches REGEX (re.search)
+    surt:PREFIX     the SURT of the URI starts with PREFIX
+    mime:TYPE       the Content-Type starts with TYPE, e.g. image/
+    status:CODE     the status code is CODE, x for any digit, e.g. 3xx
+    size:BYTES      the payload is at most BYTES long
+
+A record is indexed if it matches any include filter, or there are none,
+and matches no exclude filter.
+"""
+
+import re
+
+import surt
+
+FIELDS = ('uri', 'surt', 'mime', 'status', 'size')
+
+
+def parse_filter(spec):
+    """Return the (field, value) of a FIELD:VALUE filter"""
+    (field, sep, value) = spec.partition(':')
+    if not sep or field not in FIELDS:
+        raise ValueError(f'{spec} is not a filter of the form FIELD:VALUE '
+                         f'with FIELD one of {", ".join(FIELDS)}')
+
+    if field == 'uri':
+        try:
+            value = re.compile(value)
+        except re.error as e:
+            raise ValueError(f'{value} is not a regular expression: {e}')
+    elif field == 'mime':
+        value = value.lower()
+    elif field == 'status':
+        if not re.fullmatch(r'[0-9x]{3}', value.lower()):
+            raise ValueError(f'{value} is not a status code like 404 or 4xx')
+        value = value.lower()
+    elif field == 'size':
+        if not value.isdigit():
+            raise ValueError(f'{value} is not a number of bytes')
+        value = int(value)
+
+    return (field, value)
+
+
+class RecordFilter:
+    """Include and exclude filters, parsed with parse_filter()"""
+
+    def __init__(self, include=(), exclude=()):
+        self.include = list(include)
+        self.exclude = list(exclude)
+        self.needs_surt = any(field == 'surt' for (field, _) in
+                              self.include + self.exclude)
+
+    def __bool__(self):
+        return bool(self.include or self.exclude)
+
+    def matches(self, record):
+        """Whether the record passes the filters"""
+        fields = record_fields(record, self.needs_surt)
+        if self.include and not any(
+                field_matches(fields, f) for f in self.include):
+            return False
+
+        return not any(field_matches(fields, f) for f in self.exclude)
+
+
+def record_fields(record, with_surt=False):
+    """The fields filters are matched against, from a record's headers"""
+    uri = record.rec_headers.get_header('WARC-Target-URI') or ''
+    fields = {'uri': uri, 'mime': '', 'status': '', 'size': None}
+    if with_surt:
+        fields['surt'] = surt.surt(
+            uri, path_strip_trailing_slash_unless_empty=False)
+
+    if record.http_headers is not None:
+        fields['mime'] = (record.http_headers.get_header(
+            'content-type') or '').lower()
+        fields['status'] = record.http_headers.get_statuscode() or ''
+
+    # -1 when warcio could not tell the length of the payload
+    payload_length = getattr(record, 'payload_length', -1)
+    if payload_length is not None and payload_length >= 0:
+        fields['size'] = payload_length
+    elif record.length is not None:
+        fields['size'] = record.length
+
+    return fields
+
+
+def field_matches(fields, record_filter):
+    (field, value) = record_filter
+    if field == 'uri':
+        return value.search(fields['uri']) is not None
+    elif field == 'surt':
+        return fields['surt'].startswith(value)
+    elif field == 'mime':
+        return fields['mime'].startswith(value)
+    elif field == 'status':
+        return len(fields['status']) == 3 and all(
+            v in ('x', s) for (v, s) in zip(value, fields['status']))
+
+    return fields['size'] is not None and fields['size'] <= value
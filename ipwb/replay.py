@@ -11,6 +11,7 @@ navigating their captures.
 
 import sys
 import os
+import functools
 import importlib.resources
 import ipfshttpclient as ipfsapi
 import json
@@ -19,9 +20,10 @@ import surt
 import re
 import traceback
 import tempfile
+import queue
 
 from flask import (
-    Flask, Response, request, redirect, render_template,
+    Flask, Response, request, redirect, render_template, url_for,
 )
 
 from bisect import bisect_left
@@ -34,9 +36,14 @@ from urllib.parse import urlsplit, urlunsplit
 from requests.exceptions import HTTPError
 from ipfshttpclient.exceptions import ConnectionError
 
+from . import compression
 from . import util as ipwb_utils
 from .backends import get_web_archive_index
-from .exceptions import IPFSDaemonNotAvailable
+from .cdxj import find_cdxj_shard, read_cdxj_manifest, read_cdxj_meta
+from .content_store import content_store
+from .exceptions import ContentNotFound, IPFSDaemonNotAvailable
+from .headers import join_header
+from .index_jobs import IndexJobQueue
 from .util import unsurt, ipfs_client
 from .util import IPWBREPLAY_HOST, IPWBREPLAY_PORT
 from .util import INDEX_FILE
@@ -44,12 +51,6 @@ from .util import MementoMatch
 
 from . import indexer
 
-from base64 import b64decode
-from Crypto.Cipher import AES
-from Crypto.Util.Padding import pad
-
-import base64
-
 from werkzeug.routing import BaseConverter
 from .__init__ import __version__ as ipwb_version
 from . import settings
@@ -71,6 +72,9 @@ app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.debug = False
 
+# Uploaded WARCs waiting to be indexed into the replayed index
+upload_jobs = IndexJobQueue()
+
 
 @app.context_processor
 def formatters():
@@ -105,22 +109,47 @@ def upload_file():
         flash('No selected file')
         return resp
     if file and allowed_file(file.filename):
-        filename = secure_filename(file.filename)
-        warc_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+        # Unique, so uploads of WARCs of the same name do not collide
+        (fd, warc_path) = tempfile.mkstemp(
+            suffix=f'-{secure_filename(file.filename)}',
+            dir=app.config['UPLOAD_FOLDER'])
+        os.close(fd)
         file.save(warc_path)
 
-        # TODO: Check if semaphore lock exists, log it if so, wait for the lock
-        # to be released, and create a new lock
+        # Indexed in the background, one upload at a time
+        try:
+            job = upload_jobs.submit(warc_path, app.cdxj_file_path)
+        except queue.Full:
+            os.remove(warc_path)
+            return Response('Too many uploads are waiting to be indexed, '
+                            'try again later', status=503,
+                            headers={'Retry-After': '60'})
+
+        print(f'Queued uploaded WARC at {warc_path} to be indexed into '
+              f'{app.cdxj_file_path} as job {job.id}')
+        status_url = url_for('upload_status', job_id=job.id)
 
-        print((f'Indexing file from uploaded WARC at'
-               f'{warc_path} to {app.cdxj_file_path}'))
-        indexer.index_file_at(warc_path, outfile=app.cdxj_file_path)
-        print(f'Index updated at {app.cdxj_file_path}')
+        # The upload forms of the pages are sent back to the page they are
+        # on, only API clients get the job's status
+        if request.accept_mimetypes.best_match(
+                ['application/json', 'text/html']) == 'text/html':
+            return redirect(
+                request.referrer or url_for('show_landing_page'))
 
-        # TODO: Release semaphore lock
-        resp.location = request.referrer
+        return Response(
+            json.dumps({**upload_jobs.status(job), 'status_url': status_url}),
+            status=202, mimetype='application/json',
+            headers={'Location': status_url})
 
-        return resp
+
+@app.route('/upload/status/<job_id>')
+def upload_status(job_id):
+    job = upload_jobs.get(job_id)
+    if job is None:
+        return Response(f'No upload job {job_id}', status=404)
+
+    return Response(json.dumps(upload_jobs.status(job)),
+                    mimetype='application/json')
 
 
 @app.route('/ipwbassets/<path:path>')
@@ -265,6 +294,7 @@ def getCDXJLinesWithURIR(urir, index_path, datetime=None):
 
     # Convert URI-R to surt
     surtedURIR = surt.surt(urir, path_strip_trailing_slash_unless_empty=True)
+    index_path = get_index_shard_path(index_path, surtedURIR)
 
     fobj = open(index_path, "rb")
     res = bin_search(fobj, surtedURIR.encode(), datetime)
@@ -407,6 +437,7 @@ def get_cdxj_lines_with_urir(urir, index_path):
 
     print(f'Getting CDXJ lines with {urir} in {index_path}')
     s = surt.surt(urir, path_strip_trailing_slash_unless_empty=False)
+    index_path = get_index_shard_path(index_path, s)
     cdxj_lines_with_urir = []
 
     cdxj_line_index = get_cdxj_line_binary_search(
@@ -709,8 +740,9 @@ def show_landing_page():
 
 
 def show_uri(path, datetime=None):
+    store = content_store()
     try:
-        ipwb_utils.check_daemon_is_alive()
+        store.check_available()
 
     except IPFSDaemonNotAvailable:
         err_str = ('IPFS daemon not running. '
@@ -720,6 +752,9 @@ def show_uri(path, datetime=None):
 
         return Response(err_str, status=503)
 
+    except ContentNotFound as e:
+        return Response(str(e), status=503)
+
     cdxj_line = ''
     try:
         surted_uri = surt.surt(
@@ -762,8 +797,8 @@ def show_uri(path, datetime=None):
         #    signal.signal(signal.SIGALRM, handler)
         #    signal.alarm(10)
 
-        payload = ipfs_client().cat(digests[-1])
-        header = ipfs_client().cat(digests[-2])
+        # Fetched concurrently by stores that can
+        (header, payload) = store.get_many([digests[-2], digests[-1]])
 
         # if os.name != 'nt':  # Bug #310
         #    signal.alarm(0)
@@ -783,6 +818,9 @@ def show_uri(path, datetime=None):
         print("Fetching from the IPFS failed")
         print(e)
         return "Fetching from IPFS failed", 503
+    except ContentNotFound:
+        print(f"Hashes not found:\n\t{digests[-1]}\n\t{digests[-2]}")
+        return Response("Hashes not found", status=404)
     except HashNotFoundError:
         if payload is None:
             print(f"Hashes not found:\n\t{digests[-1]}\n\t{digests[-2]}")
@@ -796,6 +834,17 @@ def show_uri(path, datetime=None):
         print(sys.exc_info()[0])
         return "An unknown exception occurred", 500
 
+    # Transforms are undone in the reverse of the order they were applied
+    compressed_first = json_object.get('compressed_before_encryption', False)
+    compression_method = json_object.get('compression_method')
+    if compression_method and not compressed_first:
+        try:
+            (header, payload) = decompress_record(
+                header, payload, compression_method, index_path)
+        except (ContentNotFound, ImportError, ValueError) as e:
+            print(e)
+            return Response(str(e), status=500)
+
     if 'encryption_method' in json_object:
         key_string = None
         while key_string is None:
@@ -806,13 +855,29 @@ def show_uri(path, datetime=None):
                                ' containing decryption key: \n> ')
                 key_string = input(ask_for_key)
 
-        padded_encryption_key = pad(key_string, AES.block_size)
-        key = base64.b64encode(padded_encryption_key)
+        # Lines of earlier versions have base64 encoded ciphertext
+        encryption_format = json_object.get(
+            'encryption_format', indexer.ENCRYPTION_FORMAT_BASE64)
+        try:
+            (header, payload) = indexer.decrypt(
+                header, payload, key_string,
+                json_object['encryption_nonce'], encryption_format)
+        except ValueError as e:
+            print(e)
+            return Response(str(e), status=500)
+
+    if compression_method and compressed_first:
+        try:
+            (header, payload) = decompress_record(
+                header, payload, compression_method, index_path)
+        except (ContentNotFound, ImportError, ValueError) as e:
+            print(e)
+            return Response(str(e), status=500)
 
-        nonce = b64decode(json_object['encryption_nonce'])
-        cipher = AES.new(key, AES.MODE_CTR, nonce=nonce)
-        header = cipher.decrypt(base64.b64decode(header))
-        payload = cipher.decrypt(base64.b64decode(payload))
+    # Headers indexed as templates get the values cut from them back
+    if 'header_delta' in json_object:
+        header = join_header(
+            header.decode(), json_object['header_delta']).encode()
 
     h_lines = header.decode() \
         .replace('\r', '') \
@@ -877,6 +942,44 @@ def show_uri(path, datetime=None):
     return resp
 
 
+def decompress_record(header, payload, compression_method, index_path):
+    """Decompress the header and payload of a record with their codec"""
+    codec = compression.get_codec(compression_method)
+
+    decompressed = []
+    for bytes_in in (header, payload):
+        dictionary = None
+        if codec.name == compression.ZSTD:
+            dictionary = get_compression_dictionary(bytes_in, index_path)
+        decompressed.append(codec.decompress(bytes_in, dictionary))
+
+    return tuple(decompressed)
+
+
+def get_compression_dictionary(bytes_in, index_path):
+    """
+    Return the zstd dictionary a frame was compressed with, as listed in the
+    `!meta` line of the index, or None if it was compressed without one
+    """
+    dictionary_id = compression.frame_dictionary_id(bytes_in)
+    if dictionary_id == 0:
+        return None
+
+    index = get_web_archive_index(get_index_file_full_path(index_path))
+    dictionaries = read_cdxj_meta(index.split('\n')).get(
+        'compression_dictionaries', {})
+    if str(dictionary_id) not in dictionaries:
+        raise ContentNotFound(
+            f'Compression dictionary {dictionary_id} is not in the index')
+
+    return fetch_compression_dictionary(dictionaries[str(dictionary_id)])
+
+
+@functools.lru_cache(maxsize=8)
+def fetch_compression_dictionary(dictionary_hash):
+    return content_store().get(dictionary_hash)
+
+
 def is_uri(str):
     return re.match('^https?://', str, flags=re.IGNORECASE)
 
@@ -1023,6 +1126,15 @@ def get_index_file_full_path(cdxj_file_path=INDEX_FILE):
     return index_file_name
 
 
+def get_index_shard_path(index_path, surt_key):
+    """Return the shard of a sharded index with the lines of a SURT key"""
+    manifest = read_cdxj_manifest(index_path)
+    if manifest is None:
+        return index_path
+
+    return find_cdxj_shard(index_path, manifest, surt_key)
+
+
 def get_uris_and_datetimes_in_cdxj(cdxj_file_path=INDEX_FILE):
     index_file_contents = get_web_archive_index(cdxj_file_path)
 
@@ -1159,7 +1271,8 @@ def binary_search(haystack, needle, return_index=False, only_uri=False):
 
 def get_cdxj_line_binary_search(
          surt_uri, cdxj_file_path=INDEX_FILE, ret_index=False, only_uri=False):
-    full_file_path = get_index_file_full_path(cdxj_file_path)
+    full_file_path = get_index_shard_path(
+        get_index_file_full_path(cdxj_file_path), surt_uri.split(' ')[0])
 
     content = get_web_archive_index(full_file_path)
 
@@ -1182,8 +1295,9 @@ def start(cdxj_file_path, proxy=None, port=IPWBREPLAY_PORT):
     if not host_port:
         host_port = (IPWBREPLAY_HOST, port)
 
-    # This will throw an exception if daemon is not available.
-    ipwb_utils.check_daemon_is_alive()
+    # This will throw an exception if the daemon (or local store) is not
+    # available.
+    content_store().check_available()
 
     ipwb_utils.set_ipwb_replay_index_path(cdxj_file_path)
     app.cdxj_file_path = cdxj_file_path
@@ -42,9 +42,19 @@ logging_config.dictConfig(LOGGING)
 
 class App:
     __conf = {
-        "ipfsapi": IPFSAPI_MUTLIADDRESS
+        "ipfsapi": IPFSAPI_MUTLIADDRESS,
+        # Directory of a local content store used instead of IPFS, if set
+        "store": None,
+        # Requests in flight with the asyncio IPFS client, if it is used
+        "ipfs_concurrency": None,
+        # Options of `ipfs add` for indexing, the daemon's defaults if None
+        "ipfs_add_options": None,
+        # Replay's host, port and index when there is no IPFS config to keep
+        # them in, i.e. with a local store
+        "replay_config": None
     }
-    __setters = ["ipfsapi"]
+    __setters = ["ipfsapi", "store", "ipfs_concurrency", "ipfs_add_options",
+                 "replay_config"]
 
     @staticmethod
     def config(name):
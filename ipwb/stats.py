@@ -0,0 +1,176 @@
+"""
+Throughput statistics of indexing runs
+
+IndexStats counts what a run indexed and pushed and times its stages. Stage
+timers nest, e.g. reading a streamed payload from the WARC while pushing
+it, and the time of a nested stage is only counted towards that stage, so
+the stages add up to no more than the time spent in them. Pushes happen on
+several threads at once, so stage times are summed over threads.
+"""
+
+import contextlib
+import json
+import sys
+import threading
+import time
+
+STAGES = ('parse', 'titles', 'encryption', 'compression', 'push')
+COUNTS = ('warcs', 'records', 'skipped_records', 'filtered_records',
+          'warc_bytes', 'pushed_objects', 'pushed_bytes', 'retries',
+          'failed_pushes')
+
+# Progress lines are written to STDERR at most this often
+PROGRESS_INTERVAL = 0.5
+
+MB = 1024 * 1024
+
+
+class IndexStats:
+    def __init__(self):
+        self.counts = dict.fromkeys(COUNTS, 0)
+        self.stage_seconds = dict.fromkeys(STAGES, 0.0)
+        self.elapsed_seconds = 0.0
+        self.lock = threading.Lock()
+        # Stack of [start, seconds in nested stages] of each thread's timers
+        self.local = threading.local()
+
+    def __getstate__(self):
+        # Sent back from the processes of a process pool without the lock
+        return {'counts': self.counts, 'stage_seconds': self.stage_seconds,
+                'elapsed_seconds': self.elapsed_seconds}
+
+    def __setstate__(self, state):
+        self.__init__()
+        self.__dict__.update(state)
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counts[name] += n
+
+    @contextlib.contextmanager
+    def timer(self, stage):
+        """Count the time spent in the block towards `stage`"""
+        stack = self.local.__dict__.setdefault('timers', [])
+        timer = [time.perf_counter(), 0.0]
+        stack.append(timer)
+        try:
+            yield
+        finally:
+            stack.pop()
+            elapsed = time.perf_counter() - timer[0]
+            if stack:
+                stack[-1][1] += elapsed
+            with self.lock:
+                self.stage_seconds[stage] += elapsed - timer[1]
+
+    def add_seconds(self, stage, seconds):
+        """Count time towards `stage` that was measured elsewhere"""
+        with self.lock:
+            self.stage_seconds[stage] += seconds
+
+    def timed(self, stage, iterable):
+        """Iterate `iterable`, counting the time to get items to `stage`"""
+        iterator = iter(iterable)
+        while True:
+            with self.timer(stage):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def counted(self, name, chunks):
+        """Iterate byte strings, adding up their lengths in count `name`"""
+        for chunk in chunks:
+            self.count(name, len(chunk))
+            yield chunk
+
+    def merge(self, other):
+        with self.lock:
+            for name in COUNTS:
+                self.counts[name] += other.counts[name]
+            for stage in STAGES:
+                self.stage_seconds[stage] += other.stage_seconds[stage]
+
+    def rate(self, name):
+        if self.elapsed_seconds <= 0:
+            return 0.0
+
+        return self.counts[name] / self.elapsed_seconds
+
+    def as_dict(self):
+        return {
+            **self.counts,
+            'elapsed_seconds': round(self.elapsed_seconds, 3),
+            'records_per_second': round(self.rate('records'), 3),
+            'warc_bytes_per_second': round(self.rate('warc_bytes'), 3),
+            'stage_seconds': {stage: round(seconds, 3) for (stage, seconds)
+                              in self.stage_seconds.items()}
+        }
+
+    def report(self):
+        """Return a summary of the run for people to read"""
+        counts = self.counts
+        lines = [
+            f'Indexed {counts["records"]} records '
+            f'({counts["skipped_records"]} skipped, '
+            f'{counts["filtered_records"]} filtered out) from '
+            f'{counts["warcs"]} WARC(s) in {self.elapsed_seconds:.1f}s: '
+            f'{self.rate("records"):.1f} records/s, '
+            f'{self.rate("warc_bytes") / MB:.2f} MB/s of WARC',
+            f'Pushed {counts["pushed_objects"]} objects of '
+            f'{counts["pushed_bytes"] / MB:.2f} MB with '
+            f'{counts["retries"]} retries and {counts["failed_pushes"]} '
+            'failed pushes',
+            'Seconds per stage, summed over threads:'
+        ]
+        lines += [f'  {stage:<12}{seconds:>10.2f}'
+                  for (stage, seconds) in self.stage_seconds.items()]
+
+        return '\n'.join(lines)
+
+    def write_json(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.as_dict(), f, indent=2)
+            f.write('\n')
+
+
+class ProgressReporter:
+    """
+    Progress through `total` bytes of a WARC, written now and then. The
+    bytes done are written instead of a percentage if `total` is None.
+    """
+
+    def __init__(self, msg, total, interval=PROGRESS_INTERVAL):
+        self.msg = msg
+        self.total = total
+        self.interval = interval
+        self.start = time.monotonic()
+        self.last_report = None
+        self.line_length = 0
+
+    def update(self, done, records, force=False):
+        now = time.monotonic()
+        if not force and self.last_report is not None and \
+                now - self.last_report < self.interval:
+            return
+
+        self.last_report = now
+        if self.total is None:
+            done_str = f'{done / MB:.1f} MB'
+        else:
+            done_str = \
+                f'{100 * done // self.total if self.total > 0 else 100}%'
+        elapsed = max(now - self.start, 1e-9)
+        self.write(f'{self.msg}: {done_str} ({records} records, '
+                   f'{records / elapsed:.1f} records/s, '
+                   f'{done / elapsed / MB:.2f} MB/s)', end='\r')
+
+    def finish(self):
+        self.write(f'{self.msg} complete', end='\r\n')
+
+    def write(self, line, end):
+        # Pad to clear what is left of a longer line before it
+        padding = ' ' * max(self.line_length - len(line), 0)
+        print(line + padding, file=sys.stderr, end=end)
+        self.line_length = len(line)
@@ -0,0 +1,252 @@
+"""
+CIDs of content as `ipfs add` assigns them, computed without a daemon
+
+With the default settings of `ipfs add`, content is split into chunks of
+256 KiB. Each chunk is the data of a UnixFS file node. Chunks are linked from
+a balanced tree of dag-pb nodes with up to 174 links each, and the content's
+CID is the CIDv0 (base58 SHA-256 multihash) of the tree's root. Content that
+fits in a single chunk is a single node.
+
+The --cid-version, --raw-leaves, --chunker and --hash options of `ipfs add`
+change this. With raw leaves, chunks are blocks of their own with CIDv1 raw
+CIDs rather than being wrapped in UnixFS nodes. Only fixed size chunkers are
+supported here, content defined chunking is left to the daemon.
+"""
+
+import base64
+import hashlib
+
+CHUNK_SIZE = 256 * 1024
+MAX_LINKS = 174
+
+DEFAULT_CHUNKER = f'size-{CHUNK_SIZE}'
+DEFAULT_HASH = 'sha2-256'
+
+# Options of `ipfs add` that change the CIDs of content, unlike e.g. pin
+CID_ADD_OPTIONS = ('cid_version', 'raw_leaves', 'chunker', 'hash')
+
+# Hash functions of `ipfs add --hash` -> (multihash code, hashlib function)
+HASH_FUNCTIONS = {
+    'sha2-256': (0x12, hashlib.sha256),
+    'sha2-512': (0x13, hashlib.sha512),
+    'sha3-256': (0x16, hashlib.sha3_256),
+    'sha3-512': (0x14, hashlib.sha3_512),
+    'blake2b-256': (0xb220, lambda: hashlib.blake2b(digest_size=32)),
+    'blake2b-512': (0xb240, hashlib.blake2b),
+}
+
+# Multicodec codes of the blocks of a file
+DAG_PB = 0x70
+RAW = 0x55
+
+BASE58_ALPHABET = \
+    '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
+
+UNIXFS_FILE = 2
+
+
+def varint(n):
+    """Encode a non-negative integer as a protobuf varint"""
+    encoded = bytearray()
+    while n > 0x7f:
+        encoded.append(n & 0x7f | 0x80)
+        n >>= 7
+    encoded.append(n)
+
+    return bytes(encoded)
+
+
+def varint_field(number, n):
+    return varint(number << 3) + varint(n)
+
+
+def bytes_field(number, value):
+    return varint(number << 3 | 2) + varint(len(value)) + value
+
+
+def resolve_add_options(cid_version=None, raw_leaves=None, chunker=None,
+                        hash=None, pin=True):
+    """
+    Return the options of an `ipfs add` with the defaults the daemon would
+    fill in. Raise ValueError for combinations it would reject.
+    """
+    hash = hash or DEFAULT_HASH
+    if hash not in HASH_FUNCTIONS:
+        raise ValueError(f'Unsupported hash function {hash}')
+
+    # CIDv0 can only be of SHA-256 multihashes
+    if cid_version is None:
+        cid_version = 0 if hash == DEFAULT_HASH else 1
+    elif cid_version not in (0, 1):
+        raise ValueError(f'Unsupported CID version {cid_version}')
+    elif cid_version == 0 and hash != DEFAULT_HASH:
+        raise ValueError(f'CIDv0 only supports {DEFAULT_HASH}, not {hash}')
+
+    if raw_leaves is None:
+        raw_leaves = cid_version > 0
+
+    return {'cid_version': cid_version, 'raw_leaves': raw_leaves,
+            'chunker': chunker or DEFAULT_CHUNKER, 'hash': hash, 'pin': pin}
+
+
+def cid_add_options(add_options=None):
+    """
+    Return the options of an `ipfs add` that decide the CIDs it assigns,
+    with the defaults filled in, the same for options giving the same CIDs
+    """
+    resolved = resolve_add_options(**{
+        name: value for (name, value) in (add_options or {}).items()
+        if name in CID_ADD_OPTIONS})
+
+    return {name: resolved[name] for name in CID_ADD_OPTIONS}
+
+
+def chunk_size(chunker):
+    """Return the size of the chunks of a size-N chunker"""
+    (kind, _, size) = chunker.partition('-')
+    if kind != 'size' or not size.isdigit() or int(size) < 1:
+        raise ValueError(
+            f'Only size-N chunkers are supported without IPFS, not {chunker}')
+
+    return int(size)
+
+
+class CIDOptions:
+    """The options of `ipfs add` that decide the CIDs it assigns"""
+
+    def __init__(self, cid_version=0, raw_leaves=False,
+                 chunker=DEFAULT_CHUNKER, hash=DEFAULT_HASH, **_):
+        self.cid_version = cid_version
+        self.raw_leaves = raw_leaves
+        self.chunk_size = chunk_size(chunker)
+        (self.hash_code, self.hash_function) = HASH_FUNCTIONS[hash]
+
+    def multihash(self, block):
+        digest = self.hash_function(block).digest()
+        return varint(self.hash_code) + varint(len(digest)) + digest
+
+    def cid_bytes(self, codec, block, cid_version=None):
+        """Return the binary CID of a block"""
+        if cid_version is None:
+            cid_version = self.cid_version
+        if cid_version == 0:
+            return self.multihash(block)
+
+        return varint(1) + varint(codec) + self.multihash(block)
+
+
+DEFAULT_CID_OPTIONS = CIDOptions()
+
+
+def cid_string(cid_bytes):
+    """Encode a binary CID like `ipfs add` prints it"""
+    if cid_bytes[0] == 1:  # CIDv1, in base32
+        return 'b' + base64.b32encode(cid_bytes).decode().lower().rstrip('=')
+
+    return base58_encode(cid_bytes)
+
+
+def base58_encode(bytes_in):
+    n = int.from_bytes(bytes_in, 'big')
+    encoded = ''
+    while n:
+        (n, digit) = divmod(n, 58)
+        encoded = BASE58_ALPHABET[digit] + encoded
+
+    leading_zeros = len(bytes_in) - len(bytes_in.lstrip(b'\0'))
+
+    return BASE58_ALPHABET[0] * leading_zeros + encoded
+
+
+class DagNode:
+    """What links to a dag-pb node need to know of its serialized block"""
+
+    def __init__(self, cid_bytes, filesize, tsize):
+        self.cid_bytes = cid_bytes
+        # Bytes of file content under the node
+        self.filesize = filesize
+        # Bytes of the blocks of the node and all nodes under it
+        self.tsize = tsize
+
+    @classmethod
+    def leaf(cls, data, options=DEFAULT_CID_OPTIONS):
+        if options.raw_leaves:
+            # Raw blocks have no CIDv0, their CIDs are CIDv1 regardless
+            return cls(options.cid_bytes(RAW, data, cid_version=1),
+                       len(data), len(data))
+
+        unixfs = varint_field(1, UNIXFS_FILE)
+        if data:
+            unixfs += bytes_field(2, data)
+        unixfs += varint_field(3, len(data))
+
+        block = bytes_field(1, unixfs)
+        return cls(options.cid_bytes(DAG_PB, block), len(data), len(block))
+
+    @classmethod
+    def parent(cls, children, options=DEFAULT_CID_OPTIONS):
+        filesize = sum(child.filesize for child in children)
+
+        # dag-pb serializes links before data
+        links = b''.join(bytes_field(2, (
+            bytes_field(1, child.cid_bytes) + bytes_field(2, b'') +
+            varint_field(3, child.tsize))) for child in children)
+        unixfs = varint_field(1, UNIXFS_FILE) + varint_field(3, filesize) + \
+            b''.join(varint_field(4, child.filesize) for child in children)
+
+        block = links + bytes_field(1, unixfs)
+        return cls(options.cid_bytes(DAG_PB, block), filesize,
+                   len(block) + sum(child.tsize for child in children))
+
+    def cid(self):
+        return cid_string(self.cid_bytes)
+
+
+class UnixFSFile:
+    """Incrementally compute the CID of content fed to `update()`"""
+
+    def __init__(self, options=DEFAULT_CID_OPTIONS):
+        self.options = options
+        self.buffer = bytearray()
+        self.leaves = []
+
+    def update(self, data):
+        chunk_size = self.options.chunk_size
+        data = memoryview(data)
+        if self.buffer:
+            fill = chunk_size - len(self.buffer)
+            self.buffer += data[:fill]
+            data = data[fill:]
+            if len(self.buffer) == chunk_size:
+                self.leaves.append(self.leaf(self.buffer))
+                self.buffer = bytearray()
+
+        while len(data) >= chunk_size:
+            self.leaves.append(self.leaf(data[:chunk_size]))
+            data = data[chunk_size:]
+
+        self.buffer += data
+
+    def leaf(self, data):
+        return DagNode.leaf(bytes(data), self.options)
+
+    def cid(self):
+        nodes = self.leaves
+        if self.buffer or not nodes:
+            nodes = nodes + [self.leaf(self.buffer)]
+
+        # Full subtrees are filled left to right, so grouping each level
+        # bottom up gives the same tree as the top-down balanced layout
+        while len(nodes) > 1:
+            nodes = [DagNode.parent(nodes[i:i + MAX_LINKS], self.options)
+                     for i in range(0, len(nodes), MAX_LINKS)]
+
+        return nodes[0].cid()
+
+
+def unixfs_cid(bytes_in, options=DEFAULT_CID_OPTIONS):
+    """Return the CID `ipfs add` gives the bytes with the options"""
+    unixfs_file = UnixFSFile(options)
+    unixfs_file.update(bytes_in)
+
+    return unixfs_file.cid()
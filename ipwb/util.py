@@ -1,3 +1,4 @@
+import copy
 import functools
 from os.path import expanduser
 
@@ -161,13 +162,93 @@ def set_locale():
         locale.setlocale(locale.LC_TIME, '')
 
 
+# Names used in RFC 1123 dates, independent of the locale
+RFC1123_DAY_NAMES = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+RFC1123_MONTH_NAMES = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun',
+                       'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+RFC1123_MONTH_NUMBERS = {name.lower(): f'{number:02d}' for (number, name)
+                         in enumerate(RFC1123_MONTH_NAMES, 1)}
+
+
+def format_rfc1123(d):
+    """Format a datetime as an RFC 1123 date, e.g. Sun, 06 Nov 1994 ..."""
+    iso8601 = d.isoformat(timespec='seconds')
+    return (f'{RFC1123_DAY_NAMES[d.weekday()]}, {iso8601[8:10]} '
+            f'{RFC1123_MONTH_NAMES[d.month - 1]} {d.year} '
+            f'{iso8601[11:19]} GMT')
+
+
+def parse_iso8601_datetime(iso8601):
+    """
+    Parse YYYY-MM-DDTHH:MM:SS, return None if it is not a valid date. The
+    separators must have been checked, fromisoformat() accepts others.
+    """
+    try:
+        return datetime.datetime.fromisoformat(iso8601)
+    except ValueError:
+        return None
+
+
+# The converters below parse dates in the layout produced by ipwb, WARCs
+# and HTTP by slicing them, and format them with the tables above. Other
+# layouts, invalid dates and years before 1000 are left to strptime(), which
+# also accepts single digit fields and full day and month names.
+
 def digits14_to_rfc1123(digits14):
+    d = None
+    if len(digits14) == 14 and digits14[0] != '0' and digits14.isdigit():
+        d = parse_iso8601_datetime(
+            f'{digits14[0:4]}-{digits14[4:6]}-{digits14[6:8]}T'
+            f'{digits14[8:10]}:{digits14[10:12]}:{digits14[12:14]}')
+
+    if d is None:
+        return strptime_digits14_to_rfc1123(digits14)
+
+    return (f'{RFC1123_DAY_NAMES[d.weekday()]}, {digits14[6:8]} '
+            f'{RFC1123_MONTH_NAMES[d.month - 1]} {digits14[0:4]} '
+            f'{digits14[8:10]}:{digits14[10:12]}:{digits14[12:14]} GMT')
+
+
+def rfc1123_to_digits14(rfc1123_datestring):
+    s = rfc1123_datestring
+    month = RFC1123_MONTH_NUMBERS.get(s[8:11].lower())
+    d = None
+    if len(s) == 29 and month is not None and s[12] != '0' and \
+            s[0:3].capitalize() in RFC1123_DAY_NAMES and \
+            s[3:5] == ', ' and s[7] + s[11] + s[16] + s[25] == '    ' and \
+            s[19] + s[22] == '::' and s[26:].upper() == 'GMT':
+        d = parse_iso8601_datetime(f'{s[12:16]}-{month}-{s[5:7]}T{s[17:25]}')
+
+    if d is None:
+        return strptime_rfc1123_to_digits14(rfc1123_datestring)
+
+    # TODO: Account for conversion if TZ other than GMT not specified
+
+    return f'{s[12:16]}{month}{s[5:7]}{s[17:19]}{s[20:22]}{s[23:25]}'
+
+
+def iso8601_to_digits14(iso8601DateString):
+    s = iso8601DateString
+    d = None
+    if len(s) == 20 and s[0] != '0' and \
+            s[4] + s[7] + s[10] + s[13] + s[16] + s[19] == '--T::Z':
+        d = parse_iso8601_datetime(s[0:19])
+
+    if d is None:
+        return strptime_iso8601_to_digits14(iso8601DateString)
+
+    # TODO: Account for conversion if TZ other than GMT not specified
+
+    return f'{s[0:4]}{s[5:7]}{s[8:10]}{s[11:13]}{s[14:16]}{s[17:19]}'
+
+
+def strptime_digits14_to_rfc1123(digits14):
     set_locale()
     d = datetime.datetime.strptime(digits14, '%Y%m%d%H%M%S')
     return d.strftime('%a, %d %b %Y %H:%M:%S GMT')
 
 
-def rfc1123_to_digits14(rfc1123_datestring):
+def strptime_rfc1123_to_digits14(rfc1123_datestring):
     set_locale()
     d = datetime.datetime.strptime(rfc1123_datestring,
                                    '%a, %d %b %Y %H:%M:%S %Z')
@@ -177,7 +258,7 @@ def rfc1123_to_digits14(rfc1123_datestring):
     return d.strftime('%Y%m%d%H%M%S')
 
 
-def iso8601_to_digits14(iso8601DateString):
+def strptime_iso8601_to_digits14(iso8601DateString):
     set_locale()
     d = datetime.datetime.strptime(iso8601DateString,
                                    "%Y-%m-%dT%H:%M:%SZ")
@@ -196,6 +277,10 @@ def is_rfc1123_compliant(dtstr):
 
 
 def get_rfc1123_of_now():
+    return format_rfc1123(datetime.datetime.now())
+
+
+def strptime_get_rfc1123_of_now():
     set_locale()
     d = datetime.datetime.now()
     return d.strftime('%a, %d %b %Y %H:%M:%S GMT')
@@ -232,11 +317,14 @@ def fetch_remote_file(path):
 
 
 # IPFS Config manipulation from here on out.
-def read_ipfs_config():
-    ipfs_config_path = os.path.join(expanduser("~"), '.ipfs', 'config')
+def get_ipfs_repo_path():
     if 'IPFS_PATH' in os.environ:
-        ipfs_config_path = os.path.join(
-            os.environ.get('IPFS_PATH'), 'config')
+        return os.environ.get('IPFS_PATH')
+    return os.path.join(expanduser("~"), '.ipfs')
+
+
+def read_ipfs_config():
+    ipfs_config_path = os.path.join(get_ipfs_repo_path(), 'config')
 
     try:
         with open(ipfs_config_path, 'r') as f:
@@ -249,15 +337,30 @@ def read_ipfs_config():
 
 
 def write_ipfs_config(json_to_write):
-    ipfs_config_path = os.path.join(expanduser("~"), '.ipfs', 'config')
-    if 'IPFS_PATH' in os.environ:
-        ipfs_config_path = os.path.join(
-            os.environ.get('IPFS_PATH'), 'config')
+    ipfs_config_path = os.path.join(get_ipfs_repo_path(), 'config')
 
     with open(ipfs_config_path, 'w') as f:
         f.write(json.dumps(json_to_write, indent=4, sort_keys=True))
 
 
+def read_replay_config():
+    """
+    Read the config replay keeps between runs, from the IPFS config or, with
+    a local store and so maybe no IPFS repo, from the settings
+    """
+    if settings.App.config("store"):
+        return copy.deepcopy(settings.App.config("replay_config") or {})
+
+    return read_ipfs_config()
+
+
+def write_replay_config(json_to_write):
+    if settings.App.config("store"):
+        settings.App.set("replay_config", json_to_write)
+    else:
+        write_ipfs_config(json_to_write)
+
+
 def get_ipfsapi_host_and_port():
     daemon_address = settings.App.config("ipfsapi")
     # format right now is "/dns/localhost/tcp/5001/http"
@@ -272,7 +375,7 @@ def get_ipfsapi_host_and_port():
 
 def get_ipwb_replay_config(ipfs_json=None):
     if not ipfs_json:
-        ipfs_json = read_ipfs_config()
+        ipfs_json = read_replay_config()
     port = None
     if ('Ipwb' in ipfs_json and 'Replay' in ipfs_json['Ipwb'] and
        'Port' in ipfs_json['Ipwb']['Replay']):
@@ -285,29 +388,29 @@ def get_ipwb_replay_config(ipfs_json=None):
 
 def set_ipwb_replay_config(Host, Port, ipfs_json=None):
     if not ipfs_json:
-        ipfs_json = read_ipfs_config()
+        ipfs_json = read_replay_config()
     ipfs_json['Ipwb'] = {}
     ipfs_json['Ipwb']['Replay'] = {
       u'Host': Host,
       u'Port': Port
     }
-    write_ipfs_config(ipfs_json)
+    write_replay_config(ipfs_json)
 
 
 def set_ipwb_replay_index_path(cdxj):
     if cdxj is None:
         cdxj = INDEX_FILE
-    ipfs_json = read_ipfs_config()
+    ipfs_json = read_replay_config()
     ipfs_json['Ipwb']['Replay']['Index'] = cdxj
-    write_ipfs_config(ipfs_json)
+    write_replay_config(ipfs_json)
     return
 
 
 def get_ipwb_replay_index_path():
-    ipfs_json = read_ipfs_config()
+    ipfs_json = read_replay_config()
     if 'Ipwb' not in ipfs_json:
         set_ipwb_replay_config(IPWBREPLAY_HOST, IPWBREPLAY_PORT)
-        ipfs_json = read_ipfs_config()
+        ipfs_json = read_replay_config()
 
     if 'Index' in ipfs_json['Ipwb']['Replay']:
         return ipfs_json['Ipwb']['Replay']['Index']
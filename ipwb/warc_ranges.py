@@ -0,0 +1,133 @@
+"""
+Byte ranges of gzipped WARCs that can be indexed in parallel
+
+A .warc.gz is usually a series of gzip members of one record each, so it
+can be read from the start of any member. Splitting it at member starts
+gives byte ranges that separate processes can index at the same time. The
+member starts are found by looking for gzip headers after evenly spaced
+offsets and checking each by decompressing the start of it, or are taken
+from the record offsets in a CDX or CDXJ index of the WARC.
+"""
+
+import bisect
+import json
+import os
+import zlib
+
+GZIP_MAGIC = b'\x1f\x8b\x08'
+SCAN_BLOCK_SIZE = 1024 * 1024
+
+# Compressed bytes read to check that a gzip header starts a WARC record
+MEMBER_CHECK_BYTES = 4096
+
+# WARCs are not split into ranges smaller than this
+MIN_RANGE_BYTES = 16 * 1024 * 1024
+
+# Ranges per process, so processes finishing early can take more
+RANGES_PER_PROCESS = 4
+
+
+def is_member_start(fh, offset):
+    """Whether a gzip member with a WARC record starts at `offset`"""
+    fh.seek(offset)
+    data = fh.read(MEMBER_CHECK_BYTES)
+    if not data.startswith(GZIP_MAGIC):
+        return False
+
+    try:
+        record_start = zlib.decompressobj(zlib.MAX_WBITS | 16).decompress(
+            data, len(b'WARC/'))
+    except zlib.error:
+        return False
+
+    return record_start == b'WARC/'
+
+
+def find_member_start(fh, offset, end):
+    """Return the first member start from `offset` before `end`, if any"""
+    while offset < end:
+        fh.seek(offset)
+        # Overlapping blocks, so a header split between them is found
+        block = fh.read(SCAN_BLOCK_SIZE + len(GZIP_MAGIC) - 1)
+        idx = block.find(GZIP_MAGIC)
+        while idx != -1 and offset + idx < end:
+            if is_member_start(fh, offset + idx):
+                return offset + idx
+            idx = block.find(GZIP_MAGIC, idx + 1)
+
+        offset += SCAN_BLOCK_SIZE
+
+    return None
+
+
+def read_cdx_offsets(cdx_path):
+    """
+    Return the record offsets listed in a CDX or CDXJ index, by the names
+    of the WARCs they are in
+    """
+    offsets = {}
+    columns = None
+    with open(cdx_path, 'r') as f:
+        for line in f:
+            fields = line.split()
+            if not fields:
+                continue
+
+            # The header of CDX files names the letters of their columns
+            if fields[0] == 'CDX':
+                columns = fields[1:]
+                continue
+
+            try:
+                if columns is not None:
+                    offset = int(fields[columns.index('V')])
+                    filename = fields[columns.index('g')]
+                else:  # CDXJ, of pywb
+                    record = json.loads(line.split(' ', 2)[2])
+                    (offset, filename) = (int(record['offset']),
+                                          record['filename'])
+            except (IndexError, KeyError, ValueError):
+                continue
+
+            offsets.setdefault(os.path.basename(filename), []).append(offset)
+
+    return {filename: sorted(set(warc_offsets))
+            for (filename, warc_offsets) in offsets.items()}
+
+
+def warc_byte_ranges(warc_path, processes, record_offsets=None,
+                     min_range_bytes=None):
+    """
+    Split a WARC into [start, end) byte ranges that start at records, for
+    `processes` processes. WARCs that are not gzipped a record per member
+    are a single range.
+    """
+    if min_range_bytes is None:
+        min_range_bytes = MIN_RANGE_BYTES
+
+    warc_size = os.path.getsize(warc_path)
+    range_count = min(processes * RANGES_PER_PROCESS,
+                      warc_size // min_range_bytes)
+    if range_count <= 1 or not warc_path.endswith('.gz'):
+        return [(0, warc_size)]
+
+    starts = [0]
+    with open(warc_path, 'rb') as fh:
+        for n in range(1, range_count):
+            target = warc_size * n // range_count
+            if target <= starts[-1]:
+                continue
+
+            if record_offsets is not None:
+                idx = bisect.bisect_left(record_offsets, target)
+                start = record_offsets[idx] \
+                    if idx < len(record_offsets) else None
+            else:
+                start = find_member_start(fh, target, warc_size)
+
+            if start is None or start >= warc_size:
+                break
+            if start > starts[-1]:
+                starts.append(start)
+
+    return list(zip(starts, starts[1:] + [warc_size]))
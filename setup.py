@@ -32,6 +32,10 @@ setup(
         'beautifulsoup4>=4.6.3',
         'surt>=0.3.0'
     ],
+    extras_require={
+        'zstd': ['zstandard>=0.15'],
+        'async': ['aiohttp>=3.8']
+    },
     tests_require=[
         'flake8>=3.4',
         'pytest>=3.6',
@@ -0,0 +1,131 @@
+import email.parser
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+from ipwb import indexer, settings
+from ipwb.aioipfs import aiohttp, api_base_url
+from ipwb.content_store import AsyncIPFSStore, content_store
+from ipwb.exceptions import IPFSAPIError
+from ipwb.unixfs import unixfs_cid
+
+from .test_indexing import write_deduplicated_warc
+
+pytestmark = pytest.mark.skipif(aiohttp is None, reason='needs aiohttp')
+
+
+class StandInIPFSHandler(BaseHTTPRequestHandler):
+    """The add, cat, pin/add and id endpoints of an IPFS daemon's API"""
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        params = {k: v[0] for (k, v) in parse_qs(url.query).items()}
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length)
+        endpoint = url.path[len('/api/v0/'):]
+        self.server.requests.append((endpoint, params))
+
+        if endpoint == 'add':
+            message = email.parser.BytesParser().parsebytes(
+                f'Content-Type: {self.headers["Content-Type"]}\r\n\r\n'
+                .encode() + body)
+            lines = []
+            for part in message.get_payload():
+                content = part.get_payload(decode=True)
+                cid = unixfs_cid(content)
+                self.server.blocks[cid] = content
+                lines.append(json.dumps({
+                    'Name': part.get_filename(), 'Hash': cid,
+                    'Size': str(len(content))}))
+            self.respond(200, '\n'.join(lines).encode())
+        elif endpoint == 'cat' and params['arg'] in self.server.blocks:
+            content = self.server.blocks[params['arg']]
+            content = content[int(params.get('offset', 0)):]
+            if 'length' in params:
+                content = content[:int(params['length'])]
+            self.respond(200, content)
+        elif endpoint == 'pin/add':
+            self.respond(200, json.dumps({'Pins': [params['arg']]}).encode())
+        elif endpoint == 'id':
+            self.respond(200, json.dumps({'ID': 'stand-in'}).encode())
+        else:
+            self.respond(500, json.dumps({'Message': 'not found'}).encode())
+
+    def respond(self, status, body):
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def ipfs_daemon():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandInIPFSHandler)
+    server.blocks = {}
+    server.requests = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    ipfsapi = settings.App.config('ipfsapi')
+    settings.App.set('ipfsapi', f'/ip4/127.0.0.1/tcp/{server.server_port}')
+    settings.App.set('ipfs_concurrency', 8)
+    try:
+        yield server
+    finally:
+        settings.App.set('ipfsapi', ipfsapi)
+        settings.App.set('ipfs_concurrency', None)
+        server.shutdown()
+        server.server_close()
+
+
+def test_api_base_url():
+    assert api_base_url('/dns/localhost/tcp/5001/http') == \
+        'http://localhost:5001/api/v0'
+    assert api_base_url('/ip6/::1/tcp/5001') == 'http://[::1]:5001/api/v0'
+
+
+def test_async_store(ipfs_daemon):
+    store = content_store()
+    assert isinstance(store, AsyncIPFSStore)
+    store.check_available()
+
+    cids = store.put_many([b'hello world\n', b'payload'])
+    assert cids == [unixfs_cid(b'hello world\n'), unixfs_cid(b'payload')]
+    assert store.put(b'hello world\n') == cids[0]
+    assert store.get_many(list(reversed(cids))) == \
+        [b'payload', b'hello world\n']
+    assert store.get_range(cids[0], 6, 5) == b'world'
+    assert store.loop_thread.run(store.client.pin_add(cids[1])) == [cids[1]]
+
+    with pytest.raises(IPFSAPIError):
+        store.get(unixfs_cid(b'missing'))
+
+
+def test_index_with_async_client(ipfs_daemon, tmp_path):
+    warc_path = str(tmp_path / 'dedup.warc')
+    write_deduplicated_warc(warc_path)
+
+    settings.App.set('store', str(tmp_path / 'store'))
+    try:
+        local_lines = indexer.index_file_at(warc_path, quiet=True)
+    finally:
+        settings.App.set('store', None)
+
+    async_lines = indexer.index_file_at(warc_path, quiet=True)
+
+    assert async_lines[2:] == local_lines[2:]
+    assert [endpoint for (endpoint, _) in ipfs_daemon.requests].count(
+        'add') == 4
+
+
+def test_add_options_are_sent(ipfs_daemon):
+    store = AsyncIPFSStore(8, {'cid_version': 1, 'pin': False})
+    store.put_many([b'one', b'two'])
+
+    assert ipfs_daemon.requests[-1] == (
+        'add', {'cid-version': '1', 'pin': 'false'})
@@ -0,0 +1,92 @@
+import os
+import random
+
+from ipwb import cdxj
+
+
+def cdxj_line(n):
+    return f'com,example)/{n} 20200101000000 {{"locator": "urn:ipfs/a/b"}}'
+
+
+def test_merge_cdxj_lines_dedupes():
+    run_a = [cdxj_line(n) for n in (1, 2, 4)]
+    run_b = [cdxj_line(n) for n in (2, 3, 4, 5)]
+
+    assert list(cdxj.merge_cdxj_lines(run_a, run_b)) == \
+        [cdxj_line(n) for n in range(1, 6)]
+
+
+def test_sorter_spills_to_disk_within_budget():
+    lines = [cdxj_line(n) for n in range(1000)] * 2
+    random.shuffle(lines)
+
+    with cdxj.CDXJSorter(memory_budget=10000) as sorter:
+        for line in lines:
+            sorter.add(line)
+            assert sorter.buffer_size < 10000
+
+        run_paths = list(sorter.run_paths)
+        assert len(run_paths) > 1
+
+        assert list(sorter.sorted_lines()) == sorted(set(lines))
+
+    assert not any(os.path.exists(run_path) for run_path in run_paths)
+
+
+def test_sorter_without_spilling():
+    lines = [cdxj_line(n) for n in (3, 1, 2, 1)]
+
+    with cdxj.CDXJSorter() as sorter:
+        for line in lines:
+            sorter.add(line)
+
+        assert sorter.run_paths == []
+        assert list(sorter.sorted_lines()) == sorted(set(lines))
+
+
+def test_sorter_merges_added_runs():
+    run_path = cdxj.write_cdxj_run([cdxj_line(n) for n in (1, 3)])
+
+    with cdxj.CDXJSorter() as sorter:
+        sorter.add(cdxj_line(2))
+        sorter.add_run(run_path)
+
+        assert list(sorter.sorted_lines()) == \
+            [cdxj_line(n) for n in (1, 2, 3)]
+
+    assert not os.path.exists(run_path)
+
+
+def test_shards_split_between_keys(tmp_path):
+    manifest_path = str(tmp_path / 'index.cdxj')
+    # Three captures each of ten URIs
+    lines = sorted(cdxj_line(n).replace('20200101', f'2020010{day}')
+                   for n in range(10) for day in (1, 2, 3))
+    meta = ['!meta {}']
+
+    shards = cdxj.write_cdxj_shards(manifest_path, meta, lines, 30, 4)
+    manifest = cdxj.read_cdxj_manifest(manifest_path)
+    assert manifest['shards'] == shards
+    assert [shard['line_count'] for shard in shards] == [9, 9, 9, 3]
+
+    shard_lines = []
+    for path in cdxj.cdxj_shard_paths(manifest_path, manifest):
+        with open(path) as f:
+            content = f.read().splitlines()
+        assert content[0] == meta[0]
+        shard_lines.append(content[1:])
+    assert sum(shard_lines, []) == lines
+
+    for (shard, content) in zip(shards, shard_lines):
+        assert shard['first_key'] == cdxj.cdxj_key(content[0])
+        for line in content:
+            assert cdxj.find_cdxj_shard(
+                manifest_path, manifest, cdxj.cdxj_key(line)).endswith(
+                shard['path'])
+
+    # Fewer shards replace the earlier ones
+    cdxj.write_cdxj_shards(manifest_path, meta, lines, 30, 2)
+    assert sorted(os.listdir(tmp_path)) == [
+        'index-00000.cdxj', 'index-00001.cdxj', 'index.cdxj']
+    assert cdxj.read_cdxj_manifest(str(tmp_path / 'index-00000.cdxj')) \
+        is None
@@ -0,0 +1,109 @@
+import json
+import os
+from pathlib import Path
+from unittest import mock
+
+from ipwb import __main__, indexer, settings
+from ipwb.cid_cache import CIDCache, digest
+from ipwb.content_store import content_store
+
+
+def test_cache_persists_between_instances(tmp_path):
+    cache_path = str(tmp_path / 'cids.sqlite')
+
+    with CIDCache(cache_path) as cache:
+        assert cache.get(digest(b'foo')) is None
+        cache.put(digest(b'foo'), 'QmFoo')
+
+    with CIDCache(cache_path) as cache:
+        assert cache.get(digest(b'foo')) == 'QmFoo'
+        assert cache.get(digest(b'bar')) is None
+
+
+def test_cids_are_cached_per_add_options(tmp_path):
+    cache_path = str(tmp_path / 'cids.sqlite')
+
+    with CIDCache(cache_path) as cache:
+        cache.put(digest(b'foo'), 'QmFoo')
+
+    with CIDCache(cache_path, {'cid_version': 1}) as cache:
+        assert cache.get(digest(b'foo')) is None
+        cache.put(digest(b'foo'), 'bafyFoo')
+
+    with CIDCache(cache_path) as cache:
+        assert cache.get(digest(b'foo')) == 'QmFoo'
+
+
+def test_default_path_is_in_ipfs_repo(tmp_path):
+    with mock.patch.dict(os.environ, {'IPFS_PATH': str(tmp_path)}):
+        with CIDCache() as cache:
+            assert cache.path == str(tmp_path / 'ipwb_cid_cache.sqlite')
+
+
+def test_reindexing_skips_cached_pushes(tmp_path):
+    cache_path = str(tmp_path / 'cids.sqlite')
+    warc_path = os.path.join(
+        Path(os.path.dirname(__file__)).parent,
+        'samples', 'warcs', '5mementos.warc')
+
+    push = mock.MagicMock(side_effect=lambda b: f'Qm{len(b)}')
+    with mock.patch('ipwb.indexer.push_bytes_to_ipfs', push):
+        first = indexer.cdx_cdxj_lines_from_file(
+            warc_path, cid_cache_path=cache_path)
+        # Identical headers are only pushed once
+        assert 0 < push.call_count < 2 * len(first)
+
+        push.reset_mock()
+        second = indexer.cdx_cdxj_lines_from_file(
+            warc_path, cid_cache_path=cache_path)
+
+    assert push.call_count == 0
+    assert second == first
+
+
+def test_batches_only_push_uncached_objects(tmp_path):
+    with CIDCache(str(tmp_path / 'cids.sqlite')) as cache:
+        cache.put(digest(b'cached'), 'QmCached')
+
+        with mock.patch('ipwb.indexer.push_objects_to_ipfs',
+                        return_value=['QmNew']) as push:
+            ipfs_hashes = indexer.push_batch_to_ipfs(
+                [(b'cached', b'new')], cache)
+
+    push.assert_called_once_with([b'new'])
+    assert ipfs_hashes == [['QmCached', 'QmNew']]
+
+
+def test_cids_are_cached_per_store(tmp_path):
+    cache_path = str(tmp_path / 'cids.sqlite')
+    warc_path = os.path.join(
+        Path(os.path.dirname(__file__)).parent,
+        'samples', 'warcs', '5mementos.warc')
+
+    try:
+        for store in ['first', 'second']:
+            store_path = tmp_path / store
+            store_path.mkdir()
+            settings.App.set('store', str(store_path))
+            lines = indexer.cdx_cdxj_lines_from_file(
+                warc_path, cid_cache_path=cache_path)
+
+            # Content cached for the first store is added to the second
+            local_store = content_store()
+            for line in lines:
+                locator = json.loads(line.split(' ', 2)[2])['locator']
+                for cid in locator.split('/')[1:]:
+                    assert local_store.has(cid)
+    finally:
+        settings.App.set('store', None)
+
+
+def test_cid_cache_option_takes_no_path():
+    argv = ['ipwb', 'index', '--cid-cache', 'a.warc', 'b.warc']
+    with mock.patch('sys.argv', argv), \
+            mock.patch('ipwb.__main__.check_args_index') as check_args_index:
+        __main__.check_args(argv)
+
+    args = check_args_index.call_args.args[0]
+    assert args.warc_path == ['a.warc', 'b.warc']
+    assert args.cid_cache and args.cid_cache_path is None
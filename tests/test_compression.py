@@ -0,0 +1,93 @@
+import json
+from io import BytesIO
+
+import pytest
+
+from warcio.statusandheaders import StatusAndHeaders
+from warcio.warcwriter import WARCWriter
+
+from ipwb import compression, indexer, replay, settings
+from ipwb.content_store import content_store
+
+requires_zstd = pytest.mark.skipif(
+    compression.zstandard is None, reason='zstandard is not installed')
+
+
+def write_header_heavy_warc(warc_path, record_count=300):
+    with open(warc_path, 'wb') as fh:
+        writer = WARCWriter(fh, gzip=False)
+        for i in range(record_count):
+            payload = (f'<html><head><title>Page {i}</title></head><body>'
+                       f'<p>Item {i * 7919 % 1000}</p></body></html>')
+            http_headers = StatusAndHeaders('200 OK', [
+                ('Content-Type', 'text/html; charset=utf-8'),
+                ('Server', 'Apache/2.4.41 (Ubuntu)'),
+                ('Cache-Control', 'max-age=3600, public'),
+                ('Set-Cookie', f'session={i * 104729:x}; Path=/; HttpOnly'),
+                ('Content-Length', str(len(payload)))], protocol='HTTP/1.1')
+            writer.write_record(writer.create_warc_record(
+                f'http://example.com/page/{i}', 'response',
+                payload=BytesIO(payload.encode()), http_headers=http_headers,
+                warc_headers_dict={'WARC-Date': '2020-01-01T00:00:00Z'}))
+
+
+@pytest.mark.parametrize('codec_name', [
+    'zlib', pytest.param('zstd', marks=requires_zstd)])
+def test_codecs_round_trip(codec_name):
+    codec = compression.get_codec(codec_name)
+    payload = bytes(range(256)) * 100
+
+    chunks = [payload[i:i + 1000] for i in range(0, len(payload), 1000)]
+    assert codec.decompress(codec.compress(payload)) == payload
+    assert codec.decompress(b''.join(codec.compress_chunks(chunks))) == \
+        payload
+
+
+@pytest.mark.parametrize('codec_name,level', [
+    ('zlib', 10), pytest.param('zstd', 0, marks=requires_zstd)])
+def test_levels_are_checked(codec_name, level):
+    with pytest.raises(ValueError):
+        compression.get_codec(codec_name, level)
+
+
+@requires_zstd
+def test_dictionary_compression_is_replayed(tmp_path):
+    warc_path = str(tmp_path / 'headers.warc')
+    write_header_heavy_warc(warc_path)
+    dictionary_path = str(tmp_path / 'headers.dict')
+    outfile = str(tmp_path / 'index.cdxj')
+
+    settings.App.set('store', str(tmp_path / 'store'))
+    try:
+        store = content_store()
+        indexer.index_file_at(
+            warc_path, compression_level=3, outfile=outfile,
+            compression_codec=compression.ZSTD,
+            compression_dictionary_path=dictionary_path)
+
+        with open(dictionary_path, 'rb') as f:
+            dictionary = f.read()
+        with open(outfile) as f:
+            lines = f.read().splitlines()
+
+        meta = json.loads(lines[1].split(' ', 1)[1])
+        assert meta['compression_dictionaries'] == {
+            str(compression.dictionary_id(dictionary)):
+                store.put(dictionary)}
+
+        obj = json.loads(lines[2].split(' ', 2)[2])
+        assert obj['compression_method'] == compression.ZSTD
+        (header_cid, payload_cid) = obj['locator'].split('/')[-2:]
+        (header, payload) = replay.decompress_record(
+            store.get(header_cid), store.get(payload_cid),
+            obj['compression_method'], outfile)
+    finally:
+        settings.App.set('store', None)
+
+    assert header.startswith(b'HTTP/1.1 200 OK')
+    assert payload.startswith(b'<html><head><title>')
+
+    # Headers compress far better with the dictionary than on their own
+    codec = compression.get_codec(compression.ZSTD, 3, dictionary)
+    assert len(codec.compress(header)) * 2 < \
+        len(compression.get_codec(compression.ZSTD, 3).compress(header))
@@ -0,0 +1,219 @@
+import json
+import os
+from pathlib import Path
+from unittest import mock
+
+import pytest
+
+from ipwb import indexer, settings
+from ipwb.content_store import IPFSStore, LocalStore, content_store
+from ipwb.exceptions import ContentNotFound
+from ipwb.unixfs import (
+    CHUNK_SIZE, MAX_LINKS, CIDOptions, DagNode, UnixFSFile,
+    resolve_add_options, unixfs_cid)
+
+
+@pytest.mark.parametrize('bytes_in,cid', [
+    (b'', 'QmbFMke1KXqnYyBBWxB74N4c5SBnJMVAiMNRcGu6x1AwQH'),
+    (b'hello world\n', 'QmT78zSuBmuS4z925WZfrqQ1qHaJ56DQaTfyMUF7F8ff5o'),
+])
+def test_cids_match_ipfs_add(bytes_in, cid):
+    assert unixfs_cid(bytes_in) == cid
+
+
+@pytest.mark.parametrize('size', [
+    CHUNK_SIZE, CHUNK_SIZE + 1, CHUNK_SIZE * MAX_LINKS + 1])
+def test_cid_does_not_depend_on_chunking(size):
+    bytes_in = bytes(range(256)) * (size // 256) + b'x' * (size % 256)
+
+    unixfs_file = UnixFSFile()
+    for i in range(0, size, 100000):
+        unixfs_file.update(bytes_in[i:i + 100000])
+
+    assert unixfs_file.cid() == unixfs_cid(bytes_in)
+    assert unixfs_cid(bytes_in) != unixfs_cid(bytes_in + b'x')
+
+
+# `ipfs add` gives the 5 MiB file of go-ipfs's t0040 sharness test (go-random
+# with seed 41) QmSr7FqYkxYWGoSfy8ZiaMWQ5vosb18DQGCzjwEQnVHkTb, and
+# bafybeigfnx3tka2rf5ovv2slb7ymrt4zbwa3ryeqibe6fipyt5vgsrli3u with
+# --cid-version 1. unixfs_cid() gives it the same CIDs, with all of its
+# leaves file nodes. These pin that encoding for content of several chunks.
+@pytest.mark.parametrize('add_options,cid', [
+    ({}, 'QmX1a8wAaMjZyP3kn5WggaxtNuNfPETKxKgK9yUgNYtnFx'),
+    ({'cid_version': 1, 'raw_leaves': False},
+     'bafybeigfjqtalj36vm7wfyeugiannlef7tdjife7fjepc5pxzh77bna4za'),
+    ({'cid_version': 1},
+     'bafybeigknhbkhrmymxl622z5vfuzr6ng3xwoyorcc5rpqekwz5sd4cvxhq'),
+])
+def test_cids_of_content_over_one_chunk(add_options, cid):
+    bytes_in = bytes(range(256)) * (4 * CHUNK_SIZE // 256) + b'x'
+    options = CIDOptions(**resolve_add_options(**add_options))
+    assert unixfs_cid(bytes_in, options) == cid
+
+    # Leaves after the first are file nodes too, not raw UnixFS nodes
+    leaves = [DagNode.leaf(bytes_in[i:i + CHUNK_SIZE], options)
+              for i in range(0, len(bytes_in), CHUNK_SIZE)]
+    assert DagNode.parent(leaves, options).cid() == cid
+
+
+@pytest.mark.parametrize('bytes_in,add_options,cid', [
+    (b'', {'cid_version': 1},
+     'bafkreihdwdcefgh4dqkjv67uzcmw7ojee6xedzdetojuzjevtenxquvyku'),
+    (b'hello world', {'raw_leaves': True},
+     'bafkreifzjut3te2nhyekklss27nh3k72ysco7y32koao5eei66wof36n5e'),
+    (b'hello world\n', {'cid_version': 1, 'raw_leaves': False},
+     'bafybeicg2rebjoofv4kbyovkw7af3rpiitvnl6i7ckcywaq6xjcxnc2mby'),
+])
+def test_cids_match_ipfs_add_options(bytes_in, add_options, cid):
+    options = CIDOptions(**resolve_add_options(**add_options))
+    assert unixfs_cid(bytes_in, options) == cid
+
+
+def test_add_options_defaults():
+    assert resolve_add_options() == {
+        'cid_version': 0, 'raw_leaves': False, 'chunker': 'size-262144',
+        'hash': 'sha2-256', 'pin': True}
+    assert resolve_add_options(hash='blake2b-256')['cid_version'] == 1
+    assert resolve_add_options(cid_version=1)['raw_leaves']
+
+    with pytest.raises(ValueError):
+        resolve_add_options(cid_version=0, hash='sha3-256')
+    with pytest.raises(ValueError):
+        CIDOptions(chunker='rabin-262144-524288-1048576')
+
+
+def test_chunker_and_raw_leaves(tmp_path):
+    bytes_in = bytes(range(256)) * 40
+    options = {'raw_leaves': True, 'chunker': 'size-1024'}
+    store = LocalStore(str(tmp_path), options)
+
+    unixfs_file = UnixFSFile(store.cid_options)
+    unixfs_file.update(bytes_in)
+    assert len(unixfs_file.leaves) == 10
+
+    cid = store.put(bytes_in)
+    assert cid.startswith('Qm') and cid != unixfs_cid(bytes_in)
+    assert store.put_stream([bytes_in[:1000], bytes_in[1000:]]) == cid
+    assert store.get(cid) == bytes_in
+
+
+def test_add_options_are_sent_to_ipfs():
+    options = resolve_add_options(cid_version=1, hash='sha2-512', pin=False)
+    store = IPFSStore(options)
+    assert store.add_params == {
+        'cid-version': '1', 'raw-leaves': 'true', 'chunker': 'size-262144',
+        'hash': 'sha2-512', 'pin': 'false'}
+
+    client = mock.MagicMock()
+    client.add.return_value = [{'Name': '0', 'Hash': 'bafy0'}]
+    with mock.patch('ipwb.content_store.ipfs_client', return_value=client):
+        store.put(b'one')
+        assert store.put_many([b'two']) == ['bafy0']
+
+    client.add_bytes.assert_called_once_with(b'one', opts=store.add_params)
+    assert client.add.call_args.kwargs == {
+        'pin': False, 'raw_leaves': True,
+        'opts': {'cid-version': '1', 'chunker': 'size-262144',
+                 'hash': 'sha2-512'}}
+
+
+def test_local_store(tmp_path):
+    store = LocalStore(str(tmp_path / 'store'))
+    cid = store.put(b'hello world\n')
+
+    assert cid == 'QmT78zSuBmuS4z925WZfrqQ1qHaJ56DQaTfyMUF7F8ff5o'
+    assert store.has(cid)
+    assert store.get(cid) == b'hello world\n'
+    assert store.get_range(cid, 6) == b'world\n'
+    assert store.get_range(cid, 6, 5) == b'world'
+    assert store.put_stream([b'hello ', b'world\n']) == cid
+    assert store.put_many([b'hello world\n', b'']) == [
+        cid, 'QmbFMke1KXqnYyBBWxB74N4c5SBnJMVAiMNRcGu6x1AwQH']
+
+    missing = unixfs_cid(b'missing')
+    assert not store.has(missing)
+    with pytest.raises(ContentNotFound):
+        store.get(missing)
+
+
+def test_indexing_into_local_store(tmp_path):
+    warc_path = os.path.join(
+        Path(os.path.dirname(__file__)).parent,
+        'samples', 'warcs', 'salam-home.warc')
+
+    settings.App.set('store', str(tmp_path))
+    try:
+        store = content_store()
+        [cdxj_line] = indexer.cdx_cdxj_lines_from_file(warc_path)
+    finally:
+        settings.App.set('store', None)
+
+    locator = json.loads(cdxj_line.split(' ', 2)[2])['locator']
+    (header_cid, payload_cid) = locator.split('/')[-2:]
+    assert store.get(header_cid).startswith(b'HTTP/1.1 200 OK')
+    assert b'<title>HomePage | Sawood Alam</title>' in store.get(payload_cid)
+
+
+def test_add_options_are_recorded_in_meta(tmp_path):
+    warc_path = os.path.join(
+        Path(os.path.dirname(__file__)).parent,
+        'samples', 'warcs', 'salam-home.warc')
+    add_options = resolve_add_options(cid_version=1, pin=False)
+
+    settings.App.set('store', str(tmp_path))
+    settings.App.set('ipfs_add_options', add_options)
+    try:
+        cdxj_lines = indexer.index_file_at(warc_path, quiet=True)
+    finally:
+        settings.App.set('store', None)
+        settings.App.set('ipfs_add_options', None)
+
+    meta = json.loads(cdxj_lines[1].split(' ', 1)[1])
+    assert meta['ipfs_add_options'] == add_options
+
+    locator = json.loads(cdxj_lines[2].split(' ', 2)[2])['locator']
+    assert all(cid.startswith('bafk') for cid in locator.split('/')[-2:])
+
+
+def test_lines_added_with_other_options_are_not_merged(tmp_path):
+    warc_dir = os.path.join(
+        Path(os.path.dirname(__file__)).parent, 'samples', 'warcs')
+
+    def index(warc, outfile, add_options):
+        settings.App.set('ipfs_add_options', add_options)
+        try:
+            indexer.index_file_at(
+                os.path.join(warc_dir, warc), outfile=str(outfile))
+        finally:
+            settings.App.set('ipfs_add_options', None)
+
+        return outfile.read_text()
+
+    add_options = resolve_add_options(cid_version=1)
+    settings.App.set('store', str(tmp_path / 'store'))
+    try:
+        first = index('salam-home.warc', tmp_path / 'index.cdxj', add_options)
+        indexed = index('5mementos.warc', tmp_path / 'index.cdxj', add_options)
+        assert len(indexed) > len(first)
+
+        with pytest.raises(SystemExit):
+            index('mkelly1.warc', tmp_path / 'index.cdxj', None)
+        assert (tmp_path / 'index.cdxj').read_text() == indexed
+        assert not os.path.exists(
+            indexer.default_journal_dir(str(tmp_path / 'index.cdxj')))
+
+        # Options giving the same CIDs as the daemon's defaults
+        index('mkelly1.warc', tmp_path / 'other.cdxj', None)
+        index('redirect.warc', tmp_path / 'other.cdxj',
+              resolve_add_options(cid_version=0, pin=False))
+        indexer.sort_cdxj_files(
+            [str(tmp_path / 'other.cdxj'), str(tmp_path / 'other.cdxj')],
+            outfile=str(tmp_path / 'other.cdxj'))
+
+        with pytest.raises(SystemExit):
+            indexer.sort_cdxj_files(
+                [str(tmp_path / 'index.cdxj'), str(tmp_path / 'other.cdxj')],
+                outfile=str(tmp_path / 'sorted.cdxj'))
+    finally:
+        settings.App.set('store', None)
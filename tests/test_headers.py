@@ -0,0 +1,81 @@
+import json
+from io import BytesIO
+
+import pytest
+from warcio.statusandheaders import StatusAndHeaders
+from warcio.warcwriter import WARCWriter
+
+from ipwb import indexer, settings
+from ipwb.content_store import content_store
+from ipwb.headers import join_header, split_header
+
+from .test_compression import write_header_heavy_warc
+
+
+def test_split_header_round_trips():
+    hstr = ('HTTP/1.1 200 OK\r\nDate: Wed, 30 Apr 2008 20:48:25 GMT\r\n'
+            'Content-Type: text/html\r\nSet-Cookie:a=1\r\n'
+            'set-cookie: b=2; Path=/\r\nX-Note: Date: unchanged')
+
+    (template, delta) = split_header(hstr)
+    assert template == ('HTTP/1.1 200 OK\r\nDate:\r\nContent-Type: '
+                        'text/html\r\nSet-Cookie:\r\nset-cookie:\r\n'
+                        'X-Note: Date: unchanged')
+    assert [idx for (idx, _) in delta] == [1, 3, 4]
+    assert join_header(template, json.loads(json.dumps(delta))) == hstr
+
+
+def index_lines(warc_path, **kwargs):
+    return [json.loads(line.split(' ', 2)[2]) for line in
+            indexer.cdx_cdxj_lines_from_file(warc_path, **kwargs)]
+
+
+@pytest.mark.parametrize('batch_size', [1, 10])
+def test_header_templates_are_shared(tmp_path, batch_size):
+    warc_path = str(tmp_path / 'headers.warc')
+    write_header_heavy_warc(warc_path, record_count=20)
+
+    settings.App.set('store', str(tmp_path / 'store'))
+    try:
+        store = content_store()
+        plain = index_lines(warc_path, batch_size=batch_size)
+        templated = index_lines(
+            warc_path, batch_size=batch_size, header_templates=True)
+
+        for (plain_obj, obj) in zip(plain, templated):
+            (plain_header_cid, plain_payload_cid) = \
+                plain_obj['locator'].split('/')[-2:]
+            (template_cid, payload_cid) = obj['locator'].split('/')[-2:]
+
+            assert payload_cid == plain_payload_cid
+            assert join_header(
+                store.get(template_cid).decode(), obj['header_delta']) == \
+                store.get(plain_header_cid).decode()
+    finally:
+        settings.App.set('store', None)
+
+    assert len(templated) == 20
+    assert len({obj['locator'].split('/')[-2] for obj in templated}) == 1
+
+
+def test_template_of_empty_payload_is_not_shared(tmp_path):
+    warc_path = str(tmp_path / 'empty.warc')
+    http_headers = StatusAndHeaders(
+        '200 OK', [('Content-Type', 'text/html')], protocol='HTTP/1.1')
+    with open(warc_path, 'wb') as fh:
+        writer = WARCWriter(fh, gzip=False)
+        for (uri, payload) in [('http://ex.com/a', b''),
+                               ('http://ex.com/b', b'<html></html>')]:
+            writer.write_record(writer.create_warc_record(
+                uri, 'response', payload=BytesIO(payload),
+                http_headers=http_headers))
+
+    settings.App.set('store', str(tmp_path / 'store'))
+    try:
+        plain = index_lines(warc_path)
+        templated = index_lines(warc_path, header_templates=True)
+    finally:
+        settings.App.set('store', None)
+
+    assert [obj['original_uri'] for obj in plain] == ['http://ex.com/b']
+    assert [obj['original_uri'] for obj in templated] == ['http://ex.com/b']
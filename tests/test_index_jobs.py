@@ -0,0 +1,129 @@
+import io
+import os
+import threading
+import time
+from pathlib import Path
+from unittest import mock
+
+import pytest
+
+from ipwb import index_jobs, replay
+
+SAMPLE_WARCS = os.path.join(
+    Path(os.path.dirname(__file__)).parent, 'samples', 'warcs')
+
+
+@pytest.fixture
+def client(tmp_path):
+    replay.app.config['UPLOAD_FOLDER'] = str(tmp_path)
+    replay.app.cdxj_file_path = str(tmp_path / 'index.cdxj')
+    with mock.patch('ipwb.indexer.push_bytes_to_ipfs',
+                    side_effect=lambda b: f'Qm{len(b)}'), \
+            mock.patch.object(replay, 'upload_jobs',
+                              index_jobs.IndexJobQueue(max_queued=2)):
+        yield replay.app.test_client()
+
+    replay.app.config['UPLOAD_FOLDER'] = replay.UPLOAD_FOLDER
+
+
+def upload(client, warc):
+    with open(os.path.join(SAMPLE_WARCS, warc), 'rb') as f:
+        return client.post('/upload', data={'file': (
+            io.BytesIO(f.read()), warc)})
+
+
+def wait_for_job(client, status_url, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        status = client.get(status_url).get_json()
+        if status['status'] in (index_jobs.DONE, index_jobs.FAILED):
+            return status
+        time.sleep(0.05)
+
+    raise TimeoutError(status_url)
+
+
+def test_uploads_are_indexed_in_the_background(client):
+    responses = [upload(client, warc)
+                 for warc in ['5mementos.warc', 'salam-home.warc']]
+
+    assert [r.status_code for r in responses] == [202, 202]
+    statuses = [wait_for_job(client, r.headers['Location'])
+                for r in responses]
+    assert [s['status'] for s in statuses] == ['done', 'done']
+    assert statuses[0]['filename'].endswith('-5mementos.warc')
+    assert [s['stats']['records'] for s in statuses] == [7, 1]
+
+    with open(replay.app.cdxj_file_path) as f:
+        index_lines = [line for line in f.read().splitlines()
+                       if line[:1] != '!']
+    assert len(index_lines) == 8
+    assert client.get('/upload/status/unknown').status_code == 404
+
+
+def test_full_queue_is_refused(client):
+    indexing = threading.Event()
+    release = threading.Event()
+
+    def index_file_at(*args, **kwargs):
+        indexing.set()
+        release.wait(10)
+        raise ValueError('Not a WARC')
+
+    with mock.patch('ipwb.indexer.index_file_at', index_file_at):
+        first = upload(client, '5mementos.warc')
+        assert indexing.wait(10)
+        queued = [upload(client, '5mementos.warc') for _ in range(2)]
+        refused = upload(client, '5mementos.warc')
+
+        assert client.get(queued[1].headers['Location']).get_json()[
+            'queue_position'] == 1
+        release.set()
+        statuses = [wait_for_job(client, r.headers['Location'])
+                    for r in [first] + queued]
+
+    assert [r.status_code for r in queued] == [202, 202]
+    assert refused.status_code == 503
+    assert [s['status'] for s in statuses] == ['failed'] * 3
+    assert statuses[0]['error'] == 'Not a WARC'
+    assert len(os.listdir(replay.app.config['UPLOAD_FOLDER'])) == 3
+
+
+def test_form_uploads_are_redirected_to_the_page(client):
+    with open(os.path.join(SAMPLE_WARCS, '5mementos.warc'), 'rb') as f:
+        response = client.post(
+            '/upload', data={'file': (io.BytesIO(f.read()), '5mementos.warc')},
+            headers={'Accept': 'text/html,application/xhtml+xml,*/*;q=0.8',
+                     'Referer': 'http://localhost/ipwbadmin'})
+
+    assert response.status_code == 302
+    assert response.headers['Location'] == 'http://localhost/ipwbadmin'
+
+    # The job is queued all the same
+    replay.upload_jobs.queue.join()
+    assert os.path.exists(replay.app.cdxj_file_path)
+
+
+def test_progress_is_reported_while_indexing(client):
+    pushing = threading.Event()
+    release = threading.Event()
+
+    def push(bytes_in):
+        pushing.set()
+        release.wait(10)
+        return f'Qm{len(bytes_in)}'
+
+    with mock.patch('ipwb.indexer.push_bytes_to_ipfs', push), \
+            mock.patch('ipwb.indexer.PENDING_PUSHES_PER_JOB', 0):
+        status_url = upload(client, '5mementos.warc').headers['Location']
+        assert pushing.wait(10)
+        status = client.get(status_url).get_json()
+        release.set()
+        done = wait_for_job(client, status_url)
+
+    assert status['status'] == 'indexing'
+    progress = status['progress']
+    assert 0 < progress['warc_bytes'] < progress['warc_size']
+    assert progress['records'] == 0
+    assert done['stats']['warc_bytes'] == progress['warc_size']
+    assert 'progress' not in done
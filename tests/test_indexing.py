@@ -3,8 +3,21 @@
 import pytest
 from . import testUtil as ipwb_test
 import os
+import base64
+import io
+import json
+import zlib
+import multiprocessing
 
-from ipwb import indexer
+from io import BytesIO
+from unittest import mock
+
+from warcio.archiveiterator import ArchiveIterator
+from warcio.statusandheaders import StatusAndHeaders
+from warcio.warcwriter import WARCWriter
+
+from ipwb import cdxj, indexer, replay
+from ipwb.stats import IndexStats
 
 from pathlib import Path
 
@@ -29,3 +42,413 @@ def test_warc_ipwb_indexer_broken_warc_record():
 
 
 # TODO: Have unit tests for each function in indexer.py
+
+
+def test_warc_is_iterated_once():
+    warc_path = os.path.join(
+        Path(os.path.dirname(__file__)).parent,
+        'samples', 'warcs', '5mementos.warc')
+
+    with mock.patch('ipwb.indexer.push_bytes_to_ipfs', return_value='Qm'), \
+            mock.patch('ipwb.indexer.ArchiveIterator',
+                       wraps=indexer.ArchiveIterator) as archive_iterator:
+        cdxj_lines = indexer.cdx_cdxj_lines_from_file(warc_path)
+
+    assert archive_iterator.call_count == 1
+    assert len(cdxj_lines) == 7
+
+
+def test_concurrent_pushes_keep_record_order():
+    warc_path = os.path.join(
+        Path(os.path.dirname(__file__)).parent,
+        'samples', 'warcs', '5mementos.warc')
+
+    with mock.patch('ipwb.indexer.push_bytes_to_ipfs',
+                    side_effect=lambda b: f'Qm{len(b)}'):
+        serial = indexer.cdx_cdxj_lines_from_file(warc_path, jobs=1)
+        concurrent = indexer.cdx_cdxj_lines_from_file(warc_path, jobs=4)
+
+    assert concurrent == serial
+
+
+def mock_ipfs_add(*files):
+    return [{'Name': f.name, 'Hash': f'Qm{len(f.getvalue())}'} for f in files]
+
+
+@pytest.mark.parametrize('batch_size,batch_bytes', [
+    (2, indexer.DEFAULT_BATCH_BYTES),
+    (4, indexer.DEFAULT_BATCH_BYTES),
+    (100, indexer.DEFAULT_BATCH_BYTES),
+    (100, 1),
+])
+def test_batched_pushes_match_single_pushes(batch_size, batch_bytes):
+    warc_path = os.path.join(
+        Path(os.path.dirname(__file__)).parent,
+        'samples', 'warcs', '5mementos.warc')
+
+    client = mock.MagicMock()
+    client.return_value.add.side_effect = mock_ipfs_add
+    with mock.patch('ipwb.indexer.push_bytes_to_ipfs',
+                    side_effect=lambda b: f'Qm{len(b)}'), \
+            mock.patch('ipwb.content_store.ipfs_client', client):
+        single = indexer.cdx_cdxj_lines_from_file(warc_path)
+        batched = indexer.cdx_cdxj_lines_from_file(
+            warc_path, jobs=2, batch_size=batch_size, batch_bytes=batch_bytes)
+
+    assert batched == single
+    if batch_size > 2 and batch_bytes > 1:
+        assert client.return_value.add.call_count < len(single)
+
+
+@pytest.mark.skipif(multiprocessing.get_start_method() != 'fork',
+                    reason='Workers must inherit the mocked IPFS push')
+def test_process_pool_matches_serial_indexing():
+    warc_paths = [os.path.join(
+        Path(os.path.dirname(__file__)).parent, 'samples', 'warcs', warc)
+        for warc in ['5mementos.warc', 'salam-home.warc', '2mementos.warc']]
+
+    with mock.patch('ipwb.indexer.push_bytes_to_ipfs',
+                    side_effect=lambda b: f'Qm{len(b)}'):
+        serial = indexer.index_file_at(warc_paths, quiet=True)
+        parallel = indexer.index_file_at(warc_paths, quiet=True, processes=2)
+
+    # Ignore the !meta line, it contains the time of indexing
+    assert parallel[0] == serial[0]
+    assert parallel[2:] == serial[2:]
+    assert parallel[2:] == sorted(set(parallel[2:]))
+
+
+def index_to_file(warc_filenames, outfile, **kwargs):
+    warc_paths = [os.path.join(
+        Path(os.path.dirname(__file__)).parent, 'samples', 'warcs', warc)
+        for warc in warc_filenames]
+
+    with mock.patch('ipwb.indexer.push_bytes_to_ipfs',
+                    side_effect=lambda b: f'Qm{len(b)}'):
+        indexer.index_file_at(warc_paths, outfile=outfile, **kwargs)
+
+    with open(outfile) as f:
+        return f.read().splitlines()
+
+
+def test_outfile_is_merged_with_new_lines(tmp_path):
+    outfile = str(tmp_path / 'index.cdxj')
+
+    first = index_to_file(['5mementos.warc'], outfile)
+    merged = index_to_file(['salam-home.warc', '5mementos.warc'], outfile)
+    both = index_to_file(['5mementos.warc', 'salam-home.warc'],
+                         str(tmp_path / 'both.cdxj'))
+
+    assert len(merged) == len(first) + 1
+    assert merged[2:] == both[2:]
+    assert sorted(os.listdir(tmp_path)) == ['both.cdxj', 'index.cdxj']
+
+
+def test_unsorted_outfile_is_sorted_on_merge(tmp_path):
+    outfile = str(tmp_path / 'index.cdxj')
+    sorted_lines = index_to_file(['5mementos.warc'], outfile)
+    unsorted_lines = sorted_lines[:2] + sorted_lines[:1:-1]
+
+    with open(outfile, 'w') as f:
+        f.write('\n'.join(unsorted_lines) + '\n')
+
+    merged = index_to_file(['salam-home.warc'], outfile)
+
+    assert len(merged) == len(sorted_lines) + 1
+    assert merged[2:] == sorted(merged[2:])
+
+
+def test_sharded_outfile_is_merged(tmp_path):
+    outfile = str(tmp_path / 'index.cdxj')
+    warcs = ['5mementos.warc', 'salam-home.warc', 'mkelly1.warc',
+             'redirect.warc']
+    index_to_file(warcs[:2], str(tmp_path / 'plain.cdxj'))
+    plain = index_to_file(warcs[2:], str(tmp_path / 'plain.cdxj'))
+
+    index_to_file(warcs[:2], outfile, shards=3)
+    # Later runs keep the index sharded
+    index_to_file(warcs[2:], outfile)
+
+    manifest = cdxj.read_cdxj_manifest(outfile)
+    assert manifest['shard_count'] == len(manifest['shards']) == 3
+    assert manifest['line_count'] == len(plain) - 2
+
+    sharded = []
+    for shard_path in cdxj.cdxj_shard_paths(outfile, manifest):
+        with open(shard_path) as f:
+            sharded += [line for line in f.read().splitlines()
+                        if line[:1] != '!']
+    assert sharded == plain[2:]
+
+    for line in plain[2:]:
+        assert replay.get_cdxj_line_binary_search(
+            ' '.join(line.split(' ', 2)[:2]), outfile) == line
+
+
+def test_streamed_stdin_lines_are_sorted_later(tmp_path, capsys):
+    warc_path = os.path.join(
+        Path(os.path.dirname(__file__)).parent, 'samples', 'warcs',
+        '5mementos.warc')
+    outfile = str(tmp_path / 'index.cdxj')
+    plain = index_to_file(['5mementos.warc'], str(tmp_path / 'plain.cdxj'))
+
+    with open(warc_path, 'rb') as warc, \
+            mock.patch('sys.stdin', io.TextIOWrapper(warc)), \
+            mock.patch('ipwb.indexer.push_bytes_to_ipfs',
+                       side_effect=lambda b: f'Qm{len(b)}'):
+        indexer.index_file_at(indexer.STDIN_PATH, stream=True)
+    streamed = capsys.readouterr().out.splitlines()
+
+    # Lines are written in the order of the records in the WARC
+    assert streamed[2:] != plain[2:]
+    assert sorted(streamed[2:]) == plain[2:]
+
+    with open(outfile, 'w') as f:
+        f.write('\n'.join(streamed) + '\n')
+    indexer.sort_cdxj_files([outfile], outfile=outfile)
+    with open(outfile) as f:
+        assert f.read().splitlines()[2:] == plain[2:]
+
+
+def test_stdin_is_indexed_with_other_warcs_by_processes():
+    warc_dir = os.path.join(
+        Path(os.path.dirname(__file__)).parent, 'samples', 'warcs')
+
+    with mock.patch('ipwb.indexer.push_bytes_to_ipfs',
+                    side_effect=lambda b: f'Qm{len(b)}'):
+        both = indexer.index_file_at(
+            [os.path.join(warc_dir, 'salam-home.warc'),
+             os.path.join(warc_dir, '5mementos.warc')], quiet=True)
+        with open(os.path.join(warc_dir, 'salam-home.warc'), 'rb') as warc, \
+                mock.patch('sys.stdin', io.TextIOWrapper(warc)):
+            piped = indexer.index_file_at(
+                [indexer.STDIN_PATH, os.path.join(warc_dir, '5mementos.warc')],
+                quiet=True, processes=2, split_warcs=True)
+
+    assert piped[2:] == both[2:]
+
+
+def write_deduplicated_warc(warc_path):
+    payload = b'<html><head><title>Dedup</title></head></html>'
+    http_headers = StatusAndHeaders(
+        '200 OK', [('Content-Type', 'text/html')], protocol='HTTP/1.1')
+
+    with open(warc_path, 'wb') as fh:
+        writer = WARCWriter(fh, gzip=False)
+        for (uri, date) in [('http://example.com/', '2020-01-01T00:00:00Z'),
+                            ('http://example.com/copy',
+                             '2020-01-02T00:00:00Z')]:
+            writer.write_record(writer.create_warc_record(
+                uri, 'response', payload=BytesIO(payload),
+                http_headers=http_headers,
+                warc_headers_dict={'WARC-Date': date}))
+
+        revisit = writer.create_revisit_record(
+            'http://example.com/', writer.create_warc_record(
+                'http://example.com/', 'response',
+                payload=BytesIO(payload), http_headers=http_headers,
+            ).rec_headers.get_header('WARC-Payload-Digest'),
+            'http://example.com/', '2020-01-01T00:00:00Z',
+            http_headers=StatusAndHeaders(
+                '200 OK', [('Content-Type', 'text/html'),
+                           ('X-Revisit', 'yes')], protocol='HTTP/1.1'))
+        revisit.rec_headers.replace_header('WARC-Date', '2020-01-03T00:00:00Z')
+        writer.write_record(revisit)
+
+
+@pytest.mark.skipif(multiprocessing.get_start_method() != 'fork',
+                    reason='Workers must inherit the mocked IPFS push')
+def test_revisits_of_later_warcs_are_indexed(tmp_path):
+    original_path = str(tmp_path / 'a.warc')
+    revisit_path = str(tmp_path / 'b.warc')
+    write_deduplicated_warc(original_path)
+    # Only the revisit, of the payload of the records in a.warc
+    with open(original_path, 'rb') as fh, open(revisit_path, 'wb') as out:
+        writer = WARCWriter(out, gzip=False)
+        for record in ArchiveIterator(fh):
+            if record.rec_type == 'revisit':
+                writer.write_record(record)
+
+    with mock.patch('ipwb.indexer.push_bytes_to_ipfs',
+                    side_effect=lambda b: f'Qm{len(b)}'):
+        serial = indexer.index_file_at(
+            [revisit_path, original_path], quiet=True)
+        parallel = indexer.index_file_at(
+            [revisit_path, original_path], quiet=True, processes=2)
+        streamed = list(indexer.iter_cdxj_lines_from_files(
+            [revisit_path, original_path], IndexStats(), {}))
+
+    assert parallel[2:] == serial[2:]
+    assert sorted(set(streamed)) == serial[2:]
+    assert len(serial[2:]) == 3
+
+
+@pytest.mark.parametrize('batch_size', [1, 10])
+def test_revisits_and_duplicates_reuse_payloads(tmp_path, batch_size):
+    warc_path = str(tmp_path / 'dedup.warc')
+    write_deduplicated_warc(warc_path)
+
+    push = mock.MagicMock(side_effect=lambda b: f'Qm{len(b)}')
+    client = mock.MagicMock()
+    client.return_value.add.side_effect = mock_ipfs_add
+    payload_cids = {}
+    with mock.patch('ipwb.indexer.push_bytes_to_ipfs', push), \
+            mock.patch('ipwb.content_store.ipfs_client', client):
+        cdxj_lines = indexer.cdx_cdxj_lines_from_file(
+            warc_path, batch_size=batch_size, payload_cids=payload_cids)
+
+    assert [line.split(' ')[1] for line in cdxj_lines] == \
+        ['20200101000000', '20200102000000', '20200103000000']
+
+    locators = [json.loads(line.split(' ', 2)[2])['locator']
+                for line in cdxj_lines]
+    payload_hashes = {locator.split('/')[-1] for locator in locators}
+    assert payload_hashes == {'Qm46'}
+    assert locators[2].split('/')[-2] != locators[0].split('/')[-2]
+    assert json.loads(cdxj_lines[2].split(' ', 2)[2])['title'] == 'Dedup'
+
+    pushed = [call.args[0] for call in push.call_args_list] + \
+        [f.getvalue() for call in client.return_value.add.call_args_list
+         for f in call.args]
+    assert len(pushed) == 4  # Three headers and a single payload
+
+    # Only the hash and title of payloads are kept once they are pushed
+    assert list(payload_cids.values()) == [('Qm46', 'Dedup')]
+
+
+def mock_ipfs_add_stream(file):
+    return {'Hash': f'Qm{len(file.read())}'}
+
+
+def test_large_payloads_are_streamed(tmp_path):
+    warc_path = os.path.join(
+        Path(os.path.dirname(__file__)).parent,
+        'samples', 'warcs', '5mementos.warc')
+
+    client = mock.MagicMock()
+    client.return_value.add.side_effect = mock_ipfs_add_stream
+    with mock.patch('ipwb.indexer.push_bytes_to_ipfs',
+                    side_effect=lambda b: f'Qm{len(b)}'), \
+            mock.patch('ipwb.content_store.ipfs_client', client), \
+            mock.patch('ipwb.indexer.STREAM_CHUNK_SIZE', 16):
+        in_memory = indexer.cdx_cdxj_lines_from_file(warc_path)
+        streamed = indexer.cdx_cdxj_lines_from_file(
+            warc_path, stream_threshold=0)
+
+    assert client.return_value.add.called
+    assert streamed == in_memory
+
+
+@pytest.mark.parametrize('encryption_format', indexer.ENCRYPTION_FORMATS)
+@pytest.mark.parametrize('encrypt_then_compress', [True, False])
+def test_streamed_transforms_are_reversible(encrypt_then_compress,
+                                            encryption_format):
+    hstr = 'HTTP/1.1 200 OK\r\nContent-Type: text/plain'
+    payload = bytes(range(256)) * 100
+    chunks = [payload[i:i + 1000] for i in range(0, len(payload), 1000)]
+    enc_comp_opts = {
+        'encryption_key': 'ipwb',
+        'encryption_format': encryption_format,
+        'compression_level': 6,
+        'encrypt_THEN_compress': encrypt_then_compress
+    }
+
+    (hstr_out, payload_chunks, nonce) = indexer.encrypt_and_compress_stream(
+        hstr, chunks, **enc_comp_opts)
+    payload_out = b''.join(payload_chunks)
+
+    if encrypt_then_compress:
+        hstr_out = zlib.decompress(hstr_out)
+        payload_out = zlib.decompress(payload_out)
+
+    (hstr_out, payload_out) = indexer.decrypt(
+        hstr_out, payload_out, 'ipwb', nonce, encryption_format)
+    if not encrypt_then_compress:
+        hstr_out = zlib.decompress(hstr_out)
+        payload_out = zlib.decompress(payload_out)
+
+    assert hstr_out == hstr.encode()
+    assert payload_out == payload
+
+
+def test_raw_ciphertext_is_not_inflated():
+    payload = bytes(range(256)) * 100
+    enc_comp_opts = {'encryption_key': 'ipwb'}
+
+    (_, raw, nonce) = indexer.encrypt_and_compress(
+        'HTTP/1.1 200 OK', payload, **enc_comp_opts,
+        encryption_format=indexer.ENCRYPTION_FORMAT_RAW)
+    (_, encoded, _) = indexer.encrypt_and_compress(
+        'HTTP/1.1 200 OK', payload, **enc_comp_opts,
+        encryption_format=indexer.ENCRYPTION_FORMAT_BASE64)
+
+    assert len(raw) == len(payload)
+    assert len(encoded) == len(base64.b64encode(payload))
+
+
+def test_encrypted_records_record_their_format():
+    warc_path = os.path.join(
+        Path(os.path.dirname(__file__)).parent,
+        'samples', 'warcs', 'salam-home.warc')
+
+    with mock.patch('ipwb.indexer.push_bytes_to_ipfs',
+                    side_effect=lambda b: f'Qm{len(b)}'):
+        [cdxj_line] = indexer.cdx_cdxj_lines_from_file(
+            warc_path, encryption_key='ipwb',
+            encryption_format=indexer.ENCRYPTION_FORMAT_RAW)
+        [legacy_cdxj_line] = indexer.cdx_cdxj_lines_from_file(
+            warc_path, encryption_key='ipwb',
+            encryption_format=indexer.ENCRYPTION_FORMAT_BASE64)
+
+    obj = json.loads(cdxj_line.split(' ', 2)[2])
+    legacy_obj = json.loads(legacy_cdxj_line.split(' ', 2)[2])
+    assert obj['encryption_format'] == indexer.ENCRYPTION_FORMAT_RAW
+    assert legacy_obj['encryption_format'] == indexer.ENCRYPTION_FORMAT_BASE64
+
+    payload_size = int(obj['locator'].split('/')[-1][2:])
+    legacy_payload_size = int(legacy_obj['locator'].split('/')[-1][2:])
+    assert legacy_payload_size == len(base64.b64encode(b'x' * payload_size))
+
+
+@pytest.mark.parametrize('payload,title', [
+    (b'<html><head><title>A Title</title></head></html>', 'A Title'),
+    (b'<TITLE lang="en">\n  Spread\n  Out </TITLE>', 'Spread Out'),
+    (b'<title>Fish &amp; Chips &#8212; Menu</title>', 'Fish & Chips — Menu'),
+    (b'<title></title><body>', None),
+    (b'<html><body><p>No title</p></body></html>', None),
+])
+def test_title_scan_matches_full_parse(payload, title):
+    record = mock.MagicMock()
+    record.http_headers.get_header.return_value = 'text/html'
+
+    assert indexer.scan_for_title(payload) == (True, title)
+    with mock.patch('ipwb.indexer.TITLE_SCAN_BYTES', 0):
+        assert indexer.extract_title(record, payload) == title
+
+
+def test_title_scan_is_bounded():
+    long_head = b'<head><script>' + b' ' * indexer.TITLE_SCAN_BYTES
+    payload = long_head + b'</script><title>Late</title></head>'
+    body_first = b'<body>' + b' ' * indexer.TITLE_SCAN_BYTES + b'<title>'
+
+    record = mock.MagicMock()
+    record.http_headers.get_header.return_value = 'text/html; charset=utf-8'
+
+    assert indexer.scan_for_title(payload) == (False, None)
+    assert indexer.extract_title(record, payload) == 'Late'
+    assert indexer.scan_for_title(body_first) == (True, None)
+
+
+def test_titles_can_be_skipped():
+    warc_path = os.path.join(
+        Path(os.path.dirname(__file__)).parent,
+        'samples', 'warcs', 'salam-home.warc')
+
+    with mock.patch('ipwb.indexer.push_bytes_to_ipfs',
+                    side_effect=lambda b: f'Qm{len(b)}'):
+        with_titles = indexer.cdx_cdxj_lines_from_file(warc_path)
+        without_titles = indexer.cdx_cdxj_lines_from_file(
+            warc_path, titles=False)
+
+    assert any('"title"' in line for line in with_titles)
+    assert not any('"title"' in line for line in without_titles)
@@ -0,0 +1,90 @@
+import os
+import shutil
+import time
+from pathlib import Path
+from unittest import mock
+
+from ipwb import ingest
+
+SAMPLE_WARCS = os.path.join(
+    Path(os.path.dirname(__file__)).parent, 'samples', 'warcs')
+
+
+def spool(spool_dir, warc, age=60):
+    """Put a sample WARC in the spool, last modified `age` seconds ago"""
+    warc_path = shutil.copy(os.path.join(SAMPLE_WARCS, warc), spool_dir)
+    mtime = time.time() - age
+    os.utime(warc_path, (mtime, mtime))
+
+    return warc_path
+
+
+def read_index(index_path):
+    with open(index_path) as f:
+        return [line for line in f.read().splitlines() if line[:1] != '!']
+
+
+def test_closed_warcs(tmp_path):
+    closed = spool(tmp_path, '5mementos.warc')
+    spool(tmp_path, 'salam-home.warc', age=0)
+    os.rename(spool(tmp_path, '2mementos.warc'),
+              tmp_path / '2mementos.warc.open')
+    os.rename(spool(tmp_path, 'mkelly1.warc'), tmp_path / '.mkelly1.warc')
+
+    assert ingest.closed_warcs(tmp_path, settle_seconds=30) == [closed]
+
+
+def test_warcs_are_merged_in_batches_once(tmp_path):
+    spool_dir = tmp_path / 'spool'
+    spool_dir.mkdir()
+    index_path = str(tmp_path / 'index.cdxj')
+    for warc in ['5mementos.warc', 'salam-home.warc', 'mkelly1.warc']:
+        spool(spool_dir, warc)
+
+    index_file_at = mock.MagicMock(wraps=ingest.indexer.index_file_at)
+    with mock.patch('ipwb.indexer.push_bytes_to_ipfs',
+                    side_effect=lambda b: f'Qm{len(b)}'), \
+            mock.patch('ipwb.indexer.index_file_at', index_file_at):
+        ingest.ingest(spool_dir, index_path, batch_warcs=2, once=True)
+        first = read_index(index_path)
+        assert [len(args[0]) for (args, _) in
+                index_file_at.call_args_list] == [2, 1]
+
+        # Only WARCs not merged before are indexed
+        ingest.ingest(spool_dir, index_path, once=True)
+        assert index_file_at.call_count == 2
+
+        spool(spool_dir, 'redirect.warc')
+        ingest.ingest(spool_dir, index_path, once=True)
+        assert index_file_at.call_count == 3
+
+    assert len(first) == 7 + 1 + 2
+    assert len(read_index(index_path)) == len(first) + 1
+    assert len(ingest.read_ingested(index_path)) == 4
+    assert sorted(os.listdir(tmp_path)) == [
+        'index.cdxj', 'index.cdxj.ingested', 'spool']
+
+
+def test_warc_removed_mid_batch_is_dropped(tmp_path):
+    spool_dir = tmp_path / 'spool'
+    spool_dir.mkdir()
+    index_path = str(tmp_path / 'index.cdxj')
+    removed = spool(spool_dir, '5mementos.warc')
+    spool(spool_dir, 'salam-home.warc')
+
+    def remove_then_index(warc_paths, **kwargs):
+        if os.path.exists(removed):
+            os.remove(removed)
+        return index_file_at(warc_paths, **kwargs)
+
+    index_file_at = ingest.indexer.index_file_at
+    with mock.patch('ipwb.indexer.push_bytes_to_ipfs',
+                    side_effect=lambda b: f'Qm{len(b)}'), \
+            mock.patch('ipwb.indexer.index_file_at',
+                       side_effect=remove_then_index) as merge:
+        ingest.ingest(spool_dir, index_path, once=True)
+
+    assert merge.call_count == 2
+    assert len(read_index(index_path)) == 1
+    assert [path for (path, _, _) in ingest.read_ingested(index_path)] == [
+        str(spool_dir / 'salam-home.warc')]
@@ -0,0 +1,86 @@
+import os
+from unittest import mock
+
+import pytest
+
+from ipwb import indexer
+from ipwb.journal import IndexJournal, default_journal_dir, journal_path
+
+from .test_indexing import write_deduplicated_warc
+
+
+def test_journal_discards_entries_after_last_checkpoint(tmp_path):
+    journal_path = str(tmp_path / 'warc.journal')
+
+    with IndexJournal(journal_path) as journal:
+        journal.add('a 1 {}', 100, payload=('sha1:A', 'QmA', 'A'))
+        journal.checkpoint()
+        journal.add('b 2 {}', 200, payload=('sha1:B', 'QmB', None))
+
+    with open(journal_path, 'a') as f:
+        f.write('c 3 {}\n@checkpoint {"off')  # Torn by a crash
+
+    with IndexJournal(journal_path) as journal:
+        assert journal.offset == 200
+        assert journal.payloads == {'sha1:A': ('QmA', 'A'),
+                                    'sha1:B': ('QmB', None)}
+        assert list(journal.cdxj_lines()) == ['a 1 {}', 'b 2 {}']
+
+    with open(journal_path) as f:
+        assert f.read().splitlines()[-1] == '@checkpoint {"offset": 200}'
+
+
+def test_interrupted_run_is_resumed(tmp_path):
+    warc_path = str(tmp_path / 'dedup.warc')
+    write_deduplicated_warc(warc_path)
+    outfile = str(tmp_path / 'index.cdxj')
+
+    def index(push, resume=False):
+        with mock.patch('ipwb.indexer.push_bytes_to_ipfs', push):
+            indexer.index_file_at(warc_path, outfile=outfile, resume=resume)
+
+        with open(outfile) as f:
+            return f.read().splitlines()
+
+    # Crash on reaching the revisit record, with no pushes still pending
+    transform = mock.MagicMock(side_effect=[
+        indexer.encrypt_and_compress, indexer.encrypt_and_compress,
+        KeyboardInterrupt])
+    with pytest.raises(KeyboardInterrupt), \
+            mock.patch('ipwb.indexer.PENDING_PUSHES_PER_JOB', 0), \
+            mock.patch('ipwb.indexer.encrypt_and_compress',
+                       lambda *args, **kwargs: transform()(*args, **kwargs)):
+        index(mock.MagicMock(side_effect=lambda b: f'Qm{len(b)}'))
+    assert os.path.exists(default_journal_dir(outfile))
+
+    push = mock.MagicMock(side_effect=lambda b: f'Qm{len(b)}')
+    resumed = index(push, resume=True)
+    assert push.call_count == 1  # Only the header of the revisit
+    assert not os.path.exists(default_journal_dir(outfile))
+
+    os.remove(outfile)
+    uninterrupted = index(mock.MagicMock(side_effect=lambda b: f'Qm{len(b)}'))
+    assert resumed[2:] == uninterrupted[2:]
+    assert len(resumed) == 5
+
+
+def test_deferred_revisits_are_journaled(tmp_path):
+    warc_path = str(tmp_path / 'dedup.warc')
+    write_deduplicated_warc(warc_path)
+    journal_dir = str(tmp_path / 'journal')
+    os.makedirs(journal_dir)
+
+    with IndexJournal(journal_path(journal_dir, warc_path)) as journal:
+        journal.add_deferred(100)
+        journal.checkpoint(os.path.getsize(warc_path))
+
+    with open(journal_path(journal_dir, warc_path), 'a') as f:
+        f.write('@deferred {"offset": 200}\n')  # Not checkpointed
+
+    # Resuming the run defers the revisits journaled before the crash again
+    deferred_revisits = []
+    lines = list(indexer.iter_cdxj_lines_from_file(
+        warc_path, journal_dir=journal_dir,
+        deferred_revisits=deferred_revisits))
+    assert lines == []
+    assert deferred_revisits == [(warc_path, 100)]
@@ -0,0 +1,78 @@
+import os
+from pathlib import Path
+from unittest import mock
+
+import pytest
+from warcio.archiveiterator import ArchiveIterator
+
+from ipwb import indexer
+from ipwb.record_filter import RecordFilter, parse_filter
+
+SAMPLE_WARC = os.path.join(
+    Path(os.path.dirname(__file__)).parent, 'samples', 'warcs',
+    'IAH-20080430204825-00000-blackbook.warc.gz')
+
+
+def response_records():
+    with open(SAMPLE_WARC, 'rb') as fh:
+        for record in ArchiveIterator(fh):
+            if record.rec_type == 'response' and record.http_headers:
+                yield record
+
+
+@pytest.mark.parametrize('spec', [
+    'uri', 'host:example.com', 'uri:(', 'status:20', 'status:abc',
+    'size:1MB'])
+def test_invalid_filters(spec):
+    with pytest.raises(ValueError):
+        parse_filter(spec)
+
+
+def test_filters_match_headers():
+    record_filter = RecordFilter(
+        include=[parse_filter('mime:image/'), parse_filter('status:3xx')],
+        exclude=[parse_filter('size:1000')])
+    matched = 0
+    for record in response_records():
+        status = record.http_headers.get_statuscode()
+        mime = record.http_headers.get_header('content-type') or ''
+        expected = (mime.lower().startswith('image/') or
+                    status.startswith('3')) and record.payload_length > 1000
+        assert record_filter.matches(record) == expected
+        matched += expected
+
+    assert matched > 0
+
+
+def test_surt_and_uri_filters():
+    record = next(response_records())
+    uri = record.rec_headers.get_header('WARC-Target-URI')
+    assert RecordFilter([parse_filter(f'uri:^{uri}$')]).matches(record)
+    assert not RecordFilter(
+        exclude=[parse_filter('surt:')]).matches(record)
+    assert not RecordFilter([parse_filter('surt:org,example)')]).matches(
+        record)
+
+
+def test_filtered_payloads_are_not_read_or_pushed():
+    push = mock.MagicMock(side_effect=lambda b: f'Qm{len(b)}')
+    with mock.patch('ipwb.indexer.push_bytes_to_ipfs', push):
+        all_lines = indexer.index_file_at(SAMPLE_WARC, quiet=True)
+        all_pushes = push.call_count
+        push.reset_mock()
+
+        with mock.patch('warcio.recordloader.ArcWarcRecord.content_stream',
+                        autospec=True,
+                        side_effect=lambda record: record.raw_stream) as read:
+            html_lines = indexer.index_file_at(
+                SAMPLE_WARC, quiet=True,
+                include=[parse_filter('mime:text/html')],
+                exclude=[parse_filter('status:404')])
+
+    html_lines = html_lines[2:]
+    assert 0 < len(html_lines) < len(all_lines[2:])
+    assert all('"mime_type": "text/html' in line for line in html_lines)
+    assert all('"status_code": "404"' not in line for line in html_lines)
+    # Payloads of duplicates are not read either
+    assert 0 < read.call_count <= len(html_lines)
+    assert push.call_count < all_pushes
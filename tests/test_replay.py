@@ -1,7 +1,11 @@
 import pytest
 
+import os
+from pathlib import Path
+from unittest import mock
+
 from . import testUtil as ipwb_test
-from ipwb import replay
+from ipwb import indexer, replay, settings
 
 from time import sleep
 
@@ -250,3 +254,29 @@ def test_is_uri(expected, input):
 
 
 # TODO: Have unit tests for each function in replay.py
+
+
+def test_replay_with_store_needs_no_ipfs_repo(tmp_path, monkeypatch):
+    monkeypatch.delenv('IPFS_PATH', raising=False)
+    monkeypatch.setenv('HOME', str(tmp_path))
+    index_path = str(tmp_path / 'index.cdxj')
+
+    settings.App.set('store', str(tmp_path / 'store'))
+    try:
+        indexer.index_file_at(os.path.join(
+            Path(os.path.dirname(__file__)).parent, 'samples', 'warcs',
+            'salam-home.warc'), outfile=index_path)
+        with mock.patch.object(replay.app, 'run') as run:
+            replay.start(index_path)
+        assert run.called
+
+        replay.app.proxy = None
+        response = replay.app.test_client().get(
+            '/memento/20160305192247/http://www.cs.odu.edu/~salam/')
+    finally:
+        settings.App.set('store', None)
+        settings.App.set('replay_config', None)
+
+    assert response.status_code == 200
+    assert b'Sawood Alam' in response.data
+    assert not os.path.exists(tmp_path / '.ipfs')
@@ -0,0 +1,56 @@
+import json
+from unittest import mock
+
+from ipwb import indexer
+from ipwb.stats import IndexStats, ProgressReporter
+
+from .test_indexing import write_deduplicated_warc
+
+
+def test_nested_stages_are_timed_separately():
+    stats = IndexStats()
+    with mock.patch('ipwb.stats.time.perf_counter',
+                    side_effect=[0.0, 1.0, 3.0, 4.0]):
+        with stats.timer('push'):
+            with stats.timer('parse'):
+                pass
+
+    assert stats.stage_seconds['push'] == 2.0
+    assert stats.stage_seconds['parse'] == 2.0
+
+
+def test_progress_is_throttled(capsys):
+    with mock.patch('ipwb.stats.time.monotonic',
+                    side_effect=[0.0, 0.1, 0.2, 0.3, 0.7, 0.8]):
+        progress = ProgressReporter('Indexing', 100, interval=0.5)
+        for done in (10, 20, 30, 70):
+            progress.update(done, done // 10)
+        progress.update(100, 10, force=True)
+        progress.finish()
+
+    lines = capsys.readouterr().err.split('\r')
+    assert [line.split(' (')[0].strip() for line in lines[:-1]] == [
+        'Indexing: 10%', 'Indexing: 70%', 'Indexing: 100%',
+        'Indexing complete']
+
+
+def test_stats_are_written_as_json(tmp_path):
+    warc_path = str(tmp_path / 'dedup.warc')
+    write_deduplicated_warc(warc_path)
+    stats_path = str(tmp_path / 'stats.json')
+
+    push = mock.MagicMock(side_effect=lambda b: f'Qm{len(b)}')
+    with mock.patch('ipwb.indexer.push_bytes_to_ipfs', push):
+        cdxj_lines = indexer.index_file_at(
+            warc_path, quiet=True, stats_json=stats_path)
+
+    with open(stats_path) as f:
+        stats = json.load(f)
+
+    assert stats['records'] == len(cdxj_lines) - 2 == 3
+    assert stats['warcs'] == 1
+    assert stats['pushed_objects'] == push.call_count == 4
+    assert stats['pushed_bytes'] == sum(
+        len(call.args[0]) for call in push.call_args_list)
+    assert set(stats['stage_seconds']) == {
+        'parse', 'titles', 'encryption', 'compression', 'push'}
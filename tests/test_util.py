@@ -47,3 +47,45 @@ def test_pad_digits14(expected, input):
 def test_pad_digits14_inalid(input):
     with pytest.raises(ValueError):
         util.pad_digits14(input, validate=True)
+
+
+@pytest.mark.parametrize('digits14', [
+    '20181126134257', '19700101000000', '99991231235959', '20200229120000',
+    '09991231235959', '2018112613425', '20180230000000', '20181301000000',
+    '2018112613425x', '20181126 34257',
+])
+def test_digits14_to_rfc1123_matches_strptime(digits14):
+    assert_same_result(util.digits14_to_rfc1123,
+                       util.strptime_digits14_to_rfc1123, digits14)
+
+
+@pytest.mark.parametrize('rfc1123', [
+    'Mon, 26 Nov 2018 13:42:57 GMT', 'mon, 26 NOV 2018 13:42:57 gmt',
+    'Tue, 26 Nov 2018 13:42:57 GMT', 'Mon, 26 Nov 2018 13:42:57 UTC',
+    'Monday, 26 Nov 2018 13:42:57 GMT', 'Mon,  6 Nov 2018 13:42:57 GMT',
+    'Mon, 06 Nov 0999 13:42:57 GMT', 'Mon, 31 Nov 2018 13:42:57 GMT',
+    'Mon, 26 Nvm 2018 13:42:57 GMT', 'Mon, 26 Nov 2018 24:00:00 GMT',
+])
+def test_rfc1123_to_digits14_matches_strptime(rfc1123):
+    assert_same_result(util.rfc1123_to_digits14,
+                       util.strptime_rfc1123_to_digits14, rfc1123)
+
+
+@pytest.mark.parametrize('iso8601', [
+    '2018-11-26T13:42:57Z', '2018-1-26T13:42:57Z', '0999-11-26T13:42:57Z',
+    '2018-11-26T13:42:60Z', '2018-11-26 13:42:57Z', '2018-11-26T13:42:57',
+    '2019-02-29T00:00:00Z',
+])
+def test_iso8601_to_digits14_matches_strptime(iso8601):
+    assert_same_result(util.iso8601_to_digits14,
+                       util.strptime_iso8601_to_digits14, iso8601)
+
+
+def assert_same_result(fast, slow, dtstr):
+    try:
+        expected = slow(dtstr)
+    except ValueError:
+        with pytest.raises(ValueError):
+            fast(dtstr)
+    else:
+        assert fast(dtstr) == expected
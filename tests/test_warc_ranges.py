@@ -0,0 +1,105 @@
+import multiprocessing
+from io import BytesIO
+from unittest import mock
+
+import pytest
+from warcio.statusandheaders import StatusAndHeaders
+from warcio.warcwriter import WARCWriter
+
+from ipwb import indexer
+from ipwb.warc_ranges import (
+    is_member_start, read_cdx_offsets, warc_byte_ranges)
+
+
+def write_gzipped_warc(warc_path, record_count=60):
+    """Write a WARC whose last records revisit and duplicate the first"""
+    http_headers = StatusAndHeaders(
+        '200 OK', [('Content-Type', 'text/plain')], protocol='HTTP/1.1')
+    offsets = []
+    with open(warc_path, 'wb') as fh:
+        writer = WARCWriter(fh, gzip=True)
+        records = [writer.create_warc_record(
+            f'http://example.com/{n}', 'response',
+            payload=BytesIO(f'payload {n} '.encode() * 50),
+            http_headers=http_headers,
+            warc_headers_dict={'WARC-Date': '2020-01-01T00:00:00Z'})
+            for n in range(record_count)]
+        revisit = writer.create_revisit_record(
+            'http://example.com/0',
+            records[0].rec_headers.get_header('WARC-Payload-Digest'),
+            'http://example.com/0', '2020-01-01T00:00:00Z',
+            http_headers=http_headers)
+        revisit.rec_headers.replace_header('WARC-Date', '2020-01-03T00:00:00Z')
+        records.append(revisit)
+        records.append(writer.create_warc_record(
+            'http://example.com/copy', 'response',
+            payload=BytesIO(b'payload 0 ' * 50), http_headers=http_headers,
+            warc_headers_dict={'WARC-Date': '2020-01-02T00:00:00Z'}))
+
+        for record in records:
+            offsets.append(fh.tell())
+            writer.write_record(record)
+
+    return offsets
+
+
+def test_ranges_start_at_members(tmp_path):
+    warc_path = str(tmp_path / 'ranges.warc.gz')
+    offsets = write_gzipped_warc(warc_path)
+
+    ranges = warc_byte_ranges(warc_path, 2, min_range_bytes=1024)
+    assert len(ranges) == 8
+    assert ranges[0][0] == 0
+    assert all(end == start for ((_, end), (start, _)) in
+               zip(ranges, ranges[1:]))
+    assert {start for (start, _) in ranges} <= set(offsets)
+    with open(warc_path, 'rb') as fh:
+        assert all(is_member_start(fh, start) for (start, _) in ranges)
+        assert not is_member_start(fh, ranges[1][0] + 1)
+
+    assert warc_byte_ranges(
+        warc_path, 2, offsets, min_range_bytes=1024) == ranges
+    assert warc_byte_ranges(warc_path, 2) == [(0, ranges[-1][1])]
+
+
+def test_read_cdx_offsets(tmp_path):
+    cdx_path = tmp_path / 'index.cdx'
+    cdx_path.write_text(
+        ' CDX N b a m s k r M S V g\n'
+        'com,example)/ 20200101000000 http://example.com/ text/html 200 '
+        'X - - 512 1024 /warcs/a.warc.gz\n'
+        'com,example)/ 20200102000000 http://example.com/ text/html 200 '
+        'X - - 512 0 a.warc.gz\n')
+    assert read_cdx_offsets(str(cdx_path)) == {'a.warc.gz': [0, 1024]}
+
+    cdxj_path = tmp_path / 'index.cdxj'
+    cdxj_path.write_text(
+        'com,example)/ 20200101000000 {"url": "http://example.com/", '
+        '"offset": "2048", "filename": "b.warc.gz"}\n')
+    assert read_cdx_offsets(str(cdxj_path)) == {'b.warc.gz': [2048]}
+
+
+@pytest.mark.skipif(multiprocessing.get_start_method() != 'fork',
+                    reason='Workers must inherit the mocked IPFS push')
+def test_split_warc_matches_serial_indexing(tmp_path):
+    warc_path = str(tmp_path / 'ranges.warc.gz')
+    write_gzipped_warc(warc_path)
+
+    iter_lines = mock.MagicMock(wraps=indexer.iter_cdxj_lines_from_file)
+    with mock.patch('ipwb.indexer.push_bytes_to_ipfs',
+                    side_effect=lambda b: f'Qm{len(b)}'), \
+            mock.patch('ipwb.warc_ranges.MIN_RANGE_BYTES', 1024):
+        serial = indexer.index_file_at(warc_path, quiet=True)
+        with mock.patch('ipwb.indexer.iter_cdxj_lines_from_file',
+                        iter_lines):
+            split = indexer.index_file_at(
+                warc_path, quiet=True, processes=2, split_warcs=True)
+
+    # Ignore the !meta line, it contains the time of indexing
+    assert split[0] == serial[0]
+    assert split[2:] == serial[2:]
+    assert len(serial[2:]) == 62
+
+    # The revisit is in the last range, the record it revisits in the first
+    (_, kwargs) = iter_lines.call_args
+    assert kwargs['byte_range'][1] - kwargs['byte_range'][0] == 1